@@ -0,0 +1,388 @@
+import gc
+import json
+import sys
+import time
+
+import hardware_simulator
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_REPEAT = 100
+
+_DRIVER_MODULES = ("i2c_device", "matrix_keyboard_v3", "speech_recognizer",
+                   "gd5800_mp3_serial")
+
+
+def _ticks_us():
+    # The simulator replaces the time module seen by the drivers, so this
+    # module's own reference still reads the real clock.
+    if hasattr(time, "ticks_us"):
+        return time.ticks_us()
+    return time.perf_counter_ns() // 1000
+
+
+def _elapsed_us(start):
+    if hasattr(time, "ticks_diff"):
+        return time.ticks_diff(time.ticks_us(), start)
+    return _ticks_us() - start
+
+
+def _no_op():
+    pass
+
+
+class _Allocations:
+    # With the collector off, gc.mem_alloc() on MicroPython only grows, so
+    # it counts every byte a call allocates. CPython frees objects as soon
+    # as they are dropped and tracemalloc only sees live memory, so there
+    # the most memory one call holds at once is reported instead.
+    field = "allocated_bytes" if tracemalloc is None else "peak_bytes"
+
+    def __init__(self) -> None:
+        self._overhead = 0
+        self._overhead = self.measure(_no_op, 10)
+
+    def measure(self, function, repeat):
+        gc.collect()
+        if tracemalloc is None:
+            gc.disable()
+            start = gc.mem_alloc()
+            for _ in range(repeat):
+                function()
+            allocated = gc.mem_alloc() - start
+            gc.enable()
+            return allocated / repeat
+
+        peak = 0
+        tracemalloc.start()
+        for _ in range(repeat):
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            function()
+            allocated = tracemalloc.get_traced_memory()[1] - start
+            if allocated > peak:
+                peak = allocated
+        tracemalloc.stop()
+        # What the measurement itself holds is not the call's.
+        return peak - self._overhead if peak > self._overhead else 0
+
+
+class Benchmark:
+
+    def __init__(self, simulator, repeat=_REPEAT) -> None:
+        self.simulator = simulator
+        self.repeat = repeat
+        self.results = []
+        self._allocations = _Allocations()
+
+    def measure(self, group, name, function, bus, repeat=None) -> dict:
+        repeat = self.repeat if repeat is None else repeat
+        clock = self.simulator.clock
+        function()  # warm up caches and lazily created state
+        bus.stats.reset()
+        start_us = clock.now_us
+        cpu_start = _ticks_us()
+        for _ in range(repeat):
+            function()
+        cpu_us = _elapsed_us(cpu_start)
+        result = {
+            "group": group,
+            "name": name,
+            "calls": repeat,
+            "transactions": bus.stats.transactions / repeat,
+            "bytes": bus.stats.bytes / repeat,
+            "wire_us": bus.stats.wire_us / repeat,
+            "latency_us": (clock.now_us - start_us) / repeat,
+            "cpu_us": cpu_us / repeat,
+        }
+        # Allocations are measured in a separate pass so that tracing them
+        # does not inflate the timings.
+        result[_Allocations.field] = self._allocations.measure(
+            function, repeat)
+        self.results.append(result)
+        return result
+
+    def measure_import(self, module_name) -> dict:
+        sys.modules.pop(module_name, None)
+        start = _ticks_us()
+        __import__(module_name)
+        elapsed_us = _elapsed_us(start)
+
+        def import_module():
+            sys.modules.pop(module_name, None)
+            __import__(module_name)
+
+        result = {
+            "group": "import",
+            "name": module_name,
+            "import_us": elapsed_us,
+            _Allocations.field: self._allocations.measure(import_module, 1),
+        }
+        self.results.append(result)
+        return result
+
+
+def bench_import(benchmark) -> None:
+    # Modules are imported in dependency order, each measured on its own.
+    for module_name in _DRIVER_MODULES:
+        sys.modules.pop(module_name, None)
+    for module_name in _DRIVER_MODULES:
+        benchmark.measure_import(module_name)
+
+    import gd5800_mp3_serial
+    import matrix_keyboard_v3
+    import speech_recognizer
+
+    # Constructing a driver must not touch the hardware.
+    simulator = benchmark.simulator
+    simulator.i2c.attach(
+        speech_recognizer.SpeechRecognizer.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.SpeechRecognizerModel(simulator.clock))
+    simulator.i2c.attach(
+        matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.KeypadModel(simulator.clock))
+    uart = simulator.attach_uart(1, hardware_simulator.Gd5800Model())
+    benchmark.measure("init", "SpeechRecognizer",
+                      lambda: speech_recognizer.SpeechRecognizer(
+                          simulator.i2c), simulator.i2c, 10)
+    benchmark.measure("init", "MatrixKeyboardV3",
+                      lambda: matrix_keyboard_v3.MatrixKeyboardV3(
+                          simulator.i2c), simulator.i2c, 10)
+    benchmark.measure("init", "Gd5800Mp3Serial",
+                      lambda: gd5800_mp3_serial.Gd5800Mp3Serial(0, 0), uart,
+                      10)
+
+
+def bench_i2c_device(benchmark) -> None:
+    import i2c_device
+    import transaction_trace
+
+    simulator = benchmark.simulator
+    simulator.i2c.attach(0x50, hardware_simulator.RegisterModel())
+    for repeated_start in (False, True):
+        group = "i2c_device" + ("/repeated_start" if repeated_start else "")
+        device = i2c_device.I2cDevice(simulator.i2c, 0x50, repeated_start)
+        benchmark.measure(group, "i2c_read_uint8_from",
+                          lambda: device.i2c_read_uint8_from(0x10),
+                          simulator.i2c)
+        benchmark.measure(group, "i2c_read_int16le_from",
+                          lambda: device.i2c_read_int16le_from(0x10),
+                          simulator.i2c)
+        benchmark.measure(group, "i2c_read_uint32be_from",
+                          lambda: device.i2c_read_uint32be_from(0x10),
+                          simulator.i2c)
+        benchmark.measure(group, "i2c_write_uint16le_to",
+                          lambda: device.i2c_write_uint16le_to(0x10, 1234),
+                          simulator.i2c)
+        benchmark.measure(group, "i2c_write",
+                          lambda: device.i2c_write(0x10, 1, 2, 3),
+                          simulator.i2c)
+        benchmark.measure(group, "i2c_read",
+                          lambda: device.i2c_read(4), simulator.i2c)
+
+    device.i2c_set_trace(transaction_trace.TransactionTrace())
+    benchmark.measure("i2c_device/traced", "i2c_read_uint8_from",
+                      lambda: device.i2c_read_uint8_from(0x10), simulator.i2c)
+
+
+def bench_matrix_keyboard(benchmark) -> None:
+    import matrix_keyboard_v3
+
+    simulator = benchmark.simulator
+    keypad = simulator.i2c.attach(
+        matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.KeypadModel(simulator.clock))
+    keyboard = matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c)
+    now_ms = simulator.clock.now_us // 1000
+    for i in range(10):
+        keypad.press(keyboard.KEY_5, now_ms + 100 * i, 50, 1, 5)
+
+    def update():
+        keyboard.update()
+        simulator.clock.sleep_ms(1)
+
+    benchmark.measure("matrix_keyboard_v3", "update", update, simulator.i2c,
+                      1000)
+    benchmark.measure("matrix_keyboard_v3", "pressed",
+                      lambda: keyboard.pressed(keyboard.KEY_5), simulator.i2c)
+
+    keys = tuple(1 << i for i in range(16))
+
+    def per_key_queries():
+        changes = []
+        for key in keys:
+            if keyboard.pressed(key):
+                changes.append(key)
+            if keyboard.pressing(key):
+                changes.append(key)
+            if keyboard.released(key):
+                changes.append(key)
+        return changes
+
+    def mask_queries():
+        changes = []
+        for key in keyboard.keys(keyboard.pressed_keys()):
+            changes.append(key)
+        for key in keyboard.keys(keyboard.held_keys()):
+            changes.append(key)
+        for key in keyboard.keys(keyboard.released_keys()):
+            changes.append(key)
+        return changes
+
+    keypad.key_down(keyboard.KEY_1 | keyboard.KEY_D,
+                    simulator.clock.now_us // 1000)
+    for _ in range(10):
+        update()
+    benchmark.measure("matrix_keyboard_v3", "per_key_queries",
+                      per_key_queries, simulator.i2c, 1000)
+    benchmark.measure("matrix_keyboard_v3", "mask_queries", mask_queries,
+                      simulator.i2c, 1000)
+    benchmark.measure("matrix_keyboard_v3", "chars",
+                      lambda: "".join(keyboard.chars(keyboard.held_keys())),
+                      simulator.i2c, 1000)
+
+
+def bench_keyboard_group(benchmark) -> None:
+    import matrix_keyboard_v3
+
+    simulator = benchmark.simulator
+    mux = simulator.i2c.attach(0x70, hardware_simulator.Tca9548Model())
+    for count in (1, 2, 4, 8):
+        # Keypads on separate addresses, and the same number of keypads
+        # sharing one address behind the mux. With no settle time every
+        # scan reads the bus, so the rate is bound by the wire time.
+        keyboards = []
+        muxed_keyboards = []
+        for i in range(count):
+            simulator.i2c.attach(0x20 + i,
+                                 hardware_simulator.KeypadModel(
+                                     simulator.clock))
+            mux.attach(i, 0x65,
+                       hardware_simulator.KeypadModel(simulator.clock))
+            keyboards.append(
+                matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c, 0x20 + i,
+                                                    settle_ms=0))
+            muxed_keyboards.append(
+                matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c,
+                                                    settle_ms=0))
+        for group_name, group in (
+            ("matrix_keyboard_group",
+             matrix_keyboard_v3.MatrixKeyboardGroup(keyboards)),
+            ("matrix_keyboard_group/mux",
+             matrix_keyboard_v3.MatrixKeyboardGroup(
+                 muxed_keyboards, channels=range(count))),
+        ):
+            result = benchmark.measure(group_name, "scan/%d" % count,
+                                       group.scan, simulator.i2c,
+                                       100 * count)
+            result["scan_rate_hz"] = 1000000 / (result["latency_us"] *
+                                                count)
+
+
+def bench_speech_recognizer(benchmark) -> None:
+    import speech_recognizer
+
+    simulator = benchmark.simulator
+    model = simulator.i2c.attach(
+        speech_recognizer.SpeechRecognizer.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.SpeechRecognizerModel(simulator.clock))
+    for repeated_start in (False, True):
+        group = "speech_recognizer" + ("/repeated_start"
+                                       if repeated_start else "")
+        recognizer = speech_recognizer.SpeechRecognizer(
+            simulator.i2c, repeated_start=repeated_start)
+        benchmark.measure(group, "version", recognizer.version,
+                          simulator.i2c)
+        benchmark.measure(group, "get_event", recognizer.get_event,
+                          simulator.i2c)
+        benchmark.measure(group, "poll_event", recognizer.poll_event,
+                          simulator.i2c)
+        benchmark.measure(group, "set_timeout",
+                          lambda: recognizer.set_timeout(5000),
+                          simulator.i2c)
+        benchmark.measure(group, "add_keyword",
+                          lambda: recognizer.add_keyword(1, "kai deng"),
+                          simulator.i2c, 10)
+        benchmark.measure(
+            group, "load_keywords",
+            lambda: recognizer.load_keywords({1: "kai deng"}, force=True),
+            simulator.i2c, 10)
+
+        def recognize():
+            model.script_recognition(1, 100)
+            recognizer.recognize()
+
+        benchmark.measure(group, "recognize", recognize, simulator.i2c, 10)
+
+
+def bench_gd5800(benchmark) -> None:
+    import gd5800_mp3_serial
+
+    simulator = benchmark.simulator
+    model = hardware_simulator.Gd5800Model()
+    uart = simulator.attach_uart(1, model)
+    player = gd5800_mp3_serial.Gd5800Mp3Serial(0, 0)
+    group = "gd5800_mp3_serial"
+    benchmark.measure(group, "play", player.play, uart, 10)
+    benchmark.measure(group, "status", lambda: player.status, uart, 10)
+    benchmark.measure(group, "volume", lambda: player.volume, uart, 10)
+
+    def set_volume():
+        player.volume = 20
+
+    benchmark.measure(group, "volume=", set_volume, uart, 10)
+    benchmark.measure(group, "play_combined_list",
+                      lambda: player.play_combined_list((1, 2, 3)), uart, 10)
+    player.set_state_ttl(1000, 1000, 1000, 1000)
+    benchmark.measure(group + "/state_ttl", "volume", lambda: player.volume,
+                      uart, 10)
+
+    def play_offline():
+        try:
+            player.play()
+        except gd5800_mp3_serial.Gd5800Error:
+            pass
+
+    # The first failures exhaust the retries; once the circuit breaker
+    # opens, commands fail without touching the UART.
+    model.offline = True
+    benchmark.measure(group + "/offline", "play", play_offline, uart, 10)
+    model.offline = False
+
+
+BENCHMARKS = (
+    bench_import,
+    bench_i2c_device,
+    bench_matrix_keyboard,
+    bench_keyboard_group,
+    bench_speech_recognizer,
+    bench_gd5800,
+)
+
+
+def run(benchmarks=BENCHMARKS, repeat=_REPEAT) -> dict:
+    simulator = hardware_simulator.Simulator()
+    simulator.install()
+    benchmark = Benchmark(simulator, repeat)
+    for function in benchmarks:
+        function(benchmark)
+    return {
+        "implementation": sys.implementation.name,
+        "results": benchmark.results,
+    }
+
+
+def main() -> None:
+    report = run()
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as file:
+            json.dump(report, file)
+    else:
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
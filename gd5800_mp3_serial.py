@@ -1,6 +1,13 @@
+import array
 import machine
 import select
 import struct
+import time
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 try:
     from micropython import const
@@ -10,193 +17,977 @@ except ImportError:
         return x
 
 
+_COMMAND_HEADER = const(0x7E)
+_FRAME_HEADER = const(0xAA)
+_FRAME_END = const(0xEF)
+_RX_BUFFER_SIZE = const(64)
+_UART_ID = const(1)
+_BAUDRATE = const(9600)
+_RESPONSE_TIMEOUT_MS = const(500)
+_RESPONSE_MARGIN_MS = const(20)
+_COMMAND_RETRIES = const(3)
+_BACKOFF_MS = const(10)
+_BACKOFF_MAX_MS = const(100)
+_BREAKER_THRESHOLD = const(3)
+_BREAKER_OPEN_MS = const(5000)
+_UART_BITS_PER_BYTE = const(10)
+_RESPONSE_FRAMING_BYTES = const(3)
+_NOTIFICATION_BACKLOG = const(8)
+
+_STATE_STATUS = const(0)
+_STATE_VOLUME = const(1)
+_STATE_EQUALIZER = const(2)
+_STATE_LOOP_MODE = const(3)
+_STATE_COUNT = const(4)
+_STATE_ALL = const(0x0F)
+
+_TRACE_COMMAND = const(2)
+_TRACE_RESPONSE = const(3)
+
+_STAT_COMMANDS = const(0)
+_STAT_RETRIES = const(1)
+_STAT_FAILURES = const(2)
+_STAT_TIMEOUTS = const(3)
+_STAT_FRAMING_ERRORS = const(4)
+_STAT_NACKS = const(5)
+_STAT_MISMATCHES = const(6)
+_STAT_BREAKER_TRIPS = const(7)
+_STAT_FAST_FAILURES = const(8)
+_STAT_COUNT = const(9)
+_STAT_NAMES = ("commands", "retries", "failures", "timeouts",
+               "framing_errors", "nacks", "mismatches", "breaker_trips",
+               "fast_failures")
+
+_EQUALIZER_NORMAL = const(0)
+_EQUALIZER_POP = const(1)
+_EQUALIZER_ROCK = const(2)
+_EQUALIZER_JAZZ = const(3)
+_EQUALIZER_CLASSIC = const(4)
+_EQUALIZER_BASS = const(5)
+
+_STATUS_STOPPED = const(0)
+_STATUS_PLAYING = const(1)
+_STATUS_PAUSED = const(2)
+_STATUS_INTERRUPTING_PLAYING = const(5)
+
+_LOOP_MODE_REPEAT_ALL = const(0)
+_LOOP_MODE_REPEAT_FOLDER = const(1)
+_LOOP_MODE_REPEAT_SINGLE = const(2)
+_LOOP_MODE_SHUFFLE_PLAY = const(3)
+_LOOP_MODE_SINGLE_PLAY = const(4)
+
+# The frame length byte counts itself, the command byte and two bytes
+# per track, so at most 126 tracks fit in one combined-list frame.
+_MAX_COMBINED_LIST_LENGTH = const(126)
+
+_COMMAND_PLAY = const(0x01)
+_COMMAND_PAUSE = const(0x02)
+_COMMAND_NEXT = const(0x03)
+_COMMAND_PREVIOUS = const(0x04)
+_COMMAND_VOLUME_UP = const(0x05)
+_COMMAND_VOLUME_DOWN = const(0x06)
+_COMMAND_PLAY_LOOP = const(0x07)
+_COMMAND_SHUFFLE_PLAY = const(0x08)
+_COMMAND_STOP_AND_PLAY_BACKGROUND_SOUND = const(0x09)
+_COMMAND_SHUTDOWN = const(0x0A)
+_COMMAND_RESET = const(0x0B)
+_COMMAND_STOP = const(0x0E)
+_COMMAND_RESUME_OR_PAUSE = const(0x0F)
+_COMMAND_CURRENT_PLAYING_TRACK = const(0x1A)
+_COMMAND_PLAY_BY_INDEX = const(0x41)
+_COMMAND_PLAY_SPECIFIC = const(0x42)
+_COMMAND_INTERLUDE = const(0x43)
+_COMMAND_INTERLUDE_SPECIFIC = const(0x44)
+_COMMAND_PLAY_ROOT_TRACK = const(0x45)
+_COMMAND_INTERJECT_ROOT_TRACK = const(0x46)
+_COMMAND_PLAY_COMBINED_LIST = const(0x47)
+_COMMAND_INTERJECT_COMBINED_LIST = const(0x48)
+_COMMAND_PLAY_SPECIFIED_TRACK_IN_LOOP = const(0x49)
+_COMMAND_PLAY_SPECIFIED_ROOT_TRACK = const(0x4A)
+_COMMAND_FAST_FORWARD = const(0x50)
+_COMMAND_FAST_REVERSE = const(0x51)
+
+_COMMAND_SET_VOLUME = const(0x31)
+_COMMAND_SET_EQUALIZER = const(0x32)
+_COMMAND_SET_LOOP_MODE = const(0x33)
+
+_COMMAND_GET_STATUS = const(0x10)
+_COMMAND_GET_VOLUME = const(0x11)
+_COMMAND_GET_EQUALIZER = const(0x12)
+_COMMAND_GET_MODE = const(0x13)
+
+
+class Gd5800Error(OSError):
+    pass
+
+
+class Gd5800TimeoutError(Gd5800Error):
+    pass
+
+
+class Gd5800FramingError(Gd5800Error):
+    pass
+
+
+class Gd5800NackError(Gd5800Error):
+    pass
+
+
+class Gd5800MismatchError(Gd5800Error):
+    pass
+
+
+class Gd5800OfflineError(Gd5800Error):
+    pass
+
+
+def _open_uart(uart_id, baudrate, rx_pin, tx_pin):
+    uart = machine.UART(uart_id, baudrate)
+    if rx_pin is None or tx_pin is None:
+        uart.init(baudrate, bits=8, parity=None, stop=1)
+    else:
+        uart.init(baudrate,
+                  bits=8,
+                  parity=None,
+                  stop=1,
+                  tx=tx_pin,
+                  rx=rx_pin)
+    return uart
+
+
+def _encode_command(args) -> bytearray:
+    command = bytearray(len(args) + 3)
+    command[0] = _COMMAND_HEADER
+    command[1] = len(args) + 1
+    for i in range(len(args)):
+        command[i + 2] = args[i]
+    command[-1] = _FRAME_END
+    return command
+
+
+def _check_index(index) -> None:
+    if index < 0 or index > 0xFFFF:
+        raise ValueError("index", index, "out of range (0 ~ 65535)")
+
+
+def _check_byte(name, value) -> None:
+    if value < 0 or value > 0xFF:
+        raise ValueError(name, value, "out of range (0 ~ 255)")
+
+
+def _combined_list_args(command, tracks) -> bytearray:
+    if len(tracks) == 0:
+        raise ValueError("tracks", tracks, "is empty")
+    if len(tracks) > _MAX_COMBINED_LIST_LENGTH:
+        raise ValueError("tracks", len(tracks), "longer than",
+                         _MAX_COMBINED_LIST_LENGTH)
+    args = bytearray(1 + 2 * len(tracks))
+    args[0] = command
+    for i in range(len(tracks)):
+        index = tracks[i]
+        _check_index(index)
+        args[2 * i + 1] = (index >> 8) & 0xFF
+        args[2 * i + 2] = index & 0xFF
+    return args
+
+
+def _check_volume(volume) -> None:
+    if volume < 0 or volume > 0x30:
+        raise ValueError("volume", volume, "out of range (0 ~ 48)")
+
+
+class Gd5800FrameParser:
+
+    def __init__(self, size=_RX_BUFFER_SIZE) -> None:
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._head = 0
+        self._tail = 0
+        self.errors = 0
+
+    def _compact(self) -> None:
+        head = self._head
+        if head == 0:
+            return
+        buffer = self._buffer
+        count = self._tail - head
+        for i in range(count):
+            buffer[i] = buffer[head + i]
+        self._head = 0
+        self._tail = count
+
+    def _reserve(self) -> int:
+        # Frames handed out by next_frame() are views into the buffer and
+        # are only valid until the buffer is refilled.
+        self._compact()
+        if self._tail == len(self._buffer):
+            # A full buffer without a complete frame is garbage.
+            self._tail = 0
+        return len(self._buffer) - self._tail
+
+    def feed(self, data) -> None:
+        for byte in data:
+            if self._tail == len(self._buffer):
+                self._reserve()
+            self._buffer[self._tail] = byte
+            self._tail += 1
+
+    def fill_from(self, uart) -> int:
+        available = uart.any()
+        if available <= 0:
+            return 0
+        free = self._reserve()
+        count = uart.readinto(self._view[self._tail:],
+                              available if available < free else free)
+        if count:
+            self._tail += count
+            return count
+        return 0
+
+    def reset(self) -> None:
+        self._head = 0
+        self._tail = 0
+
+    def _complete_frame_after(self, head, tail) -> int:
+        buffer = self._buffer
+        for start in range(head + 1, tail - 1):
+            if buffer[start] != _FRAME_HEADER:
+                continue
+            length = buffer[start + 1]
+            end = start + length + 1
+            if length >= 2 and end < tail and buffer[end] == _FRAME_END:
+                return start
+        return -1
+
+    def next_frame(self):
+        buffer = self._buffer
+        tail = self._tail
+        head = self._head
+        while True:
+            while head < tail and buffer[head] != _FRAME_HEADER:
+                head += 1
+            self._head = head
+            if tail - head < 2:
+                return None
+            length = buffer[head + 1]
+            end = head + length + 1
+            if length < 2 or length + 2 > len(buffer):
+                # A frame carries at least its length and command bytes.
+                self.errors += 1
+                head += 1
+                continue
+            if end >= tail:
+                # Either the frame is still arriving or its length byte is
+                # corrupt. A complete frame further on means the latter, so
+                # the stalled header must not hold that frame back.
+                later = self._complete_frame_after(head, tail)
+                if later < 0:
+                    return None
+                self.errors += 1
+                head = later
+                continue
+            if buffer[end] != _FRAME_END:
+                # Corrupt frame: resynchronize on the next header byte so a
+                # valid frame following it is not lost.
+                self.errors += 1
+                head += 1
+                continue
+            self._head = end + 1
+            return self._view[head + 2:end]
+
+
+class _Notifications:
+
+    def __init__(self, backlog) -> None:
+        self._backlog = []
+        self._backlog_size = backlog
+        self._callbacks = {}
+        self._sent_commands = bytearray(32)
+        self._held = 0
+        self._deferred = []
+        self.dropped = 0
+
+    def mark_sent(self, command) -> None:
+        self._sent_commands[command >> 3] |= 1 << (command & 7)
+
+    def sent(self, command) -> bool:
+        return self._sent_commands[command >> 3] & (1 << (command & 7)) != 0
+
+    def handle(self, frame) -> None:
+        # Frames carrying a command byte this driver has sent are (possibly
+        # late) responses; anything else was initiated by the module.
+        code = frame[0]
+        if self.sent(code):
+            return
+        frame = bytes(frame)
+        if len(self._backlog) >= self._backlog_size:
+            self._backlog.pop(0)
+            self.dropped += 1
+        self._backlog.append(frame)
+        if self._held:
+            self._deferred.append(frame)
+        else:
+            self._call(frame)
+
+    def _call(self, frame) -> None:
+        callback = self._callbacks.get(frame[0])
+        if callback is not None:
+            callback(frame)
+        callback = self._callbacks.get(None)
+        if callback is not None:
+            callback(frame)
+
+    def hold(self) -> None:
+        # Callbacks may send commands themselves, so while a command waits
+        # for its response they are deferred until release().
+        self._held += 1
+
+    def release(self) -> None:
+        self._held -= 1
+        deferred = self._deferred
+        while not self._held and deferred:
+            self._call(deferred.pop(0))
+
+    def set_callback(self, code, callback) -> None:
+        if callback is None:
+            self._callbacks.pop(code, None)
+        else:
+            self._callbacks[code] = callback
+
+    def get(self):
+        if self._backlog:
+            return self._backlog.pop(0)
+        return None
+
+
 class Gd5800Mp3Serial():
-    EQUALIZER_NORMAL: int = const(0)
-    EQUALIZER_POP: int = const(1)
-    EQUALIZER_ROCK: int = const(2)
-    EQUALIZER_JAZZ: int = const(3)
-    EQUALIZER_CLASSIC: int = const(4)
-    EQUALIZER_BASS: int = const(5)
-
-    STATUS_STOPPED: int = const(0)
-    STATUS_PLAYING: int = const(1)
-    STATUS_PAUSED: int = const(2)
-    STATUS_INTERRUPTING_PLAYING: int = const(5)
-
-    LOOP_MODE_REPEAT_ALL: int = const(0)
-    LOOP_MODE_REPEAT_FOLDER: int = const(1)
-    LOOP_MODE_REPEAT_SINGLE: int = const(2)
-    LOOP_MODE_SHUFFLE_PLAY: int = const(3)
-    LOOP_MODE_SINGLE_PLAY: int = const(4)
-
-    _COMMAND_PLAY: int = const(0x01)
-    _COMMAND_PAUSE: int = const(0x02)
-    _COMMAND_NEXT: int = const(0x03)
-    _COMMAND_PREVIOUS: int = const(0x04)
-    _COMMAND_VOLUME_UP: int = const(0x05)
-    _COMMAND_VOLUME_DOWN: int = const(0x06)
-    _COMMAND_PLAY_LOOP: int = const(0x07)
-    _COMMAND_SHUFFLE_PLAY: int = const(0x08)
-    _COMMAND_STOP_AND_PLAY_BACKGROUND_SOUND: int = const(0x09)
-    _COMMAND_SHUTDOWN: int = const(0x0A)
-    _COMMAND_RESET: int = const(0x0B)
-    _COMMAND_STOP: int = const(0x0E)
-    _COMMAND_RESUME_OR_PAUSE: int = const(0x0F)
-    _COMMAND_CURRENT_PLAYING_TRACK: int = const(0x1A)
-    _COMMAND_PLAY_BY_INDEX: int = const(0x41)
-    _COMMAND_PLAY_SPECIFIC: int = const(0x42)
-    _COMMAND_INTERLUDE: int = const(0x43)
-    _COMMAND_INTERLUDE_SPECIFIC: int = const(0x44)
-    _COMMAND_PLAY_ROOT_TRACK: int = const(0x45)
-    _COMMAND_INTERJECT_ROOT_TRACK: int = const(0x46)
-    _COMMAND_PLAY_COMBINED_LIST: int = const(0x47)
-    _COMMAND_INTERJECT_COMBINED_LIST: int = const(0x48)
-    _COMMAND_PLAY_SPECIFIED_TRACK_IN_LOOP: int = const(0x49)
-    _COMMAND_PLAY_SPECIFIED_ROOT_TRACK: int = const(0x4A)
-    _COMMAND_FAST_FORWARD: int = const(0x50)
-    _COMMAND_FAST_REVERSE: int = const(0x51)
-
-    _COMMAND_SET_VOLUME: int = const(0x31)
-    _COMMAND_SET_EQUALIZER: int = const(0x32)
-    _COMMAND_SET_LOOP_MODE: int = const(0x33)
-
-    _COMMAND_GET_STATUS: int = const(0x10)
-    _COMMAND_GET_VOLUME: int = const(0x11)
-    _COMMAND_GET_EQUALIZER: int = const(0x12)
-    _COMMAND_GET_MODE: int = const(0x13)
-
-    def __init__(self, rx_pin, tx_pin) -> None:
-        self._uart = machine.UART(1, 9600)
-        self._uart.init(9600, bits=8, parity=None, stop=1, tx=tx_pin, rx=rx_pin)
+    EQUALIZER_NORMAL: int = _EQUALIZER_NORMAL
+    EQUALIZER_POP: int = _EQUALIZER_POP
+    EQUALIZER_ROCK: int = _EQUALIZER_ROCK
+    EQUALIZER_JAZZ: int = _EQUALIZER_JAZZ
+    EQUALIZER_CLASSIC: int = _EQUALIZER_CLASSIC
+    EQUALIZER_BASS: int = _EQUALIZER_BASS
+
+    STATUS_STOPPED: int = _STATUS_STOPPED
+    STATUS_PLAYING: int = _STATUS_PLAYING
+    STATUS_PAUSED: int = _STATUS_PAUSED
+    STATUS_INTERRUPTING_PLAYING: int = _STATUS_INTERRUPTING_PLAYING
+
+    LOOP_MODE_REPEAT_ALL: int = _LOOP_MODE_REPEAT_ALL
+    LOOP_MODE_REPEAT_FOLDER: int = _LOOP_MODE_REPEAT_FOLDER
+    LOOP_MODE_REPEAT_SINGLE: int = _LOOP_MODE_REPEAT_SINGLE
+    LOOP_MODE_SHUFFLE_PLAY: int = _LOOP_MODE_SHUFFLE_PLAY
+    LOOP_MODE_SINGLE_PLAY: int = _LOOP_MODE_SINGLE_PLAY
+
+    MAX_COMBINED_LIST_LENGTH: int = _MAX_COMBINED_LIST_LENGTH
+
+    TRACE_COMMAND: int = _TRACE_COMMAND
+    TRACE_RESPONSE: int = _TRACE_RESPONSE
+
+    def __init__(self,
+                 rx_pin=None,
+                 tx_pin=None,
+                 uart_id=_UART_ID,
+                 baudrate=_BAUDRATE,
+                 uart=None) -> None:
+        # The UART is opened on first use (or by begin()), so constructing
+        # the driver does not touch the hardware.
+        self._uart = uart
+        self._uart_id = uart_id
+        self._baudrate = baudrate
+        self._rx_pin = rx_pin
+        self._tx_pin = tx_pin
+        self._poll = None
+        self._parser = Gd5800FrameParser()
+        self._notifications = _Notifications(_NOTIFICATION_BACKLOG)
+        # Local mirror of the player state, indexed by the _STATE_* fields
+        # (which follow the order of the _COMMAND_GET_* queries).
+        self._state_values = bytearray(_STATE_COUNT)
+        self._state_times = array.array("l", [0] * _STATE_COUNT)
+        self._state_ttls = array.array("l", [0] * _STATE_COUNT)
+        self._state_valid = 0
+        self._round_trips_avoided = 0
+        self._trace = None
+        self._retries = _COMMAND_RETRIES
+        self._backoff_ms = _BACKOFF_MS
+        self._backoff_max_ms = _BACKOFF_MAX_MS
+        self._min_timeout_ms = _RESPONSE_MARGIN_MS
+        self._max_timeout_ms = _RESPONSE_TIMEOUT_MS
+        self._failure_threshold = _BREAKER_THRESHOLD
+        self._open_ms = _BREAKER_OPEN_MS
+        # Smoothed module processing time and its mean deviation, learned
+        # from first-attempt responses; -1 until the first sample.
+        self._response_ms = -1
+        self._response_deviation_ms = 0
+        self._failures = 0
+        self._breaker_open = False
+        self._breaker_opened = 0
+        self._stats = array.array("L", [0] * _STAT_COUNT)
+
+    def begin(self):
+        if self._poll is not None:
+            return
+        if self._uart is None:
+            self._uart = _open_uart(self._uart_id, self._baudrate,
+                                    self._rx_pin, self._tx_pin)
         self._poll = select.poll()
         self._poll.register(self._uart, select.POLLIN)
 
-    def _uart_read(self, count, timeout=100) -> bytearray:
-        result = bytearray()
-        while count > 0:
-            self._poll.poll(timeout)
-            if self._uart.any() == 0:
-                raise OSError("uart read timeouted")
-            while count > 0 and self._uart.any() > 0:
-                result += self._uart.read(1)
-                count -= 1
-        return result
+    def set_trace(self, hook):
+        # hook(kind, address, code, frame, elapsed_us, error) is called for
+        # every command attempt and every received frame; address is None.
+        self._trace = hook
+
+    def set_retry_policy(self,
+                         retries=_COMMAND_RETRIES,
+                         backoff_ms=_BACKOFF_MS,
+                         backoff_max_ms=_BACKOFF_MAX_MS,
+                         min_timeout_ms=_RESPONSE_MARGIN_MS,
+                         max_timeout_ms=_RESPONSE_TIMEOUT_MS,
+                         failure_threshold=_BREAKER_THRESHOLD,
+                         open_ms=_BREAKER_OPEN_MS):
+        # failure_threshold=0 disables the circuit breaker.
+        self._retries = retries
+        self._backoff_ms = backoff_ms
+        self._backoff_max_ms = backoff_max_ms
+        self._min_timeout_ms = min_timeout_ms
+        self._max_timeout_ms = max_timeout_ms
+        self._failure_threshold = failure_threshold
+        self._open_ms = open_ms
+
+    def command_stats(self) -> dict:
+        stats = {}
+        for i in range(_STAT_COUNT):
+            stats[_STAT_NAMES[i]] = self._stats[i]
+        stats["response_ms"] = self._response_ms
+        stats["response_deviation_ms"] = self._response_deviation_ms
+        stats["offline"] = self._breaker_open
+        return stats
+
+    def reset_command_stats(self):
+        for i in range(_STAT_COUNT):
+            self._stats[i] = 0
+
+    def set_state_ttl(self,
+                      status_ms=0,
+                      volume_ms=0,
+                      equalizer_ms=0,
+                      loop_mode_ms=0):
+        self._state_ttls[_STATE_STATUS] = status_ms
+        self._state_ttls[_STATE_VOLUME] = volume_ms
+        self._state_ttls[_STATE_EQUALIZER] = equalizer_ms
+        self._state_ttls[_STATE_LOOP_MODE] = loop_mode_ms
+
+    def round_trips_avoided(self) -> int:
+        return self._round_trips_avoided
+
+    def on_notification(self, code, callback):
+        self._notifications.set_callback(code, callback)
+
+    def get_notification(self):
+        return self._notifications.get()
+
+    def notifications_dropped(self) -> int:
+        return self._notifications.dropped
+
+    def poll_notifications(self):
+        if self._poll is None:
+            self.begin()
+        parser = self._parser
+        while True:
+            frame = parser.next_frame()
+            if frame is None:
+                if not parser.fill_from(self._uart):
+                    return
+                continue
+            self._observe(frame)
+            self._notifications.handle(frame)
+
+    def _set_state(self, field, value):
+        self._state_values[field] = value
+        self._state_times[field] = time.ticks_ms()
+        self._state_valid |= 1 << field
+
+    def _invalidate_state(self, fields=_STATE_ALL):
+        self._state_valid &= ~fields
+
+    def _observe(self, response):
+        if self._trace is not None:
+            self._trace(_TRACE_RESPONSE, None, response[0], response, 0, None)
+        field = response[0] - _COMMAND_GET_STATUS
+        if len(response) == 3 and 0 <= field < _STATE_COUNT:
+            self._set_state(field, response[2])
+
+    def _query_state(self, field):
+        ttl = self._state_ttls[field]
+        if ttl > 0 and self._state_valid & (1 << field):
+            age = time.ticks_diff(time.ticks_ms(), self._state_times[field])
+            if age < ttl:
+                self._round_trips_avoided += 1
+                return self._state_values[field]
+        return self._write_command(_COMMAND_GET_STATUS + field,
+                                   response_length=3)[2]
+
+    def refresh(self):
+        for field in range(_STATE_COUNT):
+            self._write_command(_COMMAND_GET_STATUS + field,
+                                response_length=3)
 
     def reset(self):
-        self._write_command(self._COMMAND_RESET)
+        self._write_command(_COMMAND_RESET)
+        self._invalidate_state()
 
     def play(self):
-        self._write_command(self._COMMAND_PLAY)
+        self._write_command(_COMMAND_PLAY)
+        self._set_state(_STATE_STATUS, _STATUS_PLAYING)
 
     def stop(self):
-        self._write_command(self._COMMAND_STOP)
+        self._write_command(_COMMAND_STOP)
+        self._set_state(_STATE_STATUS, _STATUS_STOPPED)
 
     def pause(self):
-        self._write_command(self._COMMAND_PAUSE)
+        self._write_command(_COMMAND_PAUSE)
+        self._set_state(_STATE_STATUS, _STATUS_PAUSED)
 
     def next(self):
-        self._write_command(self._COMMAND_NEXT)
+        self._write_command(_COMMAND_NEXT)
+        self._set_state(_STATE_STATUS, _STATUS_PLAYING)
 
     def prev(self):
-        self._write_command(self._COMMAND_PREVIOUS)
+        self._write_command(_COMMAND_PREVIOUS)
+        self._set_state(_STATE_STATUS, _STATUS_PLAYING)
 
     def fast_forward(self):
-        self._write_command(self._COMMAND_FAST_FORWARD)
+        self._write_command(_COMMAND_FAST_FORWARD)
 
     def fast_reserve(self):
-        self._write_command(self._COMMAND_FAST_REVERSE)
+        self._write_command(_COMMAND_FAST_REVERSE)
 
     def play_by_index(self, index):
-        # print('play_by_index:', index)
-        if index < 0 or index > 0xFFFF:
-            raise ValueError("index", index, "out of range (0 ~ 65535)")
-        self._write_command(self._COMMAND_PLAY_BY_INDEX, (index >> 8) & 0xFF,
+        _check_index(index)
+        self._write_command(_COMMAND_PLAY_BY_INDEX, (index >> 8) & 0xFF,
                             index & 0xFF)
+        self._set_state(_STATE_STATUS, _STATUS_PLAYING)
+
+    def play_by_index_in_loop(self, index):
+        _check_index(index)
+        self._write_command(_COMMAND_PLAY_SPECIFIED_TRACK_IN_LOOP,
+                            (index >> 8) & 0xFF, index & 0xFF)
+        self._set_state(_STATE_STATUS, _STATUS_PLAYING)
+
+    def play_in_folder(self, folder, track):
+        _check_byte("folder", folder)
+        _check_byte("track", track)
+        self._write_command(_COMMAND_PLAY_SPECIFIC, folder, track)
+        self._set_state(_STATE_STATUS, _STATUS_PLAYING)
+
+    def play_combined_list(self, tracks):
+        self._write_command(
+            *_combined_list_args(_COMMAND_PLAY_COMBINED_LIST, tracks))
+        self._set_state(_STATE_STATUS, _STATUS_PLAYING)
+
+    def interlude_by_index(self, index):
+        _check_index(index)
+        self._write_command(_COMMAND_INTERLUDE, (index >> 8) & 0xFF,
+                            index & 0xFF)
+        self._set_state(_STATE_STATUS, _STATUS_INTERRUPTING_PLAYING)
+
+    def interlude_in_folder(self, folder, track):
+        _check_byte("folder", folder)
+        _check_byte("track", track)
+        self._write_command(_COMMAND_INTERLUDE_SPECIFIC, folder, track)
+        self._set_state(_STATE_STATUS, _STATUS_INTERRUPTING_PLAYING)
+
+    def interject_combined_list(self, tracks):
+        self._write_command(*_combined_list_args(
+            _COMMAND_INTERJECT_COMBINED_LIST, tracks))
+        self._set_state(_STATE_STATUS, _STATUS_INTERRUPTING_PLAYING)
 
     def volume_up(self):
-        self._write_command(self._COMMAND_VOLUME_UP)
+        self._write_command(_COMMAND_VOLUME_UP)
+        self._invalidate_state(1 << _STATE_VOLUME)
 
     def volume_down(self):
-        self._write_command(self._COMMAND_VOLUME_DOWN)
+        self._write_command(_COMMAND_VOLUME_DOWN)
+        self._invalidate_state(1 << _STATE_VOLUME)
 
     @property
     def status(self):
-        response = self._write_command(self._COMMAND_GET_STATUS,
-                                       response_length=3)
-        return response[2]
+        return self._query_state(_STATE_STATUS)
 
     @property
     def equalizer(self):
-        return self._write_command(self._COMMAND_GET_EQUALIZER,
-                                   response_length=3)[2]
+        return self._query_state(_STATE_EQUALIZER)
 
     @equalizer.setter
     def equalizer(self, equalizer):
-        self._write_command(self._COMMAND_SET_EQUALIZER, equalizer)
+        self._write_command(_COMMAND_SET_EQUALIZER, equalizer)
+        self._set_state(_STATE_EQUALIZER, equalizer)
 
     @property
     def volume(self):
-        return self._write_command(self._COMMAND_GET_VOLUME,
-                                   response_length=3)[2]
+        return self._query_state(_STATE_VOLUME)
 
     @volume.setter
     def volume(self, volume):
-        if volume < 0 or volume > 0x30:
-            raise ValueError("volume", volume, "out of range (0 ~ 48)")
-        self._write_command(self._COMMAND_SET_VOLUME, volume)
+        _check_volume(volume)
+        self._write_command(_COMMAND_SET_VOLUME, volume)
+        self._set_state(_STATE_VOLUME, volume)
 
     @property
     def loop_mode(self):
-        return self._write_command(self._COMMAND_GET_MODE, response_length=3)[2]
+        return self._query_state(_STATE_LOOP_MODE)
 
     @loop_mode.setter
     def loop_mode(self, loop_mode):
-        self._write_command(self._COMMAND_SET_LOOP_MODE, loop_mode)
+        self._write_command(_COMMAND_SET_LOOP_MODE, loop_mode)
+        self._set_state(_STATE_LOOP_MODE, loop_mode)
 
     # @property
     # def current_playing_track(self):
     #     return struct.unpack(
     #         ">H",
-    #         self._write_command(self._COMMAND_CURRENT_PLAYING_TRACK,
+    #         self._write_command(_COMMAND_CURRENT_PLAYING_TRACK,
     #                             response_length=3)[1:3])[0]
 
+    def _wire_ms(self, command_length, response_length):
+        bits = _UART_BITS_PER_BYTE * (command_length + response_length +
+                                      _RESPONSE_FRAMING_BYTES)
+        return (bits * 1000 + self._baudrate - 1) // self._baudrate
+
+    def _response_timeout_ms(self, wire_ms):
+        # Until a response has been timed the configured maximum applies;
+        # then the wire time of both frames plus the learned processing time
+        # and four deviations, as in TCP's retransmission timer.
+        if self._response_ms < 0:
+            timeout = self._max_timeout_ms
+        else:
+            timeout = (wire_ms + self._response_ms +
+                       4 * self._response_deviation_ms)
+            if timeout > self._max_timeout_ms:
+                timeout = self._max_timeout_ms
+        if timeout < wire_ms + self._min_timeout_ms:
+            timeout = wire_ms + self._min_timeout_ms
+        return timeout
+
+    def _observe_response_time(self, elapsed_ms, wire_ms):
+        sample = elapsed_ms - wire_ms
+        if sample < 0:
+            sample = 0
+        if self._response_ms < 0:
+            self._response_ms = sample
+            self._response_deviation_ms = sample // 2
+            return
+        error = sample - self._response_ms
+        self._response_deviation_ms += (
+            (error if error >= 0 else -error) -
+            self._response_deviation_ms) // 4
+        self._response_ms += error // 8
+
+    def _check_breaker(self) -> bool:
+        # Returns True when the breaker is half-open and the command is a
+        # single probe of whether the module is back.
+        if not self._breaker_open:
+            return False
+        if time.ticks_diff(time.ticks_ms(),
+                           self._breaker_opened) < self._open_ms:
+            self._stats[_STAT_FAST_FAILURES] += 1
+            raise Gd5800OfflineError("gd5800 is offline")
+        return True
+
+    def _command_failed(self):
+        self._stats[_STAT_FAILURES] += 1
+        self._failures += 1
+        if self._breaker_open or (self._failure_threshold and self._failures
+                                  >= self._failure_threshold):
+            if not self._breaker_open:
+                self._stats[_STAT_BREAKER_TRIPS] += 1
+            self._breaker_open = True
+            self._breaker_opened = time.ticks_ms()
+
+    def _count_error(self, error):
+        if isinstance(error, Gd5800TimeoutError):
+            self._stats[_STAT_TIMEOUTS] += 1
+        elif isinstance(error, Gd5800FramingError):
+            self._stats[_STAT_FRAMING_ERRORS] += 1
+        elif isinstance(error, Gd5800NackError):
+            self._stats[_STAT_NACKS] += 1
+        elif isinstance(error, Gd5800MismatchError):
+            self._stats[_STAT_MISMATCHES] += 1
+
     def _write_command(self, *args, response_length=1):
-        # print('command:', hex(args[0]))
-        count = 3
-        while count >= 0:
+        if self._poll is None:
+            self.begin()
+        retries = 0 if self._check_breaker() else self._retries
+        command = _encode_command(args)
+        self._notifications.mark_sent(args[0])
+        self._stats[_STAT_COMMANDS] += 1
+        self._notifications.hold()
+        try:
+            return self._send_command(command, response_length, retries)
+        finally:
+            self._notifications.release()
+
+    def _send_command(self, command, response_length, retries):
+        code = command[2]
+        wire_ms = self._wire_ms(len(command), response_length)
+        timeout = self._response_timeout_ms(wire_ms)
+        attempt = 0
+        while True:
+            start = time.ticks_us()
             try:
-                # print('write', hex(args[0]))
-                command = bytearray([0x7E])
-                command.append(len(args) + 1)
-                for arg in args:
-                    command.append(arg)
-                command.append(0xEF)
                 self._uart.write(command)
                 self._uart.flush()
-
-                while True:
-                    response = self._read_response()
-                    if len(response
-                          ) == response_length and response[0] == args[0]:
-                        # print("return response:",
-                        #       [hex(byte) for byte in response])
-                        return response
-            except Exception as ex:
-                if count == 0:
-                    raise ex
-                # print('ex:', ex)
-                pass
-            count -= 1
-
-    def _read_response(self):
-        while self._uart_read(1, timeout=500)[0] != 0xAA:
-            pass
-
-        length = self._uart_read(1)[0]
-        # print("length:", length)
-        response = self._uart_read(length - 1)
-        # print("response:", [hex(byte) for byte in response])
-        if self._uart_read(1)[0] == 0xEF:
+                response = self._wait_response(code, response_length,
+                                               timeout)
+            except Gd5800Error as ex:
+                self._count_error(ex)
+                if self._trace is not None:
+                    self._trace_command(command, start, ex)
+                if attempt >= retries:
+                    self._command_failed()
+                    raise
+                backoff_ms = self._backoff_ms << attempt
+                if backoff_ms > self._backoff_max_ms:
+                    backoff_ms = self._backoff_max_ms
+                if backoff_ms > 0:
+                    time.sleep_ms(backoff_ms)
+                attempt += 1
+                self._stats[_STAT_RETRIES] += 1
+                continue
+
+            if attempt == 0:
+                # Only unambiguous round trips are timed: a response after a
+                # retry may answer either attempt.
+                self._observe_response_time(
+                    time.ticks_diff(time.ticks_us(), start) // 1000,
+                    wire_ms)
+            self._failures = 0
+            self._breaker_open = False
+            if self._trace is not None:
+                self._trace_command(command, start, None)
             return response
-        else:
+
+    def _trace_command(self, command, start, error):
+        self._trace(_TRACE_COMMAND, None, command[2], command,
+                    time.ticks_diff(time.ticks_us(), start), error)
+
+    def _wait_response(self, code, response_length, timeout):
+        deadline = time.ticks_add(time.ticks_ms(), timeout)
+        framing_errors = self._parser.errors
+        mismatched = False
+        rejected = False
+        while True:
+            response = self._read_response(deadline)
+            if response is None:
+                break
+            self._observe(response)
+            if response[0] == code:
+                if len(response) == response_length:
+                    return response
+                # Some modules acknowledge a query with a short frame before
+                # the data frame, so keep reading, as the async driver does.
+                rejected = True
+                continue
+            if self._notifications.sent(response[0]):
+                mismatched = True
+            self._notifications.handle(response)
+
+        if rejected:
+            raise Gd5800NackError("gd5800 rejected command 0x%02x" % code)
+        if self._parser.errors != framing_errors:
+            raise Gd5800FramingError("uart frame corrupted")
+        if mismatched:
+            raise Gd5800MismatchError("gd5800 response mismatched 0x%02x" %
+                                      code)
+        raise Gd5800TimeoutError("uart read timeouted")
+
+    def _read_response(self, deadline):
+        parser = self._parser
+        while True:
+            frame = parser.next_frame()
+            if frame is not None:
+                return frame
+            if parser.fill_from(self._uart):
+                continue
+            remaining = time.ticks_diff(deadline, time.ticks_ms())
+            if remaining <= 0:
+                return None
+            self._poll.poll(remaining)
+
+
+class _PendingCommand:
+
+    def __init__(self, command, response_length) -> None:
+        self.command = command
+        self.response_length = response_length
+        self.response = None
+        self.event = asyncio.Event()
+
+
+class AsyncGd5800Mp3Serial():
+
+    def __init__(self,
+                 rx_pin=None,
+                 tx_pin=None,
+                 timeout_ms=_RESPONSE_TIMEOUT_MS,
+                 retries=_COMMAND_RETRIES,
+                 uart_id=_UART_ID,
+                 baudrate=_BAUDRATE,
+                 uart=None) -> None:
+        self._uart = uart
+        self._uart_id = uart_id
+        self._baudrate = baudrate
+        self._rx_pin = rx_pin
+        self._tx_pin = tx_pin
+        self._reader = None
+        self._writer = None
+        self._parser = Gd5800FrameParser()
+        self._write_lock = asyncio.Lock()
+        self._pending = []
+        self._notifications = _Notifications(_NOTIFICATION_BACKLOG)
+        self._reader_task = None
+        self._timeout_ms = timeout_ms
+        self._retries = retries
+        self._trace = None
+
+    def set_trace(self, hook):
+        self._trace = hook
+
+    async def begin(self):
+        self._start_reader()
+
+    def _start_reader(self):
+        if self._reader is None:
+            if self._uart is None:
+                self._uart = _open_uart(self._uart_id, self._baudrate,
+                                        self._rx_pin, self._tx_pin)
+            self._reader = asyncio.StreamReader(self._uart)
+            self._writer = asyncio.StreamWriter(self._uart, {})
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._read_loop())
+
+    def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+    async def _read_loop(self):
+        parser = self._parser
+        while True:
+            parser.feed(await self._reader.read(_RX_BUFFER_SIZE))
+            frame = parser.next_frame()
+            while frame is not None:
+                self._dispatch(frame)
+                frame = parser.next_frame()
+
+    def _dispatch(self, frame):
+        if self._trace is not None:
+            self._trace(_TRACE_RESPONSE, None, frame[0], frame, 0, None)
+        for pending in self._pending:
+            if (pending.response is None
+                    and len(frame) == pending.response_length
+                    and frame[0] == pending.command):
+                pending.response = bytes(frame)
+                pending.event.set()
+                return
+        self._notifications.handle(frame)
+
+    def on_notification(self, code, callback):
+        self._notifications.set_callback(code, callback)
+
+    def get_notification(self):
+        return self._notifications.get()
+
+    def notifications_dropped(self) -> int:
+        return self._notifications.dropped
+
+    async def _send(self, command):
+        async with self._write_lock:
+            start = time.ticks_us()
+            self._writer.write(command)
+            await self._writer.drain()
+        if self._trace is not None:
+            self._trace(_TRACE_COMMAND, None, command[2], command,
+                        time.ticks_diff(time.ticks_us(), start), None)
+
+    async def command(self, *args, response_length=1, wait=True):
+        self._start_reader()
+        command = _encode_command(args)
+        self._notifications.mark_sent(args[0])
+        if not wait:
+            await self._send(command)
             return None
+
+        pending = _PendingCommand(args[0], response_length)
+        self._pending.append(pending)
+        try:
+            for _ in range(self._retries + 1):
+                await self._send(command)
+                try:
+                    await asyncio.wait_for(pending.event.wait(),
+                                           self._timeout_ms / 1000)
+                except asyncio.TimeoutError:
+                    continue
+                return pending.response
+            raise Gd5800TimeoutError("uart read timeouted")
+        finally:
+            self._pending.remove(pending)
+
+    async def reset(self, wait=False):
+        await self.command(_COMMAND_RESET, wait=wait)
+
+    async def play(self, wait=False):
+        await self.command(_COMMAND_PLAY, wait=wait)
+
+    async def stop(self, wait=False):
+        await self.command(_COMMAND_STOP, wait=wait)
+
+    async def pause(self, wait=False):
+        await self.command(_COMMAND_PAUSE, wait=wait)
+
+    async def next(self, wait=False):
+        await self.command(_COMMAND_NEXT, wait=wait)
+
+    async def prev(self, wait=False):
+        await self.command(_COMMAND_PREVIOUS, wait=wait)
+
+    async def fast_forward(self, wait=False):
+        await self.command(_COMMAND_FAST_FORWARD, wait=wait)
+
+    async def fast_reserve(self, wait=False):
+        await self.command(_COMMAND_FAST_REVERSE, wait=wait)
+
+    async def play_by_index(self, index, wait=False):
+        _check_index(index)
+        await self.command(_COMMAND_PLAY_BY_INDEX, (index >> 8) & 0xFF,
+                           index & 0xFF, wait=wait)
+
+    async def volume_up(self, wait=False):
+        await self.command(_COMMAND_VOLUME_UP, wait=wait)
+
+    async def volume_down(self, wait=False):
+        await self.command(_COMMAND_VOLUME_DOWN, wait=wait)
+
+    async def get_status(self):
+        return (await self.command(_COMMAND_GET_STATUS, response_length=3))[2]
+
+    async def get_equalizer(self):
+        return (await self.command(_COMMAND_GET_EQUALIZER,
+                                   response_length=3))[2]
+
+    async def set_equalizer(self, equalizer, wait=False):
+        await self.command(_COMMAND_SET_EQUALIZER, equalizer, wait=wait)
+
+    async def get_volume(self):
+        return (await self.command(_COMMAND_GET_VOLUME, response_length=3))[2]
+
+    async def set_volume(self, volume, wait=False):
+        _check_volume(volume)
+        await self.command(_COMMAND_SET_VOLUME, volume, wait=wait)
+
+    async def get_loop_mode(self):
+        return (await self.command(_COMMAND_GET_MODE, response_length=3))[2]
+
+    async def set_loop_mode(self, loop_mode, wait=False):
+        await self.command(_COMMAND_SET_LOOP_MODE, loop_mode, wait=wait)
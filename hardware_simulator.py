@@ -0,0 +1,615 @@
+import sys
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF_PERIOD = _TICKS_PERIOD >> 1
+
+_UART_BITS_PER_BYTE = 10
+_I2C_BITS_PER_BYTE = 9
+
+
+class Clock:
+
+    def __init__(self) -> None:
+        self.now_us = 0
+        self._timers = []
+        self._firing = False
+
+    def advance(self, us) -> None:
+        target_us = self.now_us + int(us)
+        if self._firing or not self._timers:
+            self.now_us = target_us
+            return
+        # Fire timers in order, with the clock set to each due time, so
+        # that callbacks observe the same timing they would on hardware.
+        self._firing = True
+        try:
+            while True:
+                timer = None
+                for candidate in self._timers:
+                    if (candidate.due_us is not None
+                            and candidate.due_us <= target_us
+                            and (timer is None
+                                 or candidate.due_us < timer.due_us)):
+                        timer = candidate
+                if timer is None:
+                    break
+                if timer.due_us > self.now_us:
+                    self.now_us = timer.due_us
+                timer.due_us += timer.period_us
+                timer.callback(timer)
+        finally:
+            self._firing = False
+        if target_us > self.now_us:
+            self.now_us = target_us
+
+    def ticks_ms(self) -> int:
+        return (self.now_us // 1000) & _TICKS_MAX
+
+    def ticks_us(self) -> int:
+        return self.now_us & _TICKS_MAX
+
+    def ticks_add(self, ticks, delta) -> int:
+        return (ticks + delta) & _TICKS_MAX
+
+    def ticks_diff(self, end, start) -> int:
+        return ((end - start + _TICKS_HALF_PERIOD) & _TICKS_MAX) \
+            - _TICKS_HALF_PERIOD
+
+    def sleep(self, seconds) -> None:
+        self.advance(seconds * 1000000)
+
+    def sleep_ms(self, ms) -> None:
+        self.advance(ms * 1000)
+
+    def sleep_us(self, us) -> None:
+        self.advance(us)
+
+
+class SimulatedTimer:
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, clock) -> None:
+        self._clock = clock
+        self.period_us = 0
+        self.due_us = None
+        self.callback = None
+
+    def init(self, period=1000, mode=PERIODIC, callback=None, freq=None):
+        if freq is not None:
+            period = 1000 // freq
+        self.period_us = period * 1000
+        self.due_us = self._clock.now_us + self.period_us
+        self.callback = callback
+        if self not in self._clock._timers:
+            self._clock._timers.append(self)
+
+    def deinit(self) -> None:
+        self.due_us = None
+        if self in self._clock._timers:
+            self._clock._timers.remove(self)
+
+
+class BusStats:
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.transactions = 0
+        self.bytes = 0
+        self.wire_us = 0
+
+    def record(self, byte_count, wire_us) -> None:
+        self.transactions += 1
+        self.bytes += byte_count
+        self.wire_us += wire_us
+
+
+class SimulatedI2C:
+
+    def __init__(self, clock, freq=100000) -> None:
+        self._clock = clock
+        self._devices = {}
+        self._muxes = []
+        self.freq = freq
+        self.stats = BusStats()
+
+    def attach(self, address, device):
+        self._devices[address] = device
+        if isinstance(device, Tca9548Model):
+            self._muxes.append(device)
+        return device
+
+    def _device(self, address):
+        device = self._devices.get(address)
+        for mux in self._muxes:
+            if device is not None:
+                break
+            device = mux.device(address)
+        if device is None:
+            raise OSError(19)  # ENODEV, as a NACKed address on a real port
+        return device
+
+    def _transfer(self, byte_count, repeated_start=False) -> None:
+        # START + address/data bytes (8 bits + ACK each) + STOP, plus one
+        # extra START and address byte for a repeated-start read.
+        bits = 2 + _I2C_BITS_PER_BYTE * (byte_count + 1)
+        if repeated_start:
+            bits += 1 + _I2C_BITS_PER_BYTE
+        wire_us = bits * 1000000 // self.freq
+        self.stats.record(byte_count, wire_us)
+        self._clock.advance(wire_us)
+
+    def scan(self) -> list:
+        return sorted(self._devices)
+
+    def writeto(self, address, buffer, stop=True) -> int:
+        device = self._device(address)
+        self._transfer(len(buffer))
+        device.write(bytes(buffer))
+        return len(buffer)
+
+    def readfrom(self, address, count, stop=True) -> bytes:
+        device = self._device(address)
+        self._transfer(count)
+        return device.read(count)
+
+    def readfrom_into(self, address, buffer, stop=True) -> None:
+        device = self._device(address)
+        self._transfer(len(buffer))
+        buffer[:] = device.read(len(buffer))
+
+    def writeto_mem(self, address, register_address, buffer,
+                    addrsize=8) -> None:
+        device = self._device(address)
+        self._transfer(len(buffer) + 1)
+        device.write(bytes((register_address,)) + bytes(buffer))
+
+    def readfrom_mem(self, address, register_address, count,
+                     addrsize=8) -> bytes:
+        device = self._device(address)
+        self._transfer(count + 1, True)
+        device.write(bytes((register_address,)))
+        return device.read(count)
+
+    def readfrom_mem_into(self, address, register_address, buffer,
+                          addrsize=8) -> None:
+        buffer[:] = self.readfrom_mem(address, register_address, len(buffer))
+
+
+class Tca9548Model:
+
+    def __init__(self) -> None:
+        self.channels = 0
+        self.selects = 0
+        self._devices = {}
+
+    def attach(self, channel, address, device):
+        self._devices[(channel, address)] = device
+        return device
+
+    def device(self, address):
+        for channel in range(8):
+            if self.channels >> channel & 1:
+                device = self._devices.get((channel, address))
+                if device is not None:
+                    return device
+        return None
+
+    def write(self, data) -> None:
+        if data:
+            self.channels = data[-1]
+            self.selects += 1
+
+    def read(self, count) -> bytes:
+        return bytes((self.channels,)) * count
+
+
+class RegisterModel:
+
+    def __init__(self, size=256) -> None:
+        self.registers = bytearray(size)
+        self.pointer = 0
+
+    def write(self, data) -> None:
+        if not data:
+            return
+        self.pointer = data[0]
+        for byte in data[1:]:
+            self.write_register(self.pointer, byte)
+            self.pointer = (self.pointer + 1) % len(self.registers)
+
+    def read(self, count) -> bytes:
+        data = bytearray(count)
+        for i in range(count):
+            data[i] = self.read_register(self.pointer)
+            self.pointer = (self.pointer + 1) % len(self.registers)
+        return bytes(data)
+
+    def write_register(self, register_address, value) -> None:
+        self.registers[register_address] = value
+
+    def read_register(self, register_address) -> int:
+        return self.registers[register_address]
+
+
+class SpeechRecognizerModel(RegisterModel):
+    BUSY = 0x01
+    RESET = 0x02
+    RESULT = 0x04
+    EVENT = 0x06
+    KEYWORD_INDEX = 0x0C
+    KEYWORD_DATA = 0x0D
+    KEYWORD_LENGTH = 0x3F
+    ADD_KEYWORD = 0x40
+    RECOGNIZE = 0x41
+
+    EVENT_NONE = 0
+    EVENT_START_RECOGNIZING = 4
+    EVENT_SPEECH_RECOGNIZED = 5
+    EVENT_SPEECH_RECOGNITION_TIMED_OUT = 6
+
+    def __init__(self, clock, version=1, command_ms=5) -> None:
+        super().__init__()
+        self._clock = clock
+        self.registers[0] = version
+        self.command_us = command_ms * 1000
+        self.busy_until_us = 0
+        self.keywords = {}
+        self._recognitions = []
+        self._pending_result = None
+        self._events = []
+
+    def script_recognition(self, result, duration_ms=500) -> None:
+        self._recognitions.append((result, duration_ms * 1000))
+
+    def push_event(self, event, result=None) -> None:
+        if result is not None:
+            self._set_result(result)
+        self._events.append(event)
+
+    def _busy_for(self, us) -> None:
+        self.busy_until_us = self._clock.now_us + us
+
+    def _set_result(self, result) -> None:
+        result &= 0xFFFF
+        self.registers[self.RESULT] = result & 0xFF
+        self.registers[self.RESULT + 1] = result >> 8
+
+    def _update(self) -> None:
+        if (self._pending_result is not None
+                and self._clock.now_us >= self.busy_until_us):
+            result = self._pending_result
+            self._pending_result = None
+            self._set_result(result)
+            if result < 0:
+                self._events.append(self.EVENT_SPEECH_RECOGNITION_TIMED_OUT)
+            else:
+                self._events.append(self.EVENT_SPEECH_RECOGNIZED)
+
+    def write_register(self, register_address, value) -> None:
+        super().write_register(register_address, value)
+        if register_address == self.RESET and value:
+            self.keywords.clear()
+            self._events = []
+            self._pending_result = None
+            self._busy_for(self.command_us)
+        elif register_address == self.ADD_KEYWORD and value:
+            length = self.registers[self.KEYWORD_LENGTH]
+            data = self.registers[self.KEYWORD_DATA:self.KEYWORD_DATA + length]
+            self.keywords[self.registers[self.KEYWORD_INDEX]] = bytes(data)
+            self._busy_for(self.command_us)
+        elif register_address == self.RECOGNIZE and value:
+            if self._recognitions:
+                result, duration_us = self._recognitions.pop(0)
+            else:
+                result, duration_us = -1, self.command_us
+            self._pending_result = result
+            self._events.append(self.EVENT_START_RECOGNIZING)
+            self._busy_for(duration_us)
+
+    def read_register(self, register_address) -> int:
+        self._update()
+        if register_address == self.BUSY:
+            return 1 if self._clock.now_us < self.busy_until_us else 0
+        if register_address == self.EVENT:
+            # Reading EVENT consumes it.
+            return self._events.pop(0) if self._events else self.EVENT_NONE
+        return super().read_register(register_address)
+
+
+class KeypadModel:
+
+    def __init__(self, clock) -> None:
+        self._clock = clock
+        self._transitions = []
+        self.reads = 0
+
+    def key_down(self, key, at_ms) -> None:
+        self._transitions.append((at_ms * 1000, key, True))
+        self._transitions.sort(key=lambda transition: transition[0])
+
+    def key_up(self, key, at_ms) -> None:
+        self._transitions.append((at_ms * 1000, key, False))
+        self._transitions.sort(key=lambda transition: transition[0])
+
+    def press(self, key, at_ms, hold_ms, bounce_ms=0, bounces=0) -> None:
+        # Both edges chatter `bounces` times, `bounce_ms` apart, before the
+        # contact settles.
+        release_ms = at_ms + hold_ms
+        for i in range(bounces):
+            if i % 2 == 0:
+                self.key_down(key, at_ms + i * bounce_ms)
+                self.key_up(key, release_ms + i * bounce_ms)
+            else:
+                self.key_up(key, at_ms + i * bounce_ms)
+                self.key_down(key, release_ms + i * bounce_ms)
+        self.key_down(key, at_ms + bounces * bounce_ms)
+        self.key_up(key, release_ms + bounces * bounce_ms)
+
+    def key_states(self) -> int:
+        mask = 0
+        for at_us, key, down in self._transitions:
+            if at_us > self._clock.now_us:
+                break
+            mask = mask | key if down else mask & ~key
+        return mask
+
+    def write(self, data) -> None:
+        pass
+
+    def read(self, count) -> bytes:
+        self.reads += 1
+        mask = self.key_states()
+        return bytes(((mask >> (8 * i)) & 0xFF for i in range(count)))
+
+
+class Gd5800Model:
+    STATUS_STOPPED = 0
+    STATUS_PLAYING = 1
+    STATUS_PAUSED = 2
+
+    def __init__(self, track_count=10, response_ms=2) -> None:
+        self.track_count = track_count
+        self.response_ms = response_ms
+        self.offline = False
+        self.commands = []
+        self._frame = bytearray()
+        self.uart = None
+        self._reset_state()
+
+    def _reset_state(self) -> None:
+        self.status = self.STATUS_STOPPED
+        self.volume = 20
+        self.equalizer = 0
+        self.loop_mode = 0
+        self.track = 1
+
+    def _respond(self, *payload) -> bytes:
+        return bytes((0xAA, len(payload) + 1) + payload + (0xEF,))
+
+    def notify(self, code, *payload) -> None:
+        self.uart.inject(self._respond(code, *payload))
+
+    def receive(self, data) -> bytes:
+        response = bytearray()
+        for byte in data:
+            if not self._frame and byte != 0x7E:
+                continue
+            self._frame.append(byte)
+            length = len(self._frame)
+            if length >= 2 and length == self._frame[1] + 2:
+                frame = bytes(self._frame)
+                self._frame = bytearray()
+                if frame[-1] == 0xEF and not self.offline:
+                    response += self.handle(frame[2:-1])
+        return bytes(response)
+
+    def handle(self, command) -> bytes:
+        code = command[0]
+        self.commands.append(bytes(command))
+        if code == 0x01 or code == 0x41 or code == 0x47:
+            self.status = self.STATUS_PLAYING
+        elif code == 0x02:
+            self.status = self.STATUS_PAUSED
+        elif code == 0x03:
+            self.track = self.track % self.track_count + 1
+            self.status = self.STATUS_PLAYING
+        elif code == 0x04:
+            self.track = (self.track - 2) % self.track_count + 1
+            self.status = self.STATUS_PLAYING
+        elif code == 0x05:
+            self.volume = min(self.volume + 1, 0x30)
+        elif code == 0x06:
+            self.volume = max(self.volume - 1, 0)
+        elif code == 0x0B:
+            self._reset_state()
+        elif code == 0x0E:
+            self.status = self.STATUS_STOPPED
+        elif code == 0x31:
+            self.volume = command[1]
+        elif code == 0x32:
+            self.equalizer = command[1]
+        elif code == 0x33:
+            self.loop_mode = command[1]
+        elif 0x10 <= code <= 0x13:
+            value = (self.status, self.volume, self.equalizer,
+                     self.loop_mode)[code - 0x10]
+            return self._respond(code, 0, value)
+        return self._respond(code)
+
+
+class SimulatedUART:
+
+    def __init__(self, clock, baudrate=9600, device=None) -> None:
+        self._clock = clock
+        self.baudrate = baudrate
+        self.device = device
+        self._rx = []
+        self.stats = BusStats()
+        if device is not None:
+            device.uart = self
+
+    def init(self, baudrate=9600, **kwargs) -> None:
+        self.baudrate = baudrate
+
+    def _byte_us(self) -> int:
+        return _UART_BITS_PER_BYTE * 1000000 // self.baudrate
+
+    def inject(self, data, delay_us=0) -> None:
+        start_us = max(self._clock.now_us,
+                       self._rx[-1][0] if self._rx else 0) + delay_us
+        byte_us = self._byte_us()
+        for i in range(len(data)):
+            self._rx.append((start_us + (i + 1) * byte_us, data[i]))
+        self.stats.record(len(data), len(data) * byte_us)
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        wire_us = len(data) * self._byte_us()
+        self.stats.record(len(data), wire_us)
+        self._clock.advance(wire_us)
+        if self.device is not None:
+            response = self.device.receive(data)
+            if response:
+                self.inject(response, self.device.response_ms * 1000)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def any(self) -> int:
+        count = 0
+        for at_us, _ in self._rx:
+            if at_us > self._clock.now_us:
+                break
+            count += 1
+        return count
+
+    def next_arrival_us(self):
+        return self._rx[0][0] if self._rx else None
+
+    def read(self, count=-1):
+        available = self.any()
+        if count < 0 or count > available:
+            count = available
+        if count == 0:
+            return None
+        data = bytes(byte for _, byte in self._rx[:count])
+        del self._rx[:count]
+        return data
+
+    def readinto(self, buffer, count=None) -> int:
+        data = self.read(len(buffer) if count is None else count)
+        if not data:
+            return 0
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _SimulatedPoll:
+
+    def __init__(self, clock) -> None:
+        self._clock = clock
+        self._streams = []
+
+    def register(self, stream, eventmask=1) -> None:
+        self._streams.append(stream)
+
+    def unregister(self, stream) -> None:
+        self._streams.remove(stream)
+
+    def poll(self, timeout=-1) -> list:
+        ready = [(stream, 1) for stream in self._streams if stream.any()]
+        if ready or timeout == 0:
+            return ready
+        arrivals = [stream.next_arrival_us() for stream in self._streams]
+        arrivals = [at_us for at_us in arrivals if at_us is not None]
+        deadline_us = (None if timeout < 0 else self._clock.now_us +
+                       timeout * 1000)
+        if arrivals and (deadline_us is None or min(arrivals) <= deadline_us):
+            self._clock.advance(min(arrivals) - self._clock.now_us)
+            return [(stream, 1) for stream in self._streams if stream.any()]
+        if deadline_us is not None:
+            self._clock.advance(deadline_us - self._clock.now_us)
+        return []
+
+
+class _Module:
+
+    def __init__(self, **attributes) -> None:
+        for name, value in attributes.items():
+            setattr(self, name, value)
+
+
+class Simulator:
+
+    def __init__(self, i2c_freq=100000) -> None:
+        self.clock = Clock()
+        self.i2c = SimulatedI2C(self.clock, i2c_freq)
+        self.uarts = {}
+
+    def attach_uart(self, uart_id, device=None, baudrate=9600):
+        uart = SimulatedUART(self.clock, baudrate, device)
+        self.uarts[uart_id] = uart
+        return uart
+
+    def _uart(self, uart_id, baudrate=9600, **kwargs):
+        uart = self.uarts.get(uart_id)
+        if uart is None:
+            uart = self.attach_uart(uart_id, None, baudrate)
+        uart.baudrate = baudrate
+        return uart
+
+    def install(self) -> None:
+        # Drivers must be imported after install(): the simulated modules
+        # replace machine, select and the ticks functions of time.
+        import time as real_time
+        try:
+            import asyncio
+        except ImportError:
+            asyncio = None
+        clock = self.clock
+
+        class Timer(SimulatedTimer):
+
+            def __init__(self, timer_id=-1) -> None:
+                super().__init__(clock)
+
+        sys.modules["machine"] = _Module(
+            I2C=lambda *args, **kwargs: self.i2c,
+            SoftI2C=lambda *args, **kwargs: self.i2c,
+            UART=self._uart,
+            Timer=Timer,
+            Pin=lambda *args, **kwargs: None,
+        )
+        sys.modules["select"] = _Module(
+            POLLIN=1,
+            POLLOUT=4,
+            poll=lambda: _SimulatedPoll(clock),
+        )
+        time_module = _Module()
+        for name in dir(real_time):
+            if not name.startswith("__"):
+                setattr(time_module, name, getattr(real_time, name))
+        sys.modules["time"] = time_module
+        _Module.__init__(
+            time_module,
+            sleep=clock.sleep,
+            sleep_ms=clock.sleep_ms,
+            sleep_us=clock.sleep_us,
+            ticks_ms=clock.ticks_ms,
+            ticks_us=clock.ticks_us,
+            ticks_add=clock.ticks_add,
+            ticks_diff=clock.ticks_diff,
+        )
+        if asyncio is not None:
+            sleep = asyncio.sleep
+
+            async def sleep_ms(ms):
+                clock.sleep_ms(ms)
+                await sleep(0)
+
+            asyncio.sleep_ms = sleep_ms
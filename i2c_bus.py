@@ -0,0 +1,189 @@
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+
+class _Lock:
+
+    def __init__(self) -> None:
+        self._lock = _thread.allocate_lock() if _thread else None
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self) -> None:
+        if self._lock is None:
+            self._depth += 1
+            return
+        ident = _thread.get_ident()
+        if self._depth and self._owner == ident:
+            self._depth += 1
+            return
+        self._lock.acquire()
+        self._owner = ident
+        self._depth = 1
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0 and self._lock is not None:
+            self._owner = None
+            self._lock.release()
+
+    def locked(self) -> bool:
+        return self._depth > 0
+
+
+class _AsyncLock:
+
+    def __init__(self, bus, asyncio) -> None:
+        self._bus = bus
+        self._lock = asyncio.Lock()
+        self._current_task = asyncio.current_task
+
+    def current_task(self):
+        try:
+            return self._current_task()
+        except RuntimeError:
+            return None
+
+    async def acquire(self) -> None:
+        await self._lock.acquire()
+        self._bus._async_owner = self.current_task()
+
+    def release(self) -> None:
+        self._bus._async_owner = None
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class I2cBus:
+
+    def __init__(self, i2c, queue_size=8) -> None:
+        self._i2c = i2c
+        self._lock = _Lock()
+        self._async_lock = None
+        self._async_owner = None
+        self._queue = []
+        self._queue_size = queue_size
+
+    def _acquire(self) -> None:
+        owner = self._async_owner
+        # A task holding async_lock keeps the bus across its awaits. Other
+        # tasks cannot wait for it without blocking the event loop, so
+        # their transfers fail instead of interleaving with its sequence.
+        if (owner is not None
+                and owner is not self._async_lock.current_task()):
+            raise RuntimeError("i2c bus is held by another task")
+        self._lock.acquire()
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked() or self._async_owner is not None
+
+    @property
+    def async_lock(self):
+        if self._async_lock is None:
+            try:
+                import asyncio
+            except ImportError:
+                import uasyncio as asyncio
+            self._async_lock = _AsyncLock(self, asyncio)
+        return self._async_lock
+
+    def scan(self):
+        self._acquire()
+        try:
+            return self._i2c.scan()
+        finally:
+            self._lock.release()
+
+    def writeto(self, address, buffer, stop=True):
+        self._acquire()
+        try:
+            return self._i2c.writeto(address, buffer, stop)
+        finally:
+            self._lock.release()
+
+    def readfrom(self, address, count, stop=True):
+        self._acquire()
+        try:
+            return self._i2c.readfrom(address, count, stop)
+        finally:
+            self._lock.release()
+
+    def readfrom_into(self, address, buffer, stop=True):
+        self._acquire()
+        try:
+            return self._i2c.readfrom_into(address, buffer, stop)
+        finally:
+            self._lock.release()
+
+    def writeto_mem(self, address, register_address, buffer, addrsize=8):
+        self._acquire()
+        try:
+            return self._i2c.writeto_mem(address, register_address, buffer,
+                                         addrsize=addrsize)
+        finally:
+            self._lock.release()
+
+    def readfrom_mem(self, address, register_address, count, addrsize=8):
+        self._acquire()
+        try:
+            return self._i2c.readfrom_mem(address, register_address, count,
+                                          addrsize=addrsize)
+        finally:
+            self._lock.release()
+
+    def readfrom_mem_into(self, address, register_address, buffer,
+                          addrsize=8):
+        self._acquire()
+        try:
+            return self._i2c.readfrom_mem_into(address, register_address,
+                                               buffer, addrsize=addrsize)
+        finally:
+            self._lock.release()
+
+    def writeto_then_readfrom_into(self, address, write_buffer,
+                                   read_buffer) -> None:
+        self._acquire()
+        try:
+            self._i2c.writeto(address, write_buffer)
+            self._i2c.readfrom_into(address, read_buffer)
+        finally:
+            self._lock.release()
+
+    def submit(self, function, *args) -> None:
+        if len(self._queue) >= self._queue_size:
+            raise RuntimeError("i2c bus queue is full")
+        self._queue.append((function, args))
+
+    def run_queued(self) -> list:
+        queue = self._queue
+        self._queue = []
+        results = []
+        self._acquire()
+        try:
+            for function, args in queue:
+                results.append(function(*args))
+        finally:
+            self._lock.release()
+        return results
+
+    async def run_queued_async(self) -> list:
+        async with self.async_lock:
+            return self.run_queued()
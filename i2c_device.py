@@ -1,18 +1,417 @@
 import struct
+import time
+
+try:
+    from micropython import const
+except ImportError:
+
+    def const(x):
+        return x
+
+
+_BUFFER_SIZE = const(64)
+_VIEW_COUNT = const(10)
+_REGISTER_COUNT = const(256)
+
+_CACHE_CACHEABLE = const(0x01)
+_CACHE_VALID = const(0x02)
+_CACHE_DIRTY = const(0x04)
+
+_TRACE_WRITE = const(0)
+_TRACE_READ = const(1)
+
+
+class _TracedI2c:
+
+    def __init__(self, i2c, hook) -> None:
+        self.i2c = i2c
+        self._hook = hook
+        self._register = -1
+
+    def __getattr__(self, name):
+        # Everything that is not a transfer, such as locked(), scan() and
+        # the batching and async_lock of i2c_bus.I2cBus, goes straight to
+        # the wrapped bus.
+        return getattr(self.i2c, name)
+
+    def __enter__(self):
+        self.i2c.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.i2c.__exit__(exc_type, exc_value, traceback)
+
+    def _trace(self, kind, address, register, data, start, error) -> None:
+        self._hook(kind, address, register, data,
+                   time.ticks_diff(time.ticks_us(), start), error)
+
+    def writeto(self, address, buffer, stop=True):
+        register = buffer[0] if len(buffer) else -1
+        # A one-byte write selects the register the next plain read
+        # comes from.
+        self._register = register if len(buffer) == 1 else -1
+        start = time.ticks_us()
+        error = None
+        try:
+            return self.i2c.writeto(address, buffer, stop)
+        except OSError as ex:
+            error = ex
+            raise
+        finally:
+            self._trace(_TRACE_WRITE, address, register, buffer, start,
+                        error)
+
+    def writeto_mem(self, address, register_address, buffer, addrsize=8):
+        self._register = -1
+        start = time.ticks_us()
+        error = None
+        try:
+            return self.i2c.writeto_mem(address, register_address, buffer,
+                                        addrsize=addrsize)
+        except OSError as ex:
+            error = ex
+            raise
+        finally:
+            self._trace(_TRACE_WRITE, address, register_address, buffer,
+                        start, error)
+
+    def readfrom(self, address, count, stop=True):
+        register = self._register
+        self._register = -1
+        start = time.ticks_us()
+        data = b""
+        error = None
+        try:
+            data = self.i2c.readfrom(address, count, stop)
+            return data
+        except OSError as ex:
+            error = ex
+            raise
+        finally:
+            self._trace(_TRACE_READ, address, register, data, start, error)
+
+    def readfrom_into(self, address, buffer, stop=True):
+        register = self._register
+        self._register = -1
+        start = time.ticks_us()
+        error = None
+        try:
+            return self.i2c.readfrom_into(address, buffer, stop)
+        except OSError as ex:
+            error = ex
+            raise
+        finally:
+            self._trace(_TRACE_READ, address, register, buffer, start,
+                        error)
+
+    def readfrom_mem(self, address, register_address, count, addrsize=8):
+        start = time.ticks_us()
+        data = b""
+        error = None
+        try:
+            data = self.i2c.readfrom_mem(address, register_address, count,
+                                         addrsize=addrsize)
+            return data
+        except OSError as ex:
+            error = ex
+            raise
+        finally:
+            self._trace(_TRACE_READ, address, register_address, data, start,
+                        error)
+
+    def readfrom_mem_into(self, address, register_address, buffer,
+                          addrsize=8):
+        start = time.ticks_us()
+        error = None
+        try:
+            return self.i2c.readfrom_mem_into(address, register_address,
+                                              buffer, addrsize=addrsize)
+        except OSError as ex:
+            error = ex
+            raise
+        finally:
+            self._trace(_TRACE_READ, address, register_address, buffer,
+                        start, error)
+
+    def writeto_then_readfrom_into(self, address, write_buffer,
+                                   read_buffer) -> None:
+        # The read may land in the same scratch buffer as the write, so the
+        # register is taken before the transfer.
+        register = write_buffer[0]
+        start = time.ticks_us()
+        error = None
+        try:
+            self.i2c.writeto_then_readfrom_into(address, write_buffer,
+                                                read_buffer)
+        except OSError as ex:
+            error = ex
+            raise
+        finally:
+            self._trace(_TRACE_READ, address, register, read_buffer, start,
+                        error)
 
 
 class I2cDevice:
+    TRACE_WRITE: int = _TRACE_WRITE
+    TRACE_READ: int = _TRACE_READ
 
-    def __init__(self, i2c, i2c_address) -> None:
+    def __init__(self, i2c, i2c_address, repeated_start=False) -> None:
         self._i2c = i2c
         self._address = i2c_address
         self._i2c_write = self._i2c.writeto
         self._i2c_read = self._i2c.readfrom
+        self._i2c_read_into = self._i2c.readfrom_into
+        # Register reads either address the register with a repeated-start
+        # (one bus transaction) or with a separate write followed by a STOP,
+        # which some firmware requires.
+        if repeated_start:
+            self._read_register_into = self._read_register_mem_into
+            self._read_register_bytes = self._read_register_mem
+        elif hasattr(i2c, "writeto_then_readfrom_into"):
+            # Shared buses (see i2c_bus.I2cBus) keep the split write and
+            # read of a register access together as one locked unit.
+            self._read_register_into = self._read_register_locked_into
+            self._read_register_bytes = self._read_register_locked
+        else:
+            self._read_register_into = self._read_register_split_into
+            self._read_register_bytes = self._read_register_split
+        self._write_register = self._write_register_direct
+        self._cache = None
+        self._cache_flags = None
+        self._defer_writes = False
+        self._dirty_low = _REGISTER_COUNT
+        self._dirty_high = 0
+        # Scratch space shared by all transfers of this device. The typed
+        # write helpers and the 8/16-bit typed read helpers only touch these
+        # preallocated views, so they do not allocate on the heap.
+        self._buffer = bytearray(_BUFFER_SIZE)
+        self._buffer_view = memoryview(self._buffer)
+        self._views = tuple(self._buffer_view[:n] for n in range(_VIEW_COUNT))
+
+    def _pack(self, args, offset) -> int:
+        buffer = self._buffer
+        for arg in args:
+            if isinstance(arg, (bytes, bytearray, memoryview)):
+                end = offset + len(arg)
+                if end > _BUFFER_SIZE:
+                    return -1
+                buffer[offset:end] = arg
+                offset = end
+            elif isinstance(arg, str):
+                offset = self._pack((bytes(arg, "utf8"),), offset)
+            elif isinstance(arg, (tuple, list)):
+                offset = self._pack(arg, offset)
+            elif offset < _BUFFER_SIZE:
+                buffer[offset] = arg
+                offset += 1
+            else:
+                return -1
+            if offset < 0:
+                return -1
+        return offset
+
+    def _view(self, count):
+        if count < _VIEW_COUNT:
+            return self._views[count]
+        return self._buffer_view[:count]
+
+    def _read(self, count):
+        self._i2c_read_into(self._address, self._views[count])
+        return self._buffer
+
+    def _select_register(self, register_address) -> None:
+        self._buffer[0] = register_address
+        self._i2c_write(self._address, self._views[1])
+
+    def _read_register_split_into(self, register_address, buffer) -> None:
+        self._select_register(register_address)
+        self._i2c_read_into(self._address, buffer)
+
+    def _read_register_split(self, register_address, count) -> bytes:
+        self._select_register(register_address)
+        return self._i2c_read(self._address, count)
+
+    def _read_register_locked_into(self, register_address, buffer) -> None:
+        self._buffer[0] = register_address
+        self._i2c.writeto_then_readfrom_into(self._address, self._views[1],
+                                             buffer)
+
+    def _read_register_locked(self, register_address, count) -> bytes:
+        buffer = bytearray(count)
+        self._read_register_locked_into(register_address, buffer)
+        return bytes(buffer)
+
+    def _read_register_mem_into(self, register_address, buffer) -> None:
+        self._i2c.readfrom_mem_into(self._address, register_address, buffer)
+
+    def _read_register_mem(self, register_address, count) -> bytes:
+        return self._i2c.readfrom_mem(self._address, register_address, count)
+
+    def _read_register(self, register_address, count):
+        self._read_register_into(register_address, self._views[count])
+        return self._buffer
+
+    def _write_register_direct(self, register_address, count) -> None:
+        self._buffer[0] = register_address
+        self._i2c_write(self._address, self._view(count + 1))
+
+    def _cache_hit(self, register_address, count) -> bool:
+        if register_address + count > _REGISTER_COUNT:
+            return False
+        cache = self._cache
+        flags = self._cache_flags
+        buffer = self._buffer
+        for i in range(count):
+            if (flags[register_address + i] & _CACHE_VALID == 0
+                    or cache[register_address + i] != buffer[i + 1]):
+                return False
+        return True
+
+    def _write_register_cached(self, register_address, count) -> None:
+        end = register_address + count
+        if end > _REGISTER_COUNT:
+            self._write_register_direct(register_address, count)
+            return
+        cache = self._cache
+        flags = self._cache_flags
+        buffer = self._buffer
+        cacheable = True
+        unchanged = True
+        for i in range(count):
+            flag = flags[register_address + i]
+            if flag & _CACHE_CACHEABLE == 0:
+                cacheable = False
+            elif (flag & _CACHE_VALID == 0
+                  or cache[register_address + i] != buffer[i + 1]):
+                unchanged = False
+        if cacheable and unchanged:
+            return
+
+        for i in range(count):
+            if flags[register_address + i] & _CACHE_CACHEABLE:
+                cache[register_address + i] = buffer[i + 1]
+                flags[register_address + i] |= _CACHE_VALID
+        if cacheable and self._defer_writes:
+            for i in range(register_address, end):
+                flags[i] |= _CACHE_DIRTY
+            if register_address < self._dirty_low:
+                self._dirty_low = register_address
+            if end > self._dirty_high:
+                self._dirty_high = end
+            return
+
+        for i in range(register_address, end):
+            flags[i] &= ~_CACHE_DIRTY
+        self._write_register_direct(register_address, count)
+
+    def _read_register_cached_into(self, register_address, buffer) -> None:
+        count = len(buffer)
+        end = register_address + count
+        if end > _REGISTER_COUNT:
+            self._read_register_uncached_into(register_address, buffer)
+            return
+        cache = self._cache
+        flags = self._cache_flags
+        for i in range(register_address, end):
+            if flags[i] & _CACHE_VALID == 0:
+                break
+        else:
+            for i in range(count):
+                buffer[i] = cache[register_address + i]
+            return
+
+        self._read_register_uncached_into(register_address, buffer)
+        for i in range(count):
+            flag = flags[register_address + i]
+            if flag & _CACHE_DIRTY:
+                buffer[i] = cache[register_address + i]
+            elif flag & _CACHE_CACHEABLE:
+                cache[register_address + i] = buffer[i]
+                flags[register_address + i] = flag | _CACHE_VALID
+
+    def _read_register_cached(self, register_address, count) -> bytes:
+        buffer = bytearray(count)
+        self._read_register_cached_into(register_address, buffer)
+        return bytes(buffer)
+
+    def i2c_cache_registers(self, register_address, count=1) -> None:
+        if self._cache is None:
+            self._cache = bytearray(_REGISTER_COUNT)
+            self._cache_flags = bytearray(_REGISTER_COUNT)
+            self._read_register_uncached_into = self._read_register_into
+            self._read_register_into = self._read_register_cached_into
+            self._read_register_bytes = self._read_register_cached
+            self._write_register = self._write_register_cached
+        for i in range(register_address, register_address + count):
+            self._cache_flags[i] |= _CACHE_CACHEABLE
+
+    def i2c_cached(self, register_address, *args) -> bool:
+        if self._cache is None:
+            return False
+        length = self._pack(args, 1)
+        return length > 0 and self._cache_hit(register_address, length - 1)
+
+    def i2c_invalidate_cache(self) -> None:
+        if self._cache is None:
+            return
+        flags = self._cache_flags
+        for i in range(_REGISTER_COUNT):
+            flags[i] &= _CACHE_CACHEABLE
+        self._dirty_low = _REGISTER_COUNT
+        self._dirty_high = 0
+
+    def i2c_defer_writes(self, defer=True) -> None:
+        self._defer_writes = defer
+        if not defer:
+            self.i2c_flush()
+
+    def i2c_flush(self) -> None:
+        if self._cache is None:
+            return
+        cache = self._cache
+        flags = self._cache_flags
+        buffer = self._buffer
+        register_address = self._dirty_low
+        end = self._dirty_high
+        self._dirty_low = _REGISTER_COUNT
+        self._dirty_high = 0
+        while register_address < end:
+            if flags[register_address] & _CACHE_DIRTY == 0:
+                register_address += 1
+                continue
+            count = 0
+            while (register_address + count < end
+                   and count < _BUFFER_SIZE - 1
+                   and flags[register_address + count] & _CACHE_DIRTY):
+                flags[register_address + count] &= ~_CACHE_DIRTY
+                buffer[count + 1] = cache[register_address + count]
+                count += 1
+            self._write_register_direct(register_address, count)
+            register_address += count
+
+    def i2c_set_trace(self, hook) -> None:
+        # hook(kind, address, register, data, elapsed_us, error) is called
+        # after every bus transaction; register is -1 when unknown. Without
+        # a hook the bus methods are bound directly, so tracing costs
+        # nothing when it is off.
+        i2c = self._i2c
+        if isinstance(i2c, _TracedI2c):
+            i2c = i2c.i2c
+        if hook is not None:
+            i2c = _TracedI2c(i2c, hook)
+        self._i2c = i2c
+        self._i2c_write = i2c.writeto
+        self._i2c_read = i2c.readfrom
+        self._i2c_read_into = i2c.readfrom_into
 
     def i2c_write(self, *args) -> None:
+        length = self._pack(args, 0)
+        if length >= 0:
+            return self._i2c_write(self._address, self._view(length))
+
         data = bytearray()
         for arg in args:
-            if isinstance(arg, (bytes, bytearray)):
+            if isinstance(arg, (bytes, bytearray, memoryview)):
                 data += arg
             elif isinstance(arg, str):
                 data += bytes(arg, "utf8")
@@ -23,214 +422,228 @@ class I2cDevice:
         return self._i2c_write(self._address, data)
 
     def i2c_write_to(self, register_address, *args) -> None:
-        self.i2c_write(register_address, args)
+        length = self._pack(args, 1)
+        if length < 0:
+            self.i2c_write(register_address, args)
+        else:
+            self._write_register(register_address, length - 1)
 
-    def i2c_write_int8(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("b", value))
+    def i2c_read(self, count) -> bytes:
+        return self._i2c_read(self._address, count)
 
-    def i2c_write_uint8(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("B", value))
+    def i2c_read_into(self, buffer) -> None:
+        self._i2c_read_into(self._address, buffer)
 
-    def i2c_write_int16le(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("<h", value))
+    def i2c_read_from(self, register_address, count) -> bytes:
+        return self._read_register_bytes(register_address, count)
 
-    def i2c_write_uint16le(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("<H", value))
+    def i2c_read_from_into(self, register_address, buffer) -> None:
+        self._read_register_into(register_address, buffer)
 
-    def i2c_write_int32le(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("<i", value))
 
-    def i2c_write_uint32le(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("<I", value))
+def _decode_uint8(buffer):
+    return buffer[0]
 
-    def i2c_write_int64le(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("<q", value))
 
-    def i2c_write_uint64le(self, value) -> None:
-        self._i2c_write(self._address, struct.pack("<Q", value))
+def _decode_int8(buffer):
+    value = buffer[0]
+    return value - 0x100 if value & 0x80 else value
 
-    def i2c_write_int16be(self, value) -> None:
-        self._i2c_write(self._address, struct.pack(">h", value))
 
-    def i2c_write_uint16be(self, value) -> None:
-        self._i2c_write(self._address, struct.pack(">H", value))
+def _decode_uint16le(buffer):
+    return buffer[0] | buffer[1] << 8
 
-    def i2c_write_int32be(self, value) -> None:
-        self._i2c_write(self._address, struct.pack(">i", value))
 
-    def i2c_write_uint32be(self, value) -> None:
-        self._i2c_write(self._address, struct.pack(">I", value))
+def _decode_int16le(buffer):
+    value = buffer[0] | buffer[1] << 8
+    return value - 0x10000 if value & 0x8000 else value
 
-    def i2c_write_int64be(self, value) -> None:
-        self._i2c_write(self._address, struct.pack(">q", value))
 
-    def i2c_write_uint64be(self, value) -> None:
-        self._i2c_write(self._address, struct.pack(">Q", value))
+def _decode_uint16be(buffer):
+    return buffer[0] << 8 | buffer[1]
 
-    def i2c_write_int8_to(self, register_address, value) -> None:
-        self._i2c_write(self._address, struct.pack("Bb", register_address,
-                                                   value))
 
-    def i2c_write_uint8_to(self, register_address, value) -> None:
-        self._i2c_write(self._address, struct.pack("BB", register_address,
-                                                   value))
+def _decode_int16be(buffer):
+    value = buffer[0] << 8 | buffer[1]
+    return value - 0x10000 if value & 0x8000 else value
 
-    def i2c_write_int16le_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack("<Bh", register_address, value))
 
-    def i2c_write_uint16le_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack("<BH", register_address, value))
+# Only results that fit a small int are allocation-free on MicroPython.
+def _decode_uint32le(buffer):
+    return buffer[0] | buffer[1] << 8 | buffer[2] << 16 | buffer[3] << 24
 
-    def i2c_write_int32le_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack("<Bi", register_address, value))
 
-    def i2c_write_uint32le_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack("<BI", register_address, value))
+def _decode_int32le(buffer):
+    value = buffer[0] | buffer[1] << 8 | buffer[2] << 16
+    top = buffer[3]
+    return value | (top - 0x100 if top & 0x80 else top) << 24
 
-    def i2c_write_int64le_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack("<Bq", register_address, value))
 
-    def i2c_write_uint64le_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack("<BQ", register_address, value))
+def _decode_uint32be(buffer):
+    return buffer[0] << 24 | buffer[1] << 16 | buffer[2] << 8 | buffer[3]
 
-    def i2c_write_int16be_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack(">Bh", register_address, value))
 
-    def i2c_write_uint16be_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack(">BH", register_address, value))
+def _decode_int32be(buffer):
+    value = buffer[1] << 16 | buffer[2] << 8 | buffer[3]
+    top = buffer[0]
+    return value | (top - 0x100 if top & 0x80 else top) << 24
 
-    def i2c_write_int32be_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack(">Bi", register_address, value))
 
-    def i2c_write_uint32be_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack(">BI", register_address, value))
+_DECODERS = {
+    "B": _decode_uint8,
+    "b": _decode_int8,
+    "<H": _decode_uint16le,
+    "<h": _decode_int16le,
+    ">H": _decode_uint16be,
+    ">h": _decode_int16be,
+    "<I": _decode_uint32le,
+    "<i": _decode_int32le,
+    ">I": _decode_uint32be,
+    ">i": _decode_int32be,
+}
 
-    def i2c_write_int64be_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack(">Bq", register_address, value))
 
-    def i2c_write_uint64be_to(self, register_address, value) -> None:
-        self._i2c_write(self._address,
-                        struct.pack(">BQ", register_address, value))
+class _Codec:
 
-    def i2c_read(self, count) -> bytes:
-        return self._i2c_read(self._address, count)
+    def __init__(self, format) -> None:
+        self.format = format
+        self.size = struct.calcsize(format)
+        self.decode = _DECODERS.get(format, self._unpack)
+
+    # 64-bit formats have no hand decoder: struct.unpack_from allocates a
+    # tuple, and the value would not fit a small int anyway.
+    def _unpack(self, buffer):
+        return struct.unpack_from(self.format, buffer)[0]
+
+    def read(self, device):
+        return self.decode(device._read(self.size))
+
+    def read_from(self, device, register_address):
+        return self.decode(device._read_register(register_address, self.size))
+
+    def write(self, device, value) -> None:
+        struct.pack_into(self.format, device._buffer, 0, value)
+        device._i2c_write(device._address, device._views[self.size])
+
+    def write_to(self, device, register_address, value) -> None:
+        struct.pack_into(self.format, device._buffer, 1, value)
+        device._write_register(register_address, self.size)
+
+    def cached(self, device, register_address, value) -> bool:
+        if device._cache is None:
+            return False
+        struct.pack_into(self.format, device._buffer, 1, value)
+        return device._cache_hit(register_address, self.size)
+
+
+_CODECS = {}
 
-    def i2c_read_from(self, register_address, count) -> bytes:
-        self.i2c_write_uint8(register_address)
-        return self._i2c_read(self._address, count)
 
-    def i2c_read_byte(self):
-        return struct.unpack("B", self.i2c_read(1))[0]
+def _codec(format):
+    codec = _CODECS.get(format)
+    if codec is None:
+        codec = _CODECS[format] = _Codec(format)
+    return codec
 
-    def i2c_read_int8(self):
-        return struct.unpack("b", self.i2c_read(1))[0]
 
-    def i2c_read_uint8(self):
-        return struct.unpack("B", self.i2c_read(1))[0]
+class Register:
 
-    def i2c_read_int16le(self):
-        return struct.unpack("<h", self.i2c_read(2))[0]
+    def __init__(self, register_address, format="B") -> None:
+        self.address = register_address
+        self._codec = _codec(format)
 
-    def i2c_read_uint16le(self):
-        return struct.unpack("<H", self.i2c_read(2))[0]
+    def __get__(self, device, owner=None):
+        if device is None:
+            return self
+        return self._codec.read_from(device, self.address)
 
-    def i2c_read_int32le(self):
-        return struct.unpack("<i", self.i2c_read(4))[0]
+    def __set__(self, device, value) -> None:
+        self._codec.write_to(device, self.address, value)
 
-    def i2c_read_uint32le(self):
-        return struct.unpack("<I", self.i2c_read(4))[0]
+    def cached(self, device, value) -> bool:
+        return self._codec.cached(device, self.address, value)
 
-    def i2c_read_int64le(self):
-        return struct.unpack("<q", self.i2c_read(8))[0]
 
-    def i2c_read_uint64le(self):
-        return struct.unpack("<Q", self.i2c_read(8))[0]
+class Field:
 
-    def i2c_read_int16be(self):
-        return struct.unpack(">h", self.i2c_read(2))[0]
+    def __init__(self, register_address, mask, format="B") -> None:
+        self.address = register_address
+        self.mask = mask
+        self._codec = _codec(format)
+        self._shift = 0
+        while mask and not mask >> self._shift & 1:
+            self._shift += 1
 
-    def i2c_read_uint16be(self):
-        return struct.unpack(">H", self.i2c_read(2))[0]
+    def __get__(self, device, owner=None):
+        if device is None:
+            return self
+        value = self._codec.read_from(device, self.address)
+        return (value & self.mask) >> self._shift
 
-    def i2c_read_int32be(self):
-        return struct.unpack(">i", self.i2c_read(4))[0]
+    def __set__(self, device, value) -> None:
+        codec = self._codec
+        current = codec.read_from(device, self.address)
+        codec.write_to(device, self.address, current & ~self.mask
+                       | value << self._shift & self.mask)
 
-    def i2c_read_uint32be(self):
-        return struct.unpack(">I", self.i2c_read(4))[0]
 
-    def i2c_read_int64be(self):
-        return struct.unpack(">q", self.i2c_read(8))[0]
+def _reader(codec):
 
-    def i2c_read_uint64be(self):
-        return struct.unpack(">Q", self.i2c_read(8))[0]
+    def i2c_read(self):
+        return codec.read(self)
 
-    def i2c_read_byte_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("B", self.i2c_read(1))[0]
+    return i2c_read
 
-    def i2c_read_int8_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("b", self.i2c_read(1))[0]
 
-    def i2c_read_uint8_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("B", self.i2c_read(1))[0]
+def _register_reader(codec):
 
-    def i2c_read_int16le_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("<h", self.i2c_read(2))[0]
+    def i2c_read_from(self, register_address):
+        return codec.read_from(self, register_address)
 
-    def i2c_read_uint16le_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("<H", self.i2c_read(2))[0]
+    return i2c_read_from
 
-    def i2c_read_int32le_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("<i", self.i2c_read(4))[0]
 
-    def i2c_read_uint32le_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("<I", self.i2c_read(4))[0]
+def _writer(codec):
 
-    def i2c_read_int64le_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("<q", self.i2c_read(8))[0]
+    def i2c_write(self, value) -> None:
+        codec.write(self, value)
 
-    def i2c_read_uint64le_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack("<Q", self.i2c_read(8))[0]
+    return i2c_write
 
-    def i2c_read_int16be_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack(">h", self.i2c_read(2))[0]
 
-    def i2c_read_uint16be_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack(">H", self.i2c_read(2))[0]
+def _register_writer(codec):
 
-    def i2c_read_int32be_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack(">i", self.i2c_read(4))[0]
+    def i2c_write_to(self, register_address, value) -> None:
+        codec.write_to(self, register_address, value)
 
-    def i2c_read_uint32be_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack(">I", self.i2c_read(4))[0]
+    return i2c_write_to
 
-    def i2c_read_int64be_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack(">q", self.i2c_read(8))[0]
 
-    def i2c_read_uint64be_from(self, register_address):
-        self.i2c_write_uint8(register_address)
-        return struct.unpack(">Q", self.i2c_read(8))[0]
+# The typed i2c_read_<type>[_from] and i2c_write_<type>[_to] helpers are
+# generated from one precompiled codec per format and share their bytecode.
+for _name, _format in (
+    ("byte", "B"),
+    ("int8", "b"),
+    ("uint8", "B"),
+    ("int16le", "<h"),
+    ("uint16le", "<H"),
+    ("int32le", "<i"),
+    ("uint32le", "<I"),
+    ("int64le", "<q"),
+    ("uint64le", "<Q"),
+    ("int16be", ">h"),
+    ("uint16be", ">H"),
+    ("int32be", ">i"),
+    ("uint32be", ">I"),
+    ("int64be", ">q"),
+    ("uint64be", ">Q"),
+):
+    _codec_instance = _codec(_format)
+    setattr(I2cDevice, "i2c_read_" + _name, _reader(_codec_instance))
+    setattr(I2cDevice, "i2c_read_" + _name + "_from",
+            _register_reader(_codec_instance))
+    if _name != "byte":
+        setattr(I2cDevice, "i2c_write_" + _name, _writer(_codec_instance))
+        setattr(I2cDevice, "i2c_write_" + _name + "_to",
+                _register_writer(_codec_instance))
+del _name, _format, _codec_instance
@@ -1,51 +1,173 @@
+import array
 import i2c_device
+import machine
+import time
 
 try:
-    from micropython import const
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+try:
+    from micropython import const, schedule
 except ImportError:
 
     def const(x):
         return x
 
+    def schedule(function, argument):
+        function(argument)
+
+
+_KEY_COUNT = const(16)
+_SAMPLES_PER_SETTLE = const(4)
+_DEFAULT_SETTLE_MS = const(20)
+_DEFAULT_EVENT_QUEUE_SIZE = const(16)
+_DEFAULT_LONG_PRESS_MS = const(800)
+_DEFAULT_REPEAT_INTERVAL_MS = const(200)
+_DEFAULT_SCAN_PERIOD_MS = const(10)
+_DEFAULT_GROUP_EVENT_QUEUE_SIZE = const(32)
+_MUX_ADDRESS = const(0x70)
+
+_DEFAULT_I2C_ADDRESS = const(0x65)
+
+_KEY_0 = const(1 << 7)
+_KEY_1 = const(1 << 0)
+_KEY_2 = const(1 << 4)
+_KEY_3 = const(1 << 8)
+_KEY_4 = const(1 << 1)
+_KEY_5 = const(1 << 5)
+_KEY_6 = const(1 << 9)
+_KEY_7 = const(1 << 2)
+_KEY_8 = const(1 << 6)
+_KEY_9 = const(1 << 10)
+_KEY_A = const(1 << 12)
+_KEY_B = const(1 << 13)
+_KEY_C = const(1 << 14)
+_KEY_D = const(1 << 15)
+_KEY_ASTERISK = const(1 << 3)
+_KEY_NUMBER_SIGN = const(1 << 11)
+
+_EVENT_PRESSED = const(1)
+_EVENT_RELEASED = const(2)
+_EVENT_LONG_PRESSED = const(3)
+_EVENT_REPEATED = const(4)
+_EVENT_CHORD = const(5)
+
+# Bit numbers of the keys in row-major order of the physical keypad
+# (1 2 3 A / 4 5 6 B / 7 8 9 C / * 0 # D), and the character of each bit.
+_PHYSICAL_ORDER = bytes((0, 4, 8, 12, 1, 5, 9, 13, 2, 6, 10, 14, 3, 7, 11, 15))
+_KEY_CHARS = "147*2580369#ABCD"
+
 
 class MatrixKeyboardV3(i2c_device.I2cDevice):
-    DEFAULT_I2C_ADDRESS: int = const(0x65)
-
-    KEY_0: int = const(1 << 7)
-    KEY_1: int = const(1 << 0)
-    KEY_2: int = const(1 << 4)
-    KEY_3: int = const(1 << 8)
-    KEY_4: int = const(1 << 1)
-    KEY_5: int = const(1 << 5)
-    KEY_6: int = const(1 << 9)
-    KEY_7: int = const(1 << 2)
-    KEY_8: int = const(1 << 6)
-    KEY_9: int = const(1 << 10)
-    KEY_A: int = const(1 << 12)
-    KEY_B: int = const(1 << 13)
-    KEY_C: int = const(1 << 14)
-    KEY_D: int = const(1 << 15)
-    KEY_ASTERISK: int = const(1 << 3)
-    KEY_NUMBER_SIGN: int = const(1 << 11)
-
-    def __init__(self, i2c, i2c_address=DEFAULT_I2C_ADDRESS):
+    DEFAULT_I2C_ADDRESS: int = _DEFAULT_I2C_ADDRESS
+
+    KEY_0: int = _KEY_0
+    KEY_1: int = _KEY_1
+    KEY_2: int = _KEY_2
+    KEY_3: int = _KEY_3
+    KEY_4: int = _KEY_4
+    KEY_5: int = _KEY_5
+    KEY_6: int = _KEY_6
+    KEY_7: int = _KEY_7
+    KEY_8: int = _KEY_8
+    KEY_9: int = _KEY_9
+    KEY_A: int = _KEY_A
+    KEY_B: int = _KEY_B
+    KEY_C: int = _KEY_C
+    KEY_D: int = _KEY_D
+    KEY_ASTERISK: int = _KEY_ASTERISK
+    KEY_NUMBER_SIGN: int = _KEY_NUMBER_SIGN
+
+    EVENT_PRESSED: int = _EVENT_PRESSED
+    EVENT_RELEASED: int = _EVENT_RELEASED
+    EVENT_LONG_PRESSED: int = _EVENT_LONG_PRESSED
+    EVENT_REPEATED: int = _EVENT_REPEATED
+    EVENT_CHORD: int = _EVENT_CHORD
+
+    KEY_CHARS: str = _KEY_CHARS
+
+    def __init__(self,
+                 i2c,
+                 i2c_address=_DEFAULT_I2C_ADDRESS,
+                 settle_ms=_DEFAULT_SETTLE_MS,
+                 event_queue_size=_DEFAULT_EVENT_QUEUE_SIZE):
         super().__init__(i2c, i2c_address)
         self._key_states = 0
         self._last_key_states = 0
+        self._pressed_keys = 0
+        self._released_keys = 0
+        # A key changes state once its contacts have disagreed with the
+        # debounced state for settle_ms and a sample taken after that still
+        # disagrees. _unstable marks the keys whose disagreement is being
+        # timed and _change_times holds when each of them was first seen to
+        # disagree.
+        self._settle_ms = settle_ms
+        self._unstable = 0
+        self._change_times = array.array("l", [0] * _KEY_COUNT)
+        self._sample_ms = settle_ms // _SAMPLES_PER_SETTLE
+        self._last_sample_ms = time.ticks_add(time.ticks_ms(),
+                                              -self._sample_ms)
+        # Scanner state and the event ring buffer are allocated up front so
+        # that scans run from a timer never allocate.
+        self._event_types = bytearray(event_queue_size)
+        self._event_keys = array.array("H", [0] * event_queue_size)
+        self._event_times = array.array("l", [0] * event_queue_size)
+        self._event_head = 0
+        self._event_tail = 0
+        self._events_dropped = 0
+        self._press_times = array.array("l", [0] * _KEY_COUNT)
+        self._repeat_times = array.array("l", [0] * _KEY_COUNT)
+        self._long_pressed = 0
+        self._long_press_ms = _DEFAULT_LONG_PRESS_MS
+        self._repeat_interval_ms = _DEFAULT_REPEAT_INTERVAL_MS
+        self._timer = None
+        self._bus_locked = None
+        self._scan_callback = self._scan
 
     def update(self):
-        key_state = -1
-        count: int = const(4)
+        last_key_states = self._key_states
+        self._last_key_states = last_key_states
+        self._pressed_keys = 0
+        self._released_keys = 0
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self._last_sample_ms) < self._sample_ms:
+            return
+        self._last_sample_ms = now
 
-        while key_state == -1:
-            key_state = self.i2c_read_uint16le()
-            for i in range(count):
-                if key_state != self.i2c_read_uint16le():
-                    key_state = -1
-                    break
+        raw_key_states = self.i2c_read_uint16le()
+        changed = raw_key_states ^ last_key_states
+        unstable = self._unstable
+        if not changed and not unstable:
+            return
 
-        self._last_key_states = self._key_states
-        self._key_states = key_state
+        settle_ms = self._settle_ms
+        change_times = self._change_times
+        key_states = last_key_states
+        for i in range(_KEY_COUNT):
+            key = 1 << i
+            if not (changed | unstable) & key:
+                continue
+            if unstable & key:
+                if not changed & key:
+                    # Bounced back, however long ago the change was seen.
+                    unstable &= ~key
+                elif time.ticks_diff(now, change_times[i]) >= settle_ms:
+                    # Still changed after settle_ms, even if the samples in
+                    # between were sparse.
+                    key_states ^= key
+                    unstable &= ~key
+                continue
+            change_times[i] = now
+            if settle_ms > 0:
+                unstable |= key
+            else:
+                key_states ^= key
+        self._unstable = unstable
+        self._key_states = key_states
+        self._pressed_keys = key_states & ~last_key_states
+        self._released_keys = last_key_states & ~key_states
 
     def key_states(self):
         return self._key_states
@@ -58,3 +180,254 @@ class MatrixKeyboardV3(i2c_device.I2cDevice):
 
     def released(self, key):
         return self._last_key_states & key != 0 and self._key_states & key == 0
+
+    def pressed_keys(self):
+        return self._pressed_keys
+
+    def released_keys(self):
+        return self._released_keys
+
+    def held_keys(self):
+        return self._last_key_states & self._key_states
+
+    def keys(self, key_states):
+        for bit in _PHYSICAL_ORDER:
+            if not key_states:
+                return
+            if key_states >> bit & 1:
+                key_states ^= 1 << bit
+                yield 1 << bit
+
+    def chars(self, key_states):
+        for bit in _PHYSICAL_ORDER:
+            if not key_states:
+                return
+            if key_states >> bit & 1:
+                key_states ^= 1 << bit
+                yield _KEY_CHARS[bit]
+
+    def set_long_press(self,
+                       long_press_ms=_DEFAULT_LONG_PRESS_MS,
+                       repeat_interval_ms=_DEFAULT_REPEAT_INTERVAL_MS):
+        self._long_press_ms = long_press_ms
+        self._repeat_interval_ms = repeat_interval_ms
+
+    def _push_event(self, event, keys, now):
+        head = self._event_head
+        next_head = head + 1
+        if next_head == len(self._event_types):
+            next_head = 0
+        if next_head == self._event_tail:
+            self._events_dropped += 1
+            return
+        self._event_types[head] = event
+        self._event_keys[head] = keys
+        self._event_times[head] = now
+        self._event_head = next_head
+
+    def _scan(self, _=None):
+        if self._bus_locked is not None and self._bus_locked():
+            return
+        self.update()
+        key_states = self._key_states
+        last_key_states = self._last_key_states
+        if key_states == 0 and last_key_states == 0:
+            return
+
+        now = time.ticks_ms()
+        for i in range(_KEY_COUNT):
+            key = 1 << i
+            if key_states & key:
+                if not last_key_states & key:
+                    self._press_times[i] = now
+                    self._push_event(_EVENT_PRESSED, key, now)
+                elif not self._long_pressed & key:
+                    held_ms = time.ticks_diff(now, self._press_times[i])
+                    if self._long_press_ms and held_ms >= self._long_press_ms:
+                        self._long_pressed |= key
+                        self._repeat_times[i] = now
+                        self._push_event(_EVENT_LONG_PRESSED, key, now)
+                elif self._repeat_interval_ms:
+                    since_ms = time.ticks_diff(now, self._repeat_times[i])
+                    if since_ms >= self._repeat_interval_ms:
+                        self._repeat_times[i] = now
+                        self._push_event(_EVENT_REPEATED, key, now)
+            elif last_key_states & key:
+                self._long_pressed &= ~key
+                self._push_event(_EVENT_RELEASED, key, now)
+
+        if key_states & ~last_key_states and key_states & (key_states - 1):
+            self._push_event(_EVENT_CHORD, key_states, now)
+
+    def _timer_callback(self, timer):
+        try:
+            schedule(self._scan_callback, None)
+        except RuntimeError:
+            pass
+
+    def start_scanning(self, period_ms=10, timer_id=-1):
+        self.stop_scanning()
+        self._bus_locked = getattr(self._i2c, "locked", None)
+        self._timer = machine.Timer(timer_id)
+        self._timer.init(period=period_ms,
+                         mode=machine.Timer.PERIODIC,
+                         callback=self._timer_callback)
+
+    def stop_scanning(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    async def scan_task(self, period_ms=10):
+        self._bus_locked = getattr(self._i2c, "locked", None)
+        while True:
+            self._scan()
+            await asyncio.sleep_ms(period_ms)
+
+    def events_dropped(self) -> int:
+        return self._events_dropped
+
+    def get_event(self):
+        tail = self._event_tail
+        if tail == self._event_head:
+            return None
+        event = (self._event_types[tail], self._event_keys[tail],
+                 self._event_times[tail])
+        tail += 1
+        self._event_tail = 0 if tail == len(self._event_types) else tail
+        return event
+
+
+class MatrixKeyboardGroup:
+
+    def __init__(self,
+                 keyboards,
+                 channels=None,
+                 mux_address=_MUX_ADDRESS,
+                 event_queue_size=_DEFAULT_GROUP_EVENT_QUEUE_SIZE):
+        if not keyboards:
+            raise ValueError("keyboards is empty")
+        if channels is not None and len(channels) != len(keyboards):
+            raise ValueError("one mux channel is needed per keyboard")
+        self._keyboards = tuple(keyboards)
+        # Keyboards behind a TCA9548-style mux share one bus; the channel
+        # is only switched when the next keyboard sits on another one.
+        self._channels = None if channels is None else bytes(channels)
+        self._i2c = self._keyboards[0]._i2c
+        # An I2cBus is held across the select and the read, so another
+        # driver cannot switch the channel in between.
+        self._hold_bus = hasattr(self._i2c, "locked")
+        self._mux_address = mux_address
+        self._mux_buffer = bytearray(1)
+        self._mux_channel = -1
+        self._next = 0
+        self._event_devices = bytearray(event_queue_size)
+        self._event_types = bytearray(event_queue_size)
+        self._event_keys = array.array("H", [0] * event_queue_size)
+        self._event_times = array.array("l", [0] * event_queue_size)
+        self._event_head = 0
+        self._event_tail = 0
+        self._events_dropped = 0
+        self._timer = None
+        self._bus_locked = None
+        self._scan_callback = self.scan
+
+    def _select(self, channel):
+        if channel == self._mux_channel:
+            return
+        self._mux_channel = -1
+        self._mux_buffer[0] = 1 << channel
+        self._i2c.writeto(self._mux_address, self._mux_buffer)
+        self._mux_channel = channel
+
+    def _push_event(self, device, event, keys, now):
+        head = self._event_head
+        next_head = head + 1
+        if next_head == len(self._event_types):
+            next_head = 0
+        if next_head == self._event_tail:
+            self._events_dropped += 1
+            return
+        self._event_devices[head] = device
+        self._event_types[head] = event
+        self._event_keys[head] = keys
+        self._event_times[head] = now
+        self._event_head = next_head
+
+    def _drain(self, device, keyboard):
+        tail = keyboard._event_tail
+        head = keyboard._event_head
+        size = len(keyboard._event_types)
+        while tail != head:
+            self._push_event(device, keyboard._event_types[tail],
+                             keyboard._event_keys[tail],
+                             keyboard._event_times[tail])
+            tail += 1
+            if tail == size:
+                tail = 0
+        keyboard._event_tail = tail
+
+    def scan(self, _=None):
+        # Each call samples the next keyboard in turn, so the debounce
+        # interval of one keyboard is spent reading the others.
+        if self._bus_locked is not None and self._bus_locked():
+            return
+        device = self._next
+        self._next = device + 1 if device + 1 < len(self._keyboards) else 0
+        keyboard = self._keyboards[device]
+        if self._channels is None:
+            keyboard._scan()
+        elif self._hold_bus:
+            with self._i2c:
+                self._select(self._channels[device])
+                keyboard._scan()
+        else:
+            self._select(self._channels[device])
+            keyboard._scan()
+        self._drain(device, keyboard)
+
+    def _timer_callback(self, timer):
+        try:
+            schedule(self._scan_callback, None)
+        except RuntimeError:
+            pass
+
+    def _step_ms(self, period_ms):
+        step_ms = period_ms // len(self._keyboards)
+        return step_ms if step_ms > 0 else 1
+
+    def start_scanning(self, period_ms=_DEFAULT_SCAN_PERIOD_MS, timer_id=-1):
+        self.stop_scanning()
+        self._bus_locked = getattr(self._i2c, "locked", None)
+        self._timer = machine.Timer(timer_id)
+        self._timer.init(period=self._step_ms(period_ms),
+                         mode=machine.Timer.PERIODIC,
+                         callback=self._timer_callback)
+
+    def stop_scanning(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    async def scan_task(self, period_ms=_DEFAULT_SCAN_PERIOD_MS):
+        self._bus_locked = getattr(self._i2c, "locked", None)
+        step_ms = self._step_ms(period_ms)
+        while True:
+            self.scan()
+            await asyncio.sleep_ms(step_ms)
+
+    def events_dropped(self) -> int:
+        dropped = self._events_dropped
+        for keyboard in self._keyboards:
+            dropped += keyboard._events_dropped
+        return dropped
+
+    def get_event(self):
+        tail = self._event_tail
+        if tail == self._event_head:
+            return None
+        event = (self._event_devices[tail], self._event_types[tail],
+                 self._event_keys[tail], self._event_times[tail])
+        tail += 1
+        self._event_tail = 0 if tail == len(self._event_types) else tail
+        return event
@@ -0,0 +1,135 @@
+import time
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+try:
+    from micropython import const
+except ImportError:
+
+    def const(x):
+        return x
+
+
+_UTILIZATION_SCALE = const(1000)
+
+
+class _Task:
+
+    def __init__(self, callback, period_ms, budget_ms, name, now) -> None:
+        self.callback = callback
+        self.period_ms = period_ms
+        self.budget_ms = budget_ms
+        self.name = name
+        self.release = now
+        self.runs = 0
+        self.missed = 0
+        self.overruns = 0
+        self.busy_us = 0
+        self.max_us = 0
+
+
+class PollScheduler:
+
+    def __init__(self) -> None:
+        self._tasks = []
+        self._utilization = 0
+
+    def register(self, callback, period_ms, budget_ms, name=None):
+        if period_ms <= 0 or budget_ms <= 0 or budget_ms > period_ms:
+            raise ValueError("invalid poll period or budget")
+        # Earliest-deadline-first meets every deadline as long as the
+        # declared budgets do not exceed the available time.
+        utilization = budget_ms * _UTILIZATION_SCALE // period_ms
+        if self._utilization + utilization > _UTILIZATION_SCALE:
+            raise ValueError("poll budgets exceed the available time")
+        self._utilization += utilization
+        task = _Task(callback, period_ms, budget_ms, name, time.ticks_ms())
+        self._tasks.append(task)
+        return task
+
+    def unregister(self, task) -> None:
+        self._tasks.remove(task)
+        self._utilization -= (task.budget_ms * _UTILIZATION_SCALE //
+                              task.period_ms)
+
+    def _next_task(self, now):
+        # Deadlines are implicit: each poll is due before the task's next
+        # release.
+        next_task = None
+        next_deadline = 0
+        for task in self._tasks:
+            if time.ticks_diff(now, task.release) < 0:
+                continue
+            deadline = time.ticks_add(task.release, task.period_ms)
+            if (next_task is None
+                    or time.ticks_diff(deadline, next_deadline) < 0):
+                next_task = task
+                next_deadline = deadline
+        return next_task
+
+    def _run(self, task) -> None:
+        start = time.ticks_us()
+        task.callback()
+        elapsed_us = time.ticks_diff(time.ticks_us(), start)
+        task.runs += 1
+        task.busy_us += elapsed_us
+        if elapsed_us > task.max_us:
+            task.max_us = elapsed_us
+        if elapsed_us > task.budget_ms * 1000:
+            task.overruns += 1
+
+        deadline = time.ticks_add(task.release, task.period_ms)
+        task.release = deadline
+        lag = time.ticks_diff(time.ticks_ms(), deadline)
+        if lag > 0:
+            task.missed += 1
+            # Periods whose deadlines have already passed are skipped
+            # rather than run back to back to catch up.
+            skipped = lag // task.period_ms
+            if skipped:
+                task.missed += skipped
+                task.release = time.ticks_add(deadline,
+                                              skipped * task.period_ms)
+
+    def run_once(self) -> int:
+        while True:
+            now = time.ticks_ms()
+            task = self._next_task(now)
+            if task is None:
+                break
+            self._run(task)
+
+        delay = None
+        now = time.ticks_ms()
+        for task in self._tasks:
+            remaining = time.ticks_diff(task.release, now)
+            if delay is None or remaining < delay:
+                delay = remaining
+        if delay is None or delay < 0:
+            return 0
+        return delay
+
+    def run(self) -> None:
+        while True:
+            delay = self.run_once()
+            if delay:
+                time.sleep_ms(delay)
+
+    async def run_async(self) -> None:
+        while True:
+            await asyncio.sleep_ms(self.run_once())
+
+    def stats(self) -> list:
+        return [(task.name, task.runs, task.missed, task.overruns,
+                 task.busy_us, task.max_us) for task in self._tasks]
+
+    def reset_stats(self) -> None:
+        for task in self._tasks:
+            task.runs = 0
+            task.missed = 0
+            task.overruns = 0
+            task.busy_us = 0
+            task.max_us = 0
@@ -1,6 +1,11 @@
 import i2c_device
+import os
 import time
-import struct
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 
 try:
     from micropython import const
@@ -10,81 +15,362 @@ except ImportError:
         return x
 
 
+_POLL_INTERVAL_MIN_MS = const(1)
+_POLL_INTERVAL_MAX_MS = const(16)
+_EVENT_POLL_IDLE_MS = const(50)
+_EVENT_POLL_ACTIVE_MS = const(5)
+
+_DEFAULT_I2C_ADDRESS = const(0x30)
+
+_MAX_KEYWORD_DATA_BYTES = const(50)
+
+_RECOGNITION_AUTO = const(0)
+_BUTTON_TRIGGER = const(1)
+_KEYWORD_TRIGGER = const(2)
+_KEYWORD_OT_BUTTON_TRIGGER = const(3)
+
+_EVENT_NONE = const(0)
+_EVENT_START_WAITING_FOR_TRIGGER = const(1)
+_EVENT_BUTTON_TRIGGERED = const(2)
+_EVENT_KEYWORD_TRIGGERED = const(3)
+_EVENT_START_RECOGNIZING = const(4)
+_EVENT_SPEECH_RECOGNIZED = const(5)
+_EVENT_SPEECH_RECOGNITION_TIMED_OUT = const(6)
+
+_DATA_ADDRESS_VERSION = const(0x00)
+_DATA_ADDRESS_BUSY = const(0x01)
+_DATA_ADDRESS_RESET = const(0x02)
+_DATA_ADDRESS_RECOGNITION_MODE = const(0x03)
+_DATA_ADDRESS_RESULT = const(0x04)
+_DATA_ADDRESS_EVENT = const(0x06)
+_DATA_ADDRESS_TIMEOUT = const(0x08)
+_DATA_ADDRESS_KEYWORD_INDEX = const(0x0C)
+_DATA_ADDRESS_KEYWORD_DATA = const(0x0D)
+_DATA_ADDRESS_KEYWORD_LENGTH = const(0x3F)
+_DATA_ADDRESS_ADD_KEYWORD = const(0x40)
+_DATA_ADDRESS_RECOGNIZE = const(0x41)
+
+
+def _deadline(timeout_ms):
+    if timeout_ms is None:
+        return None
+    return time.ticks_add(time.ticks_ms(), timeout_ms)
+
+
 class SpeechRecognizer(i2c_device.I2cDevice):
-    DEFAULT_I2C_ADDRESS: int = const(0x30)
-
-    MAX_KEYWORD_DATA_BYTES: int = const(50)
-
-    RECOGNITION_AUTO: int = const(0)
-    BUTTON_TRIGGER: int = const(1)
-    KEYWORD_TRIGGER: int = const(2)
-    KEYWORD_OT_BUTTON_TRIGGER: int = const(3)
-
-    EVENT_NONE: int = const(0)
-    EVENT_START_WAITING_FOR_TRIGGER: int = const(1)
-    EVENT_BUTTON_TRIGGERED: int = const(2)
-    EVENT_KEYWORD_TRIGGERED: int = const(3)
-    EVENT_START_RECOGNIZING: int = const(4)
-    EVENT_SPEECH_RECOGNIZED: int = const(5)
-    EVENT_SPEECH_RECOGNITION_TIMED_OUT: int = const(6)
-
-    DATA_ADDRESS_VERSION: int = const(0x00)
-    DATA_ADDRESS_BUSY: int = const(0x01)
-    DATA_ADDRESS_RESET: int = const(0x02)
-    DATA_ADDRESS_RECOGNITION_MODE: int = const(0x03)
-    DATA_ADDRESS_RESULT: int = const(0x04)
-    DATA_ADDRESS_EVENT: int = const(0x06)
-    DATA_ADDRESS_TIMEOUT: int = const(0x08)
-    DATA_ADDRESS_KEYWORD_INDEX: int = const(0x0C)
-    DATA_ADDRESS_KEYWORD_DATA: int = const(0x0D)
-    DATA_ADDRESS_KEYWORD_LENGTH: int = const(0x3F)
-    DATA_ADDRESS_ADD_KEYWORD: int = const(0x40)
-    DATA_ADDRESS_RECOGNIZE: int = const(0x41)
-
-    def __init__(self, i2c, i2c_address=DEFAULT_I2C_ADDRESS):
-        super().__init__(i2c, i2c_address)
-        self.reset()
+    DEFAULT_I2C_ADDRESS: int = _DEFAULT_I2C_ADDRESS
 
-    def _wait_until_idle(self):
+    MAX_KEYWORD_DATA_BYTES: int = _MAX_KEYWORD_DATA_BYTES
+
+    RECOGNITION_AUTO: int = _RECOGNITION_AUTO
+    BUTTON_TRIGGER: int = _BUTTON_TRIGGER
+    KEYWORD_TRIGGER: int = _KEYWORD_TRIGGER
+    KEYWORD_OT_BUTTON_TRIGGER: int = _KEYWORD_OT_BUTTON_TRIGGER
+
+    EVENT_NONE: int = _EVENT_NONE
+    EVENT_START_WAITING_FOR_TRIGGER: int = _EVENT_START_WAITING_FOR_TRIGGER
+    EVENT_BUTTON_TRIGGERED: int = _EVENT_BUTTON_TRIGGERED
+    EVENT_KEYWORD_TRIGGERED: int = _EVENT_KEYWORD_TRIGGERED
+    EVENT_START_RECOGNIZING: int = _EVENT_START_RECOGNIZING
+    EVENT_SPEECH_RECOGNIZED: int = _EVENT_SPEECH_RECOGNIZED
+    EVENT_SPEECH_RECOGNITION_TIMED_OUT: int = (
+        _EVENT_SPEECH_RECOGNITION_TIMED_OUT)
+
+    DATA_ADDRESS_VERSION: int = _DATA_ADDRESS_VERSION
+    DATA_ADDRESS_BUSY: int = _DATA_ADDRESS_BUSY
+    DATA_ADDRESS_RESET: int = _DATA_ADDRESS_RESET
+    DATA_ADDRESS_RECOGNITION_MODE: int = _DATA_ADDRESS_RECOGNITION_MODE
+    DATA_ADDRESS_RESULT: int = _DATA_ADDRESS_RESULT
+    DATA_ADDRESS_EVENT: int = _DATA_ADDRESS_EVENT
+    DATA_ADDRESS_TIMEOUT: int = _DATA_ADDRESS_TIMEOUT
+    DATA_ADDRESS_KEYWORD_INDEX: int = _DATA_ADDRESS_KEYWORD_INDEX
+    DATA_ADDRESS_KEYWORD_DATA: int = _DATA_ADDRESS_KEYWORD_DATA
+    DATA_ADDRESS_KEYWORD_LENGTH: int = _DATA_ADDRESS_KEYWORD_LENGTH
+    DATA_ADDRESS_ADD_KEYWORD: int = _DATA_ADDRESS_ADD_KEYWORD
+    DATA_ADDRESS_RECOGNIZE: int = _DATA_ADDRESS_RECOGNIZE
+
+    _version = i2c_device.Register(_DATA_ADDRESS_VERSION)
+    _busy = i2c_device.Register(_DATA_ADDRESS_BUSY)
+    _recognition_mode = i2c_device.Register(_DATA_ADDRESS_RECOGNITION_MODE)
+    _result = i2c_device.Register(_DATA_ADDRESS_RESULT, "<h")
+    _event = i2c_device.Register(_DATA_ADDRESS_EVENT)
+    _timeout = i2c_device.Register(_DATA_ADDRESS_TIMEOUT, "<H")
+
+    def __init__(self,
+                 i2c,
+                 i2c_address=_DEFAULT_I2C_ADDRESS,
+                 repeated_start=False):
+        super().__init__(i2c, i2c_address, repeated_start)
+        self.i2c_cache_registers(_DATA_ADDRESS_RECOGNITION_MODE)
+        self.i2c_cache_registers(_DATA_ADDRESS_TIMEOUT, 2)
+        self._event_callbacks = {}
+        self._event_result = 0
+        self._idle_poll_ms = _EVENT_POLL_IDLE_MS
+        self._active_poll_ms = _EVENT_POLL_ACTIVE_MS
+        self._poll_interval_ms = _EVENT_POLL_IDLE_MS
+        # What the module is known to hold, or None while that is unknown:
+        # before the driver has reset the module or written a keyword.
+        self._keywords = None
+        self._keyword_cache_path = None
+        # The module is reset on first use (or by begin()) rather than here,
+        # so constructing the driver never blocks on the bus.
+        self._begun = False
+
+    def begin(self, reset=True):
+        # reset=False adopts the module as it is, e.g. after a soft reboot
+        # of the host while the module kept power. Only then can the
+        # keyword cache of load_keywords() be trusted.
+        if reset:
+            self.reset()
+        else:
+            self._begun = True
+
+    async def begin_async(self, timeout_ms=None, reset=True):
+        if reset:
+            await self.reset_async(timeout_ms)
+        else:
+            self._begun = True
+
+    def _wait_while_busy(self):
         while True:
-            if self.i2c_read_uint8_from(
-                    SpeechRecognizer.DATA_ADDRESS_BUSY) == 0:
+            if self._busy == 0:
                 break
             time.sleep(0.001)
 
+    def _wait_until_idle(self):
+        if not self._begun:
+            self.reset()
+        self._wait_while_busy()
+
+    async def _wait_until_idle_async(self, deadline=None):
+        if not self._begun:
+            await self._reset_async(deadline)
+        await self._wait_while_busy_async(deadline)
+
+    async def _wait_while_busy_async(self, deadline):
+        interval = _POLL_INTERVAL_MIN_MS
+        while self._busy != 0:
+            if (deadline is not None
+                    and time.ticks_diff(deadline, time.ticks_ms()) <= 0):
+                raise OSError("speech recognizer busy timeouted")
+            await asyncio.sleep_ms(interval)
+            if interval < _POLL_INTERVAL_MAX_MS:
+                interval <<= 1
+
     def reset(self):
-        self._wait_until_idle()
-        self.i2c_write(SpeechRecognizer.DATA_ADDRESS_RESET, 1)
+        self._wait_while_busy()
+        self.i2c_write(_DATA_ADDRESS_RESET, 1)
+        self.i2c_invalidate_cache()
+        self._forget_keywords()
+        # Only a RESET that reached the module counts as bringing it up; a
+        # failed one is retried on the next use.
+        self._begun = True
+
+    async def _reset_async(self, deadline):
+        await self._wait_while_busy_async(deadline)
+        self.i2c_write(_DATA_ADDRESS_RESET, 1)
+        self.i2c_invalidate_cache()
+        self._forget_keywords()
+        self._begun = True
+
+    async def reset_async(self, timeout_ms=None):
+        await self._reset_async(_deadline(timeout_ms))
 
     def version(self):
-        return self.i2c_read_uint8_from(SpeechRecognizer.DATA_ADDRESS_VERSION)
+        return self._version
 
     def set_recognition_mode(self, mode):
+        if SpeechRecognizer._recognition_mode.cached(self, mode):
+            return
         self._wait_until_idle()
-        self.i2c_write(SpeechRecognizer.DATA_ADDRESS_RECOGNITION_MODE, mode)
+        self._recognition_mode = mode
+
+    async def set_recognition_mode_async(self, mode, timeout_ms=None):
+        if SpeechRecognizer._recognition_mode.cached(self, mode):
+            return
+        await self._wait_until_idle_async(_deadline(timeout_ms))
+        self._recognition_mode = mode
 
     def set_timeout(self, timeout_ms):
+        if SpeechRecognizer._timeout.cached(self, timeout_ms):
+            return
         self._wait_until_idle()
-        self.i2c_write_uint16le_to(SpeechRecognizer.DATA_ADDRESS_TIMEOUT,
-                                   timeout_ms)
+        self._timeout = timeout_ms
 
-    def add_keyword(self, index: int, keyword: str):
+    async def set_timeout_async(self, timeout_ms, wait_timeout_ms=None):
+        if SpeechRecognizer._timeout.cached(self, timeout_ms):
+            return
+        await self._wait_until_idle_async(_deadline(wait_timeout_ms))
+        self._timeout = timeout_ms
+
+    def _keyword_bytes(self, keyword: str) -> bytes:
         keyword_bytes = bytes(keyword, "utf8")
-        if len(keyword_bytes) > SpeechRecognizer.MAX_KEYWORD_DATA_BYTES:
+        if len(keyword_bytes) > _MAX_KEYWORD_DATA_BYTES:
             raise ValueError("the keyword length is longer than 50 bytes")
+        return keyword_bytes
 
+    def add_keyword(self, index: int, keyword: str):
+        keyword_bytes = self._keyword_bytes(keyword)
         self._wait_until_idle()
-        self.i2c_write(SpeechRecognizer.DATA_ADDRESS_KEYWORD_INDEX, index)
-        self.i2c_write(SpeechRecognizer.DATA_ADDRESS_KEYWORD_DATA,
-                       keyword_bytes)
-        self.i2c_write(SpeechRecognizer.DATA_ADDRESS_KEYWORD_LENGTH,
-                       len(keyword_bytes))
-        self.i2c_write(SpeechRecognizer.DATA_ADDRESS_ADD_KEYWORD, 1)
+        self._write_keyword(index, keyword, keyword_bytes)
+
+    async def add_keyword_async(self, index: int, keyword: str,
+                                timeout_ms=None):
+        keyword_bytes = self._keyword_bytes(keyword)
+        await self._wait_until_idle_async(_deadline(timeout_ms))
+        self._write_keyword(index, keyword, keyword_bytes)
+
+    def _write_keyword(self, index: int, keyword: str, keyword_bytes: bytes):
+        # The cache on flash no longer matches the module from here until
+        # load_keywords() saves it again.
+        self._drop_keyword_cache()
+        # KEYWORD_INDEX/KEYWORD_DATA and KEYWORD_LENGTH/ADD_KEYWORD are
+        # adjacent, so each pair goes out as one burst write.
+        self.i2c_write(_DATA_ADDRESS_KEYWORD_INDEX, index, keyword_bytes)
+        self.i2c_write(_DATA_ADDRESS_KEYWORD_LENGTH, len(keyword_bytes), 1)
+        if self._keywords is None:
+            self._keywords = {}
+        self._keywords[index] = keyword
+
+    def _forget_keywords(self):
+        # RESET clears every keyword on the module.
+        self._drop_keyword_cache()
+        self._keywords = {}
+
+    def _drop_keyword_cache(self):
+        if self._keyword_cache_path is None:
+            return
+        try:
+            os.remove(self._keyword_cache_path)
+        except OSError:
+            pass
+        self._keyword_cache_path = None
+
+    def _load_keyword_cache(self, cache_path):
+        keywords = {}
+        if cache_path is None:
+            return keywords
+        try:
+            with open(cache_path) as file:
+                for line in file:
+                    fields = line.rstrip("\n").split("\t", 1)
+                    if len(fields) == 2:
+                        keywords[int(fields[0])] = fields[1]
+        except (OSError, ValueError):
+            keywords.clear()
+        return keywords
+
+    def _save_keyword_cache(self, cache_path):
+        with open(cache_path, "w") as file:
+            for index, keyword in self._keywords.items():
+                file.write("%d\t%s\n" % (index, keyword))
+
+    def load_keywords(self, table, cache_path=None, force=False):
+        start = time.ticks_ms()
+        if not self._begun:
+            self.reset()
+        if self._keywords is None:
+            # The driver has neither reset the module nor written to it, so
+            # it still holds what the cache recorded.
+            self._keywords = self._load_keyword_cache(cache_path)
+            self._keyword_cache_path = cache_path
+        items = table.items() if isinstance(table, dict) else table
+
+        uploaded = 0
+        skipped = 0
+        for index, keyword in items:
+            if not force and self._keywords.get(index) == keyword:
+                skipped += 1
+                continue
+            keyword_bytes = self._keyword_bytes(keyword)
+            self._wait_until_idle()
+            self._write_keyword(index, keyword, keyword_bytes)
+            uploaded += 1
+
+        if cache_path is not None and cache_path != self._keyword_cache_path:
+            self._save_keyword_cache(cache_path)
+            self._keyword_cache_path = cache_path
+        return uploaded, skipped, time.ticks_diff(time.ticks_ms(), start)
 
     def recognize(self) -> int:
+        # RESULT holds the outcome of this recognition only once BUSY has
+        # cleared again, as in recognize_async().
         self._wait_until_idle()
-        self.i2c_write(SpeechRecognizer.DATA_ADDRESS_RECOGNIZE, 1)
-        return self.i2c_read_int16le_from(SpeechRecognizer.DATA_ADDRESS_RESULT)
+        self.i2c_write(_DATA_ADDRESS_RECOGNIZE, 1)
+        self._wait_while_busy()
+        return self._result
+
+    async def recognize_async(self, timeout_ms=None) -> int:
+        deadline = _deadline(timeout_ms)
+        await self._wait_until_idle_async(deadline)
+        self.i2c_write(_DATA_ADDRESS_RECOGNIZE, 1)
+        await self._wait_until_idle_async(deadline)
+        return self._result
 
     def get_event(self):
-        return self.i2c_read_uint8_from(SpeechRecognizer.DATA_ADDRESS_EVENT)
+        return self._event
+
+    def on_event(self, event, callback):
+        if callback is None:
+            self._event_callbacks.pop(event, None)
+        else:
+            self._event_callbacks[event] = callback
+
+    def set_event_poll_intervals(self, idle_ms, active_ms):
+        self._idle_poll_ms = idle_ms
+        self._active_poll_ms = active_ms
+        self._poll_interval_ms = idle_ms
+
+    def event_result(self) -> int:
+        return self._event_result
+
+    def poll_event(self):
+        # RESULT (0x04, int16le) and EVENT (0x06) are read in one burst.
+        buffer = self._read_register(_DATA_ADDRESS_RESULT, 3)
+        event = buffer[2]
+        if event == _EVENT_NONE:
+            return event
+
+        result = buffer[0] | buffer[1] << 8
+        if result & 0x8000:
+            result -= 0x10000
+        self._event_result = result
+        if (event == _EVENT_BUTTON_TRIGGERED
+                or event == _EVENT_KEYWORD_TRIGGERED
+                or event == _EVENT_START_RECOGNIZING):
+            self._poll_interval_ms = self._active_poll_ms
+        else:
+            self._poll_interval_ms = self._idle_poll_ms
+
+        callback = self._event_callbacks.get(event)
+        if callback is not None:
+            callback(event, result)
+        return event
+
+    def events(self):
+        while True:
+            event = self.poll_event()
+            if event == _EVENT_NONE:
+                time.sleep_ms(self._poll_interval_ms)
+            else:
+                yield event, self._event_result
+
+    def events_async(self):
+        return _SpeechEvents(self)
+
+
+class _SpeechEvents:
+
+    def __init__(self, recognizer) -> None:
+        self._recognizer = recognizer
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        recognizer = self._recognizer
+        while True:
+            event = recognizer.poll_event()
+            if event != _EVENT_NONE:
+                return event, recognizer._event_result
+            await asyncio.sleep_ms(recognizer._poll_interval_ms)
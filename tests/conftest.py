@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hardware_simulator  # noqa: E402
+
+_DRIVER_MODULES = ("i2c_device", "i2c_bus", "matrix_keyboard_v3",
+                   "speech_recognizer", "gd5800_mp3_serial",
+                   "transaction_trace", "poll_scheduler")
+_SIMULATED_MODULES = ("machine", "select", "time")
+
+
+@pytest.fixture
+def simulator():
+    # Drivers bind machine and time when they are imported, so each test
+    # imports them afresh against its own simulator.
+    saved = {name: sys.modules.get(name)
+             for name in _DRIVER_MODULES + _SIMULATED_MODULES}
+    try:
+        import asyncio
+        sleep_ms = getattr(asyncio, "sleep_ms", None)
+    except ImportError:
+        asyncio = None
+    for name in _DRIVER_MODULES:
+        sys.modules.pop(name, None)
+    simulator = hardware_simulator.Simulator()
+    simulator.install()
+    yield simulator
+    for name, module in saved.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+    if asyncio is not None:
+        if sleep_ms is None:
+            del asyncio.sleep_ms
+        else:
+            asyncio.sleep_ms = sleep_ms
@@ -0,0 +1,420 @@
+import asyncio
+
+import pytest
+
+import hardware_simulator
+
+_STATUS_FRAME = b"\xaa\x04\x10\x00\x01\xef"
+_VOLUME_FRAME = b"\xaa\x04\x11\x00\x14\xef"
+
+
+def _frames(parser):
+    frames = []
+    frame = parser.next_frame()
+    while frame is not None:
+        frames.append(bytes(frame))
+        frame = parser.next_frame()
+    return frames
+
+
+def test_parser_reassembles_fragmented_frames(simulator):
+    import gd5800_mp3_serial
+
+    parser = gd5800_mp3_serial.Gd5800FrameParser()
+    frames = []
+    for byte in _STATUS_FRAME + _VOLUME_FRAME:
+        parser.feed(bytes((byte,)))
+        frames += _frames(parser)
+    assert frames == [_STATUS_FRAME[2:-1], _VOLUME_FRAME[2:-1]]
+    assert parser.errors == 0
+
+
+def test_parser_drains_fake_uart_in_chunks(simulator):
+    import gd5800_mp3_serial
+
+    uart = hardware_simulator.SimulatedUART(simulator.clock)
+    parser = gd5800_mp3_serial.Gd5800FrameParser()
+    uart.inject(b"\x00\x13" + _STATUS_FRAME + _VOLUME_FRAME[:3])
+    uart.inject(_VOLUME_FRAME[3:], 5000)
+    frames = []
+    while uart.next_arrival_us() is not None or uart.any():
+        simulator.clock.sleep_ms(2)
+        parser.fill_from(uart)
+        frames += _frames(parser)
+    assert frames == [_STATUS_FRAME[2:-1], _VOLUME_FRAME[2:-1]]
+
+
+@pytest.mark.parametrize("garbage", (
+    b"\xaa\x04\x10\x00\x01\x00",  # wrong end byte
+    b"\xaa\x01\xef",  # too short to carry a command byte
+    b"\xaa\xff\x10",  # longer than the buffer
+    b"\xaa\x10",  # length byte corrupt, frame never completes
+    b"\xaa\x05\x10\xaa",  # header inside a truncated frame
+))
+def test_parser_resynchronizes_without_losing_next_frame(simulator, garbage):
+    import gd5800_mp3_serial
+
+    parser = gd5800_mp3_serial.Gd5800FrameParser()
+    parser.feed(garbage + _STATUS_FRAME)
+    assert _frames(parser) == [_STATUS_FRAME[2:-1]]
+    assert parser.errors > 0
+    parser.feed(_VOLUME_FRAME)
+    assert _frames(parser) == [_VOLUME_FRAME[2:-1]]
+
+
+def test_parser_waits_for_incomplete_frame(simulator):
+    import gd5800_mp3_serial
+
+    parser = gd5800_mp3_serial.Gd5800FrameParser()
+    parser.feed(_STATUS_FRAME[:4])
+    assert parser.next_frame() is None
+    parser.feed(_STATUS_FRAME[4:])
+    assert _frames(parser) == [_STATUS_FRAME[2:-1]]
+    assert parser.errors == 0
+
+
+def test_parser_recovers_from_full_buffer_of_garbage(simulator):
+    import gd5800_mp3_serial
+
+    parser = gd5800_mp3_serial.Gd5800FrameParser(16)
+    parser.feed(b"\xaa\x0e" + bytes(30))
+    assert parser.next_frame() is None
+    parser.feed(_STATUS_FRAME)
+    assert _frames(parser) == [_STATUS_FRAME[2:-1]]
+
+
+def test_query_recovers_from_stray_header(simulator):
+    import gd5800_mp3_serial
+
+    uart = simulator.attach_uart(1, hardware_simulator.Gd5800Model())
+    player = gd5800_mp3_serial.Gd5800Mp3Serial()
+    player.play()
+    uart.inject(b"\xaa\x10")
+    start_us = simulator.clock.now_us
+    assert player.status == player.STATUS_PLAYING
+    assert simulator.clock.now_us - start_us < 50000
+    stats = player.command_stats()
+    assert stats["retries"] == 0
+    assert stats["timeouts"] == 0
+
+
+def _player(simulator):
+    import gd5800_mp3_serial
+
+    model = hardware_simulator.Gd5800Model()
+    uart = simulator.attach_uart(1, model)
+    written = []
+    write = uart.write
+
+    def record(data):
+        written.append(bytes(data))
+        return write(data)
+
+    uart.write = record
+    return gd5800_mp3_serial.Gd5800Mp3Serial(), model, written
+
+
+@pytest.mark.parametrize("method, args, frame", (
+    ("play_combined_list", ((1, 2, 0x1234),),
+     b"\x7e\x08\x47\x00\x01\x00\x02\x12\x34\xef"),
+    ("play_combined_list", ([0xFFFF],), b"\x7e\x04\x47\xff\xff\xef"),
+    ("interject_combined_list", ((5, 0x0100),),
+     b"\x7e\x06\x48\x00\x05\x01\x00\xef"),
+    ("interlude_by_index", (0x0102,), b"\x7e\x04\x43\x01\x02\xef"),
+    ("interlude_in_folder", (2, 3), b"\x7e\x04\x44\x02\x03\xef"),
+    ("play_in_folder", (1, 255), b"\x7e\x04\x42\x01\xff\xef"),
+    ("play_by_index_in_loop", (0x0203,), b"\x7e\x04\x49\x02\x03\xef"),
+))
+def test_playback_frames(simulator, method, args, frame):
+    player, model, written = _player(simulator)
+    getattr(player, method)(*args)
+    assert written == [frame]
+    assert model.commands == [frame[2:-1]]
+
+
+def test_combined_list_length_limit(simulator):
+    player, model, written = _player(simulator)
+    tracks = list(range(1, player.MAX_COMBINED_LIST_LENGTH + 1))
+    player.play_combined_list(tracks)
+    frame = written[0]
+    assert len(frame) == 256
+    assert frame[:3] == b"\x7e\xfe\x47"
+    assert frame[-3:] == b"\x00\x7e\xef"
+    for i, track in enumerate(tracks):
+        assert frame[3 + 2 * i:5 + 2 * i] == bytes((track >> 8, track & 0xFF))
+    with pytest.raises(ValueError):
+        player.play_combined_list(tracks + [127])
+    assert len(written) == 1
+
+
+@pytest.mark.parametrize("method, args", (
+    ("play_combined_list", ((),)),
+    ("play_combined_list", ((1, 0x10000),)),
+    ("play_combined_list", ((-1,),)),
+    ("interject_combined_list", ([],)),
+    ("interject_combined_list", ((0x10000,),)),
+    ("interlude_by_index", (0x10000,)),
+    ("interlude_by_index", (-1,)),
+    ("interlude_in_folder", (256, 1)),
+    ("interlude_in_folder", (1, -1)),
+    ("play_in_folder", (-1, 1)),
+    ("play_in_folder", (1, 256)),
+    ("play_by_index_in_loop", (0x10000,)),
+))
+def test_playback_rejects_invalid_arguments(simulator, method, args):
+    player, model, written = _player(simulator)
+    with pytest.raises(ValueError):
+        getattr(player, method)(*args)
+    assert written == []
+    assert model.commands == []
+
+
+class _AckingGd5800Model(hardware_simulator.Gd5800Model):
+    # Acknowledges every query with a short frame before the data frame,
+    # or, with data=False, answers queries with the short frame only.
+
+    def __init__(self, data=True) -> None:
+        super().__init__()
+        self.data = data
+
+    def handle(self, command):
+        response = super().handle(command)
+        if len(response) == 4:
+            return response
+        ack = self._respond(command[0])
+        return ack + response if self.data else ack
+
+
+def test_query_skips_short_ack_before_data(simulator):
+    import gd5800_mp3_serial
+
+    simulator.attach_uart(1, _AckingGd5800Model())
+    player = gd5800_mp3_serial.Gd5800Mp3Serial()
+    assert player.volume == 20
+    stats = player.command_stats()
+    assert stats["retries"] == 0
+    assert stats["nacks"] == 0
+
+
+def test_query_without_data_frame_is_rejected(simulator):
+    import gd5800_mp3_serial
+
+    simulator.attach_uart(1, _AckingGd5800Model(data=False))
+    player = gd5800_mp3_serial.Gd5800Mp3Serial()
+    player.set_retry_policy(retries=1)
+    with pytest.raises(gd5800_mp3_serial.Gd5800NackError) as error:
+        player.volume
+    assert error.value.args == ("gd5800 rejected command 0x%02x"
+                                % gd5800_mp3_serial._COMMAND_GET_VOLUME,)
+    assert player.command_stats()["nacks"] == 2
+
+
+class _StreamReader:
+    # MicroPython's asyncio.StreamReader(stream), which CPython lacks, over
+    # a simulated UART.
+
+    def __init__(self, uart) -> None:
+        self._uart = uart
+
+    async def read(self, count):
+        while True:
+            data = self._uart.read(count)
+            if data:
+                return data
+            await asyncio.sleep_ms(1)
+
+
+class _StreamWriter:
+
+    def __init__(self, uart, extra) -> None:
+        self._uart = uart
+        self._buffer = bytearray()
+
+    def write(self, data) -> None:
+        self._buffer += data
+
+    async def drain(self) -> None:
+        data = bytes(self._buffer)
+        self._buffer = bytearray()
+        self._uart.write(data)
+
+
+class _FlakyGd5800Model(hardware_simulator.Gd5800Model):
+    # Ignores the first `drop` commands, and holds back the answer to a
+    # volume query until the next command has been answered.
+
+    def __init__(self, drop=0, reorder=False) -> None:
+        super().__init__()
+        self.drop = drop
+        self.reorder = reorder
+        self._held = b""
+
+    def handle(self, command):
+        if self.drop:
+            self.drop -= 1
+            return b""
+        response = super().handle(command)
+        if self.reorder and command[0] == 0x11 and not self._held:
+            self._held = response
+            return b""
+        response += self._held
+        self._held = b""
+        return response
+
+
+def _async_player(simulator, monkeypatch, model, **kwargs):
+    import gd5800_mp3_serial
+
+    monkeypatch.setattr(asyncio, "StreamReader", _StreamReader,
+                        raising=False)
+    monkeypatch.setattr(asyncio, "StreamWriter", _StreamWriter,
+                        raising=False)
+    uart = simulator.attach_uart(1, model)
+    return gd5800_mp3_serial.AsyncGd5800Mp3Serial(uart=uart, **kwargs)
+
+
+def test_async_commands_are_matched_by_command_byte(simulator, monkeypatch):
+    model = _FlakyGd5800Model(reorder=True)
+    player = _async_player(simulator, monkeypatch, model)
+    model.status = model.STATUS_PLAYING
+
+    async def queries():
+        try:
+            return await asyncio.gather(player.get_volume(),
+                                        player.get_status())
+        finally:
+            player.close()
+
+    # The volume answer arrives after the status answer.
+    assert asyncio.run(queries()) == [20, model.STATUS_PLAYING]
+    assert model.commands == [b"\x11", b"\x10"]
+
+
+def test_async_command_is_retried(simulator, monkeypatch):
+    import gd5800_mp3_serial
+
+    model = _FlakyGd5800Model(drop=2)
+    player = _async_player(simulator, monkeypatch, model, timeout_ms=20,
+                           retries=2)
+
+    async def query():
+        try:
+            return await player.get_volume()
+        finally:
+            player.close()
+
+    assert asyncio.run(query()) == 20
+    assert model.drop == 0
+
+    model.drop = 3
+    with pytest.raises(gd5800_mp3_serial.Gd5800TimeoutError):
+        asyncio.run(query())
+    assert model.drop == 0
+
+
+def test_async_fire_and_forget(simulator, monkeypatch):
+    model = _FlakyGd5800Model()
+    player = _async_player(simulator, monkeypatch, model)
+
+    async def commands():
+        try:
+            await player.set_volume(30)
+            assert model.commands == [b"\x31\x1e"]
+            await player.play()
+            # Let the acknowledgements arrive.
+            await asyncio.sleep_ms(20)
+            model.notify(0x3D, 0, 7)
+            await asyncio.sleep_ms(20)
+            return await player.get_volume()
+        finally:
+            player.close()
+
+    assert asyncio.run(commands()) == 30
+    # Late acknowledgements of sent commands are not notifications; the
+    # frame the module sent on its own is.
+    assert player.get_notification() == b"\x3d\x00\x07"
+    assert player.get_notification() is None
+
+
+def _queries(model):
+    return [command for command in model.commands
+            if 0x10 <= command[0] <= 0x13]
+
+
+def test_state_queries_go_to_module_without_ttl(simulator):
+    player, model, _ = _player(simulator)
+    assert player.volume == 20
+    assert player.volume == 20
+    assert len(_queries(model)) == 2
+    assert player.round_trips_avoided() == 0
+
+
+def test_state_mirror_serves_queries_within_ttl(simulator):
+    player, model, _ = _player(simulator)
+    player.set_state_ttl(status_ms=100, volume_ms=100)
+    assert player.volume == 20
+    model.volume = 25
+    assert player.volume == 20
+    assert len(_queries(model)) == 1
+    assert player.round_trips_avoided() == 1
+    simulator.clock.sleep_ms(100)
+    assert player.volume == 25
+    assert len(_queries(model)) == 2
+
+    # Commands with a known outcome update the mirror without a query.
+    player.volume = 30
+    player.play()
+    assert player.volume == 30
+    assert player.status == player.STATUS_PLAYING
+    assert len(_queries(model)) == 2
+    assert player.round_trips_avoided() == 3
+
+    # Fields without a TTL are still queried every time.
+    assert player.equalizer == 0
+    assert len(_queries(model)) == 3
+
+
+def test_state_mirror_is_invalidated(simulator):
+    player, model, _ = _player(simulator)
+    player.set_state_ttl(100, 100, 100, 100)
+    player.volume = 30
+    player.volume_up()
+    assert player.volume == 31
+    assert len(_queries(model)) == 1
+
+    player.refresh()
+    assert [query[0] for query in _queries(model)[1:]] == [0x10, 0x11, 0x12,
+                                                            0x13]
+    player.reset()
+    assert player.volume == 20
+    assert len(_queries(model)) == 6
+
+
+def test_notification_callback_may_send_commands(simulator):
+    player, model, written = _player(simulator)
+    notified = []
+
+    def on_track_finished(frame):
+        notified.append(bytes(frame))
+        player.play_by_index(3)
+
+    player.on_notification(0x3D, on_track_finished)
+    player.play()
+    # The module reports a finished track while a status query waits for
+    # its response.
+    model.notify(0x3D, 0, 7)
+    assert player.status == player.STATUS_PLAYING
+    assert notified == [b"\x3d\x00\x07"]
+    assert model.commands[-2:] == [b"\x10", b"\x41\x00\x03"]
+    stats = player.command_stats()
+    assert stats["retries"] == 0
+    assert stats["timeouts"] == 0
+    assert player.get_notification() == b"\x3d\x00\x07"
+
+    # Outside a command, poll_notifications() calls back at once.
+    model.notify(0x3D, 0, 8)
+    simulator.clock.sleep_ms(20)
+    player.poll_notifications()
+    assert notified[-1] == b"\x3d\x00\x08"
+    assert model.commands[-1] == b"\x41\x00\x03"
+    assert player.command_stats()["retries"] == 0
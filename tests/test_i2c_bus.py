@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+import hardware_simulator
+
+
+def test_async_lock_holds_bus_across_awaits(simulator):
+    import i2c_bus
+    import i2c_device
+
+    simulator.i2c.attach(0x50, hardware_simulator.RegisterModel())
+    bus = i2c_bus.I2cBus(simulator.i2c)
+    holder = i2c_device.I2cDevice(bus, 0x50)
+    other = i2c_device.I2cDevice(bus, 0x50)
+    order = []
+
+    async def hold():
+        async with bus.async_lock:
+            holder.i2c_write_uint8_to(0x10, 1)
+            order.append("holder")
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            holder.i2c_read_uint8_from(0x10)
+            order.append("holder")
+
+    async def interleave():
+        await asyncio.sleep(0)
+        assert bus.locked()
+        with pytest.raises(RuntimeError):
+            other.i2c_read_uint8_from(0x10)
+        order.append("blocked")
+        async with bus.async_lock:
+            order.append("other")
+            assert other.i2c_read_uint8_from(0x10) == 1
+
+    async def main():
+        await asyncio.gather(hold(), interleave())
+
+    asyncio.run(main())
+    assert order == ["holder", "blocked", "holder", "other"]
+    assert not bus.locked()
+
+
+def test_background_scan_defers_to_async_holder(simulator):
+    import i2c_bus
+    import matrix_keyboard_v3
+
+    keypad = simulator.i2c.attach(
+        matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.KeypadModel(simulator.clock))
+    bus = i2c_bus.I2cBus(simulator.i2c)
+    keyboard = matrix_keyboard_v3.MatrixKeyboardV3(bus)
+
+    async def main():
+        scanner = asyncio.create_task(keyboard.scan_task(1))
+        async with bus.async_lock:
+            reads = keypad.reads
+            for _ in range(5):
+                await asyncio.sleep_ms(1)
+            assert keypad.reads == reads
+        for _ in range(5):
+            await asyncio.sleep_ms(1)
+        assert keypad.reads > reads
+        scanner.cancel()
+
+    asyncio.run(main())
@@ -0,0 +1,347 @@
+import gc
+
+import pytest
+
+import hardware_simulator
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_REPEAT = 100
+
+_READ_TYPES = ("byte", "int8", "uint8", "int16le", "uint16le", "int32le",
+               "uint32le", "int16be", "uint16be", "int32be", "uint32be")
+_WRITE_TYPES = ("int8", "uint8", "int16le", "uint16le", "int32le",
+                "uint32le", "int64le", "uint64le", "int16be", "uint16be",
+                "int32be", "uint32be", "int64be", "uint64be")
+
+
+class _RegisterBus:
+    # A bus that serves transfers from a fixed register file without
+    # allocating, so any allocation measured comes from the driver.
+
+    def __init__(self) -> None:
+        self.registers = bytearray(256)
+        self.pointer = 0
+
+    def writeto(self, address, buffer, stop=True) -> int:
+        count = len(buffer)
+        self.pointer = buffer[0]
+        i = 1
+        while i < count:
+            self.registers[self.pointer + i - 1] = buffer[i]
+            i += 1
+        return count
+
+    def readfrom_into(self, address, buffer, stop=True) -> None:
+        count = len(buffer)
+        i = 0
+        while i < count:
+            buffer[i] = self.registers[self.pointer + i]
+            i += 1
+
+    def readfrom_mem_into(self, address, register_address, buffer,
+                          addrsize=8) -> None:
+        self.pointer = register_address
+        self.readfrom_into(address, buffer)
+
+    def readfrom(self, address, count, stop=True) -> bytes:
+        raise AssertionError("typed helpers must read into scratch buffers")
+
+    def readfrom_mem(self, address, register_address, count,
+                     addrsize=8) -> bytes:
+        raise AssertionError("typed helpers must read into scratch buffers")
+
+
+def _allocated(function) -> int:
+    function()
+    gc.collect()
+    if tracemalloc is None:
+        # On MicroPython the allocation counter only grows while the
+        # collector is off, so it counts every byte allocated.
+        gc.disable()
+        start = gc.mem_alloc()
+        for _ in range(_REPEAT):
+            function()
+        allocated = gc.mem_alloc() - start
+        gc.enable()
+        return allocated
+    # CPython frees most objects as soon as they are dropped, so the peak
+    # is the closest measure: anything a call allocates shows up in it.
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in range(_REPEAT):
+        function()
+    allocated = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return allocated
+
+
+def _no_op() -> None:
+    pass
+
+
+@pytest.mark.parametrize("repeated_start", (False, True))
+def test_typed_helpers_do_not_allocate(simulator, repeated_start):
+    import i2c_device
+
+    device = i2c_device.I2cDevice(_RegisterBus(), 0x50, repeated_start)
+    # Values stay below 256 so CPython does not box the results.
+    baseline = _allocated(_no_op)
+    for name in _READ_TYPES:
+        read = getattr(device, "i2c_read_" + name)
+        read_from = getattr(device, "i2c_read_" + name + "_from")
+        assert _allocated(read) <= baseline, name
+        assert _allocated(lambda: read_from(0x10)) <= baseline, name
+    for name in _WRITE_TYPES:
+        write = getattr(device, "i2c_write_" + name)
+        write_to = getattr(device, "i2c_write_" + name + "_to")
+        assert _allocated(lambda: write(0x12)) <= baseline, name
+        assert _allocated(lambda: write_to(0x10, 0x12)) <= baseline, name
+
+
+@pytest.mark.parametrize("name, format", (
+    ("int8", "b"),
+    ("int16le", "<h"),
+    ("uint16le", "<H"),
+    ("int32le", "<i"),
+    ("uint32le", "<I"),
+    ("int16be", ">h"),
+    ("uint16be", ">H"),
+    ("int32be", ">i"),
+    ("uint32be", ">I"),
+))
+@pytest.mark.parametrize("data", (b"\x81\x02\x03\xf4", b"\x7f\xff\xff\x80"))
+def test_typed_reads_decode_without_struct(simulator, monkeypatch, name,
+                                           format, data):
+    import struct
+
+    import i2c_device
+
+    expected = struct.unpack_from(format, data)[0]
+    # CPython reuses the one-item tuple struct returns, so the allocation
+    # test cannot see it; a decoder that falls back to struct fails here.
+    monkeypatch.setattr(struct, "unpack_from", None)
+    bus = _RegisterBus()
+    bus.registers[0x10:0x14] = data
+    device = i2c_device.I2cDevice(bus, 0x50)
+    assert getattr(device, "i2c_read_" + name + "_from")(0x10) == expected
+    bus.pointer = 0x10
+    assert getattr(device, "i2c_read_" + name)() == expected
+
+
+@pytest.mark.parametrize("repeated_start, transactions",
+                         ((False, 2), (True, 1)))
+def test_register_read_transactions(simulator, repeated_start,
+                                    transactions):
+    import i2c_device
+
+    model = simulator.i2c.attach(0x50, hardware_simulator.RegisterModel())
+    model.registers[0x10:0x14] = b"\x01\x02\x03\x04"
+    device = i2c_device.I2cDevice(simulator.i2c, 0x50, repeated_start)
+    for read, expected in (
+        (device.i2c_read_uint8_from, 0x01),
+        (device.i2c_read_uint16le_from, 0x0201),
+        (device.i2c_read_int16be_from, 0x0102),
+        (device.i2c_read_uint32be_from, 0x01020304),
+    ):
+        simulator.i2c.stats.reset()
+        assert read(0x10) == expected
+        assert simulator.i2c.stats.transactions == transactions
+    simulator.i2c.stats.reset()
+    assert device.i2c_read_from(0x10, 3) == b"\x01\x02\x03"
+    assert simulator.i2c.stats.transactions == transactions
+
+
+def test_shared_bus_register_read_transactions(simulator):
+    import i2c_bus
+    import i2c_device
+
+    simulator.i2c.attach(0x50, hardware_simulator.RegisterModel())
+    device = i2c_device.I2cDevice(i2c_bus.I2cBus(simulator.i2c), 0x50)
+    simulator.i2c.stats.reset()
+    device.i2c_read_uint16le_from(0x10)
+    assert simulator.i2c.stats.transactions == 2
+
+
+def test_traced_bus_keeps_bus_methods(simulator):
+    import i2c_bus
+    import i2c_device
+    import matrix_keyboard_v3
+    import transaction_trace
+
+    keypad = simulator.i2c.attach(
+        matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.KeypadModel(simulator.clock))
+    simulator.i2c.attach(0x50, hardware_simulator.RegisterModel())
+    bus = i2c_bus.I2cBus(simulator.i2c)
+    trace = transaction_trace.TransactionTrace()
+    keyboard = matrix_keyboard_v3.MatrixKeyboardV3(bus, settle_ms=0)
+    keyboard.i2c_set_trace(trace)
+    assert keyboard._i2c.scan() == bus.scan()
+
+    # Background scans still defer to whoever holds the bus.
+    keyboard.start_scanning(1)
+    with bus:
+        simulator.clock.sleep_ms(10)
+    assert keypad.reads == 0
+    simulator.clock.sleep_ms(10)
+    keyboard.stop_scanning()
+    assert keypad.reads > 0
+    assert trace.total(i2c_device.I2cDevice.TRACE_READ) == keypad.reads
+
+    device = i2c_device.I2cDevice(bus, 0x50)
+    device.i2c_set_trace(trace)
+    device._i2c.writeto_mem(0x50, 0x10, b"\x01\x02")
+    assert trace.count(i2c_device.I2cDevice.TRACE_WRITE, 0x10) == 1
+    assert device.i2c_read_uint16le_from(0x10) == 0x0201
+    # The read overwrites the scratch buffer that held the register.
+    assert trace.count(i2c_device.I2cDevice.TRACE_READ, 0x10) == 1
+    assert trace.count(i2c_device.I2cDevice.TRACE_READ, 0x01) == 0
+
+
+def _cached_device(simulator):
+    import i2c_device
+
+    model = simulator.i2c.attach(0x50, hardware_simulator.RegisterModel())
+    device = i2c_device.I2cDevice(simulator.i2c, 0x50)
+    device.i2c_cache_registers(0x20, 4)
+    simulator.i2c.stats.reset()
+    return device, model
+
+
+def test_cache_skips_unchanged_writes(simulator):
+    device, model = _cached_device(simulator)
+    device.i2c_write_uint8_to(0x20, 5)
+    assert simulator.i2c.stats.transactions == 1
+    assert device.i2c_cached(0x20, 5)
+    assert not device.i2c_cached(0x20, 6)
+    device.i2c_write_uint8_to(0x20, 5)
+    assert simulator.i2c.stats.transactions == 1
+    # The written value is served back without a read.
+    assert device.i2c_read_uint8_from(0x20) == 5
+    assert simulator.i2c.stats.transactions == 1
+    device.i2c_write_uint8_to(0x20, 6)
+    assert simulator.i2c.stats.transactions == 2
+    assert model.registers[0x20] == 6
+
+    # Registers outside the cached range always reach the bus.
+    device.i2c_write_uint8_to(0x30, 5)
+    device.i2c_write_uint8_to(0x30, 5)
+    assert simulator.i2c.stats.transactions == 4
+
+
+def test_cache_serves_repeated_reads(simulator):
+    device, model = _cached_device(simulator)
+    model.registers[0x20:0x22] = b"\x34\x12"
+    assert device.i2c_read_uint16le_from(0x20) == 0x1234
+    transactions = simulator.i2c.stats.transactions
+    assert device.i2c_read_uint16le_from(0x20) == 0x1234
+    assert device.i2c_read_from(0x20, 2) == b"\x34\x12"
+    assert simulator.i2c.stats.transactions == transactions
+
+
+def test_deferred_writes_flush_as_one_transfer(simulator):
+    device, model = _cached_device(simulator)
+    device.i2c_defer_writes()
+    device.i2c_write_uint8_to(0x21, 1)
+    device.i2c_write_uint8_to(0x23, 3)
+    device.i2c_write_uint8_to(0x22, 2)
+    assert simulator.i2c.stats.transactions == 0
+    assert model.registers[0x21:0x24] == b"\x00\x00\x00"
+    # Reads see the pending values, not the stale device registers.
+    assert device.i2c_read_from(0x20, 4) == b"\x00\x01\x02\x03"
+
+    simulator.i2c.stats.reset()
+    device.i2c_flush()
+    assert simulator.i2c.stats.transactions == 1
+    assert model.registers[0x21:0x24] == b"\x01\x02\x03"
+    device.i2c_flush()
+    assert simulator.i2c.stats.transactions == 1
+
+    device.i2c_write_uint8_to(0x20, 9)
+    device.i2c_defer_writes(False)
+    assert simulator.i2c.stats.transactions == 2
+    assert model.registers[0x20] == 9
+    device.i2c_write_uint8_to(0x20, 8)
+    assert simulator.i2c.stats.transactions == 3
+
+
+def test_invalidated_cache_reads_device_again(simulator):
+    device, model = _cached_device(simulator)
+    device.i2c_write_uint8_to(0x20, 5)
+    model.registers[0x20] = 7
+    assert device.i2c_read_uint8_from(0x20) == 5
+    device.i2c_invalidate_cache()
+    assert not device.i2c_cached(0x20, 5)
+    assert device.i2c_read_uint8_from(0x20) == 7
+    # Writes of the value just read are skipped again.
+    transactions = simulator.i2c.stats.transactions
+    device.i2c_write_uint8_to(0x20, 7)
+    assert simulator.i2c.stats.transactions == transactions
+
+
+def _register_device(simulator):
+    import i2c_device
+
+    class Device(i2c_device.I2cDevice):
+        control = i2c_device.Register(0x10)
+        threshold = i2c_device.Register(0x12, ">h")
+        mode = i2c_device.Field(0x10, 0x0C)
+        enable = i2c_device.Field(0x10, 0x01)
+        gain = i2c_device.Field(0x14, 0x0FF0, "<H")
+
+    model = simulator.i2c.attach(0x50, hardware_simulator.RegisterModel())
+    return Device(simulator.i2c, 0x50), model
+
+
+def test_register_descriptors_read_and_write(simulator):
+    device, model = _register_device(simulator)
+    device.threshold = -2
+    assert model.registers[0x12:0x14] == b"\xff\xfe"
+    assert device.threshold == -2
+    model.registers[0x10] = 0xA5
+    assert device.control == 0xA5
+    assert type(device).control.address == 0x10
+
+
+def test_field_writes_keep_other_bits(simulator):
+    device, model = _register_device(simulator)
+    model.registers[0x10] = 0xF2
+    assert device.mode == 0
+    device.mode = 3
+    assert model.registers[0x10] == 0xFE
+    device.enable = 1
+    assert model.registers[0x10] == 0xFF
+    device.mode = 1
+    assert model.registers[0x10] == 0xF7
+    assert device.mode == 1
+    assert device.enable == 1
+    # Values wider than the field are masked off.
+    device.enable = 2
+    assert model.registers[0x10] == 0xF6
+
+    model.registers[0x14:0x16] = b"\x0f\xf0"
+    device.gain = 0xAB
+    assert model.registers[0x14:0x16] == b"\xbf\xfa"
+    assert device.gain == 0xAB
+
+
+def test_cached_field_write_reads_once(simulator):
+    device, model = _register_device(simulator)
+    device.i2c_cache_registers(0x10)
+    model.registers[0x10] = 0x80
+    simulator.i2c.stats.reset()
+    device.mode = 2
+    # A split register read fills the cache, then one write stores the
+    # new value.
+    assert simulator.i2c.stats.transactions == 3
+    device.enable = 1
+    assert simulator.i2c.stats.transactions == 4
+    assert model.registers[0x10] == 0x89
+    # Writing the field's current value again costs nothing.
+    device.mode = 2
+    assert simulator.i2c.stats.transactions == 4
+    assert type(device).control.cached(device, 0x89)
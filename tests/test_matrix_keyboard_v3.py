@@ -0,0 +1,321 @@
+import pytest
+
+import hardware_simulator
+
+
+def _keyboard(simulator, settle_ms=20):
+    import matrix_keyboard_v3
+
+    keypad = simulator.i2c.attach(
+        matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.KeypadModel(simulator.clock))
+    return matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c,
+                                               settle_ms=settle_ms), keypad
+
+
+def _run(simulator, keyboard, key, duration_ms, period_ms):
+    # Calls update() every period_ms and returns the (edge, ms) pairs seen
+    # for key, and how many times update() was called.
+    edges = []
+    calls = 0
+    for _ in range(duration_ms // period_ms):
+        keyboard.update()
+        calls += 1
+        now_ms = simulator.clock.now_us // 1000
+        if keyboard.pressed(key):
+            edges.append(("pressed", now_ms))
+        if keyboard.released(key):
+            edges.append(("released", now_ms))
+        simulator.clock.sleep_ms(period_ms)
+    return edges, calls
+
+
+def test_bouncing_key_reports_one_press(simulator):
+    keyboard, keypad = _keyboard(simulator)
+    # Both edges chatter every millisecond for 9 ms before settling.
+    keypad.press(keyboard.KEY_5, 100, 200, 1, 9)
+    edges, calls = _run(simulator, keyboard, keyboard.KEY_5, 500, 1)
+    assert [edge for edge, _ in edges] == ["pressed", "released"]
+    # Latency after the contacts settle is bounded by the settle time plus
+    # the sample interval of settle_ms / 4.
+    assert 109 + 20 <= edges[0][1] <= 109 + 20 + 2 * 5
+    assert 309 + 20 <= edges[1][1] <= 309 + 20 + 2 * 5
+    # At most one read per call, and reads are spaced by the sample
+    # interval rather than made on every call.
+    assert keypad.reads <= calls // 4 + 1
+
+
+@pytest.mark.parametrize("period_ms", (1, 5, 20, 25, 50, 100))
+def test_glitch_shorter_than_settle_time_is_ignored(simulator, period_ms):
+    keyboard, keypad = _keyboard(simulator)
+    # Every loop period samples the glitch; slow loops sample it only once
+    # and must not take the next sample, after settle_ms, as confirmation.
+    keypad.press(keyboard.KEY_5, 100, 8)
+    edges, _ = _run(simulator, keyboard, keyboard.KEY_5, 400, period_ms)
+    assert edges == []
+
+
+@pytest.mark.parametrize("period_ms", (5, 20, 50, 100))
+def test_press_seen_with_slow_update_loop(simulator, period_ms):
+    keyboard, keypad = _keyboard(simulator)
+    # A change is only confirmed by a later sample, so a press must span
+    # two loop periods.
+    keypad.press(keyboard.KEY_5, 125, max(150, 2 * period_ms), 1, 5)
+    edges, calls = _run(simulator, keyboard, keyboard.KEY_5, 600, period_ms)
+    assert [edge for edge, _ in edges] == ["pressed", "released"]
+    assert keypad.reads <= calls
+
+
+def test_chattering_key_does_not_stall_update(simulator):
+    keyboard, keypad = _keyboard(simulator)
+    # A key that never settles: update() still reads at most once.
+    for at_ms in range(0, 200, 2):
+        keypad.key_down(keyboard.KEY_5, at_ms)
+        keypad.key_up(keyboard.KEY_5, at_ms + 1)
+    edges, calls = _run(simulator, keyboard, keyboard.KEY_5, 200, 1)
+    assert edges == []
+    assert keypad.reads <= calls
+
+
+def _scan_events(simulator, keyboard, duration_ms, period_ms=10):
+    # Scans from the simulated timer and returns the queued events with
+    # their times in ms.
+    keyboard.start_scanning(period_ms)
+    simulator.clock.sleep_ms(duration_ms)
+    keyboard.stop_scanning()
+    events = []
+    event = keyboard.get_event()
+    while event is not None:
+        events.append(event)
+        event = keyboard.get_event()
+    return events
+
+
+def test_scanner_reports_long_press_and_repeats(simulator):
+    keyboard, keypad = _keyboard(simulator)
+    keyboard.set_long_press(800, 200)
+    keypad.press(keyboard.KEY_5, 100, 1300, 1, 5)
+    events = _scan_events(simulator, keyboard, 2000)
+    assert [(event, keys) for event, keys, _ in events] == [
+        (keyboard.EVENT_PRESSED, keyboard.KEY_5),
+        (keyboard.EVENT_LONG_PRESSED, keyboard.KEY_5),
+        (keyboard.EVENT_REPEATED, keyboard.KEY_5),
+        (keyboard.EVENT_REPEATED, keyboard.KEY_5),
+        (keyboard.EVENT_RELEASED, keyboard.KEY_5),
+    ]
+    times = [at_ms for _, _, at_ms in events]
+    assert 800 <= times[1] - times[0] <= 810
+    assert 200 <= times[2] - times[1] <= 210
+    assert 200 <= times[3] - times[2] <= 210
+    assert keyboard.events_dropped() == 0
+
+
+def test_scanner_without_long_press(simulator):
+    keyboard, keypad = _keyboard(simulator)
+    keyboard.set_long_press(0, 0)
+    keypad.press(keyboard.KEY_5, 100, 1300)
+    events = _scan_events(simulator, keyboard, 2000)
+    assert [event for event, _, _ in events] == [keyboard.EVENT_PRESSED,
+                                                 keyboard.EVENT_RELEASED]
+
+
+def test_scanner_reports_chords(simulator):
+    keyboard, keypad = _keyboard(simulator)
+    keypad.press(keyboard.KEY_1, 100, 300)
+    keypad.press(keyboard.KEY_2, 200, 100)
+    events = _scan_events(simulator, keyboard, 600)
+    assert [(event, keys) for event, keys, _ in events] == [
+        (keyboard.EVENT_PRESSED, keyboard.KEY_1),
+        (keyboard.EVENT_PRESSED, keyboard.KEY_2),
+        (keyboard.EVENT_CHORD, keyboard.KEY_1 | keyboard.KEY_2),
+        (keyboard.EVENT_RELEASED, keyboard.KEY_2),
+        (keyboard.EVENT_RELEASED, keyboard.KEY_1),
+    ]
+
+
+def test_scanner_counts_dropped_events(simulator):
+    import matrix_keyboard_v3
+
+    keypad = simulator.i2c.attach(
+        matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.KeypadModel(simulator.clock))
+    keyboard = matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c,
+                                                   event_queue_size=4)
+    for at_ms in range(100, 1000, 100):
+        keypad.press(keyboard.KEY_5, at_ms, 50)
+    events = _scan_events(simulator, keyboard, 1100)
+    # One slot of the ring buffer stays free to tell full from empty.
+    assert len(events) == 3
+    assert events[0][0] == keyboard.EVENT_PRESSED
+    assert keyboard.events_dropped() == 18 - 3
+
+
+def test_mask_queries_report_edges_and_held_keys(simulator):
+    keyboard, keypad = _keyboard(simulator, settle_ms=0)
+    both = keyboard.KEY_1 | keyboard.KEY_2
+    keypad.key_down(keyboard.KEY_1, 10)
+    keypad.key_down(keyboard.KEY_2, 10)
+    keypad.key_up(keyboard.KEY_2, 30)
+    keypad.key_up(keyboard.KEY_1, 40)
+    seen = []
+    for _ in range(5):
+        keyboard.update()
+        seen.append((keyboard.pressed_keys(), keyboard.held_keys(),
+                     keyboard.released_keys(), keyboard.key_states()))
+        simulator.clock.sleep_ms(10)
+    assert seen == [
+        (0, 0, 0, 0),
+        (both, 0, 0, both),
+        (0, both, 0, both),
+        (0, keyboard.KEY_1, keyboard.KEY_2, keyboard.KEY_1),
+        (0, 0, keyboard.KEY_1, 0),
+    ]
+
+
+def test_keys_and_chars_follow_physical_layout(simulator):
+    keyboard, _ = _keyboard(simulator)
+    assert "".join(keyboard.chars(0xFFFF)) == "123A456B789C*0#D"
+    assert list(keyboard.keys(0xFFFF)) == [
+        keyboard.KEY_1, keyboard.KEY_2, keyboard.KEY_3, keyboard.KEY_A,
+        keyboard.KEY_4, keyboard.KEY_5, keyboard.KEY_6, keyboard.KEY_B,
+        keyboard.KEY_7, keyboard.KEY_8, keyboard.KEY_9, keyboard.KEY_C,
+        keyboard.KEY_ASTERISK, keyboard.KEY_0, keyboard.KEY_NUMBER_SIGN,
+        keyboard.KEY_D,
+    ]
+    for char in "0123456789ABCD":
+        assert list(keyboard.chars(getattr(keyboard, "KEY_" + char))) == [
+            char]
+    assert list(keyboard.chars(keyboard.KEY_ASTERISK)) == ["*"]
+    assert list(keyboard.chars(keyboard.KEY_NUMBER_SIGN)) == ["#"]
+    assert "".join(keyboard.chars(keyboard.KEY_D | keyboard.KEY_5)) == "5D"
+    assert list(keyboard.keys(0)) == []
+
+
+def _group_events(group):
+    events = []
+    event = group.get_event()
+    while event is not None:
+        events.append(event[:3])
+        event = group.get_event()
+    return events
+
+
+def _muxed_keypads(simulator, count):
+    import matrix_keyboard_v3
+
+    address = matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS
+    mux = simulator.i2c.attach(0x70, hardware_simulator.Tca9548Model())
+    keypads = [mux.attach(channel, address,
+                          hardware_simulator.KeypadModel(simulator.clock))
+               for channel in range(count)]
+    keyboards = [matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c)
+                 for _ in range(count)]
+    return mux, keypads, keyboards
+
+
+def test_group_scans_keypads_behind_mux(simulator):
+    import matrix_keyboard_v3
+
+    mux, keypads, keyboards = _muxed_keypads(simulator, 2)
+    group = matrix_keyboard_v3.MatrixKeyboardGroup(keyboards, (0, 1))
+    keypads[1].press(keyboards[1].KEY_5, 50, 100)
+    keypads[0].press(keyboards[0].KEY_A, 250, 100)
+    group.start_scanning(10)
+    simulator.clock.sleep_ms(500)
+    group.stop_scanning()
+    assert _group_events(group) == [
+        (1, keyboards[1].EVENT_PRESSED, keyboards[1].KEY_5),
+        (1, keyboards[1].EVENT_RELEASED, keyboards[1].KEY_5),
+        (0, keyboards[0].EVENT_PRESSED, keyboards[0].KEY_A),
+        (0, keyboards[0].EVENT_RELEASED, keyboards[0].KEY_A),
+    ]
+    # The period is split between the keypads, so each is still sampled
+    # every 10 ms.
+    assert 49 <= keypads[0].reads <= 51
+    assert 49 <= keypads[1].reads <= 51
+    assert mux.selects == keypads[0].reads + keypads[1].reads
+    assert group.events_dropped() == 0
+
+
+def test_group_selects_channel_only_when_it_changes(simulator):
+    import matrix_keyboard_v3
+
+    mux = simulator.i2c.attach(0x70, hardware_simulator.Tca9548Model())
+    keypads = [mux.attach(2, address,
+                          hardware_simulator.KeypadModel(simulator.clock))
+               for address in (0x65, 0x66)]
+    keyboards = [matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c, address)
+                 for address in (0x65, 0x66)]
+    group = matrix_keyboard_v3.MatrixKeyboardGroup(keyboards, (2, 2))
+    for _ in range(10):
+        group.scan()
+        simulator.clock.sleep_ms(5)
+    assert mux.selects == 1
+    assert mux.channels == 1 << 2
+    assert keypads[0].reads == 5
+    assert keypads[1].reads == 5
+
+
+def test_group_without_mux(simulator):
+    import matrix_keyboard_v3
+
+    keypads = [simulator.i2c.attach(
+        address, hardware_simulator.KeypadModel(simulator.clock))
+        for address in (0x65, 0x66)]
+    keyboards = [matrix_keyboard_v3.MatrixKeyboardV3(simulator.i2c, address)
+                 for address in (0x65, 0x66)]
+    group = matrix_keyboard_v3.MatrixKeyboardGroup(keyboards)
+    keypads[1].press(keyboards[1].KEY_1, 20, 100)
+    for _ in range(100):
+        group.scan()
+        simulator.clock.sleep_ms(5)
+    assert _group_events(group) == [
+        (1, keyboards[1].EVENT_PRESSED, keyboards[1].KEY_1),
+        (1, keyboards[1].EVENT_RELEASED, keyboards[1].KEY_1),
+    ]
+
+
+def test_group_rejects_bad_configuration(simulator):
+    import matrix_keyboard_v3
+
+    _, _, keyboards = _muxed_keypads(simulator, 2)
+    with pytest.raises(ValueError):
+        matrix_keyboard_v3.MatrixKeyboardGroup([])
+    with pytest.raises(ValueError):
+        matrix_keyboard_v3.MatrixKeyboardGroup(keyboards, (0,))
+
+
+def test_group_holds_bus_across_select_and_read(simulator):
+    import i2c_bus
+    import matrix_keyboard_v3
+
+    log = []
+
+    class _RecordingBus(i2c_bus.I2cBus):
+
+        def __enter__(self):
+            log.append("lock")
+            return super().__enter__()
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            log.append("unlock")
+            return super().__exit__(exc_type, exc_value, traceback)
+
+        def writeto(self, address, buffer, stop=True):
+            log.append(("write", address))
+            return super().writeto(address, buffer, stop)
+
+        def readfrom_into(self, address, buffer, stop=True):
+            log.append(("read", address))
+            return super().readfrom_into(address, buffer, stop)
+
+    address = matrix_keyboard_v3.MatrixKeyboardV3.DEFAULT_I2C_ADDRESS
+    mux = simulator.i2c.attach(0x70, hardware_simulator.Tca9548Model())
+    mux.attach(3, address, hardware_simulator.KeypadModel(simulator.clock))
+    bus = _RecordingBus(simulator.i2c)
+    keyboard = matrix_keyboard_v3.MatrixKeyboardV3(bus)
+    group = matrix_keyboard_v3.MatrixKeyboardGroup([keyboard], (3,))
+    del log[:]
+    group.scan()
+    assert log == ["lock", ("write", 0x70), ("read", address), "unlock"]
+    assert not bus.locked()
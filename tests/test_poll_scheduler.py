@@ -0,0 +1,77 @@
+import pytest
+
+
+def _run_for(simulator, scheduler, duration_ms):
+    end_us = simulator.clock.now_us + duration_ms * 1000
+    while simulator.clock.now_us < end_us:
+        delay = scheduler.run_once()
+        simulator.clock.sleep_ms(delay if delay else 1)
+
+
+def test_register_rejects_invalid_budgets(simulator):
+    import poll_scheduler
+
+    scheduler = poll_scheduler.PollScheduler()
+    for period_ms, budget_ms in ((0, 1), (10, 0), (10, 11)):
+        with pytest.raises(ValueError):
+            scheduler.register(lambda: None, period_ms, budget_ms)
+    task = scheduler.register(lambda: None, 10, 6)
+    # 6/10 + 5/10 would leave no time for the deadlines to be met.
+    with pytest.raises(ValueError):
+        scheduler.register(lambda: None, 10, 5)
+    scheduler.unregister(task)
+    scheduler.register(lambda: None, 10, 5)
+
+
+def test_earliest_deadline_runs_first(simulator):
+    import poll_scheduler
+
+    scheduler = poll_scheduler.PollScheduler()
+    order = []
+    scheduler.register(lambda: order.append("slow"), 20, 2)
+    scheduler.register(lambda: order.append("fast"), 5, 1)
+    assert scheduler.run_once() == 5
+    assert order == ["fast", "slow"]
+    assert scheduler.run_once() == 5
+    assert order == ["fast", "slow"]
+    simulator.clock.sleep_ms(5)
+    scheduler.run_once()
+    assert order == ["fast", "slow", "fast"]
+
+
+def test_tasks_run_once_per_period(simulator):
+    import poll_scheduler
+
+    scheduler = poll_scheduler.PollScheduler()
+    scheduler.register(lambda: None, 10, 2, "keypad")
+    scheduler.register(lambda: None, 25, 2, "player")
+    _run_for(simulator, scheduler, 100)
+    assert [(name, runs, missed, overruns)
+            for name, runs, missed, overruns, _, _ in scheduler.stats()] == [
+        ("keypad", 10, 0, 0),
+        ("player", 4, 0, 0),
+    ]
+    scheduler.reset_stats()
+    assert scheduler.stats()[0][1:] == (0, 0, 0, 0, 0)
+
+
+def test_overruns_and_missed_deadlines_are_counted(simulator):
+    import poll_scheduler
+
+    scheduler = poll_scheduler.PollScheduler()
+    durations = [1, 3, 35, 1, 1]
+
+    def poll():
+        simulator.clock.sleep_ms(durations.pop(0) if durations else 1)
+
+    scheduler.register(poll, 10, 2, "slow")
+    _run_for(simulator, scheduler, 100)
+    _, runs, missed, overruns, busy_us, max_us = scheduler.stats()[0]
+    assert overruns == 2
+    assert max_us == 35000
+    # The 35 ms poll, released at 20 ms, missed its deadline at 30 ms and
+    # overlapped two more periods. Those are skipped rather than run back
+    # to back, so the next poll is the one released at 50 ms.
+    assert missed == 3
+    assert runs == 8
+    assert busy_us == (1 + 3 + 35 + 5) * 1000
@@ -0,0 +1,192 @@
+import asyncio
+import os
+
+import pytest
+
+import hardware_simulator
+
+
+def _recognizer(simulator, model=None):
+    import speech_recognizer
+
+    if model is None:
+        model = simulator.i2c.attach(
+            speech_recognizer.SpeechRecognizer.DEFAULT_I2C_ADDRESS,
+            hardware_simulator.SpeechRecognizerModel(simulator.clock))
+    return speech_recognizer.SpeechRecognizer(simulator.i2c), model
+
+
+def test_load_keywords_uploads_only_changes(simulator):
+    recognizer, model = _recognizer(simulator)
+    table = {0: "kai deng", 1: "guan deng"}
+    assert recognizer.load_keywords(table)[:2] == (2, 0)
+    table[1] = "da kai"
+    assert recognizer.load_keywords(table)[:2] == (1, 1)
+    assert model.keywords == {0: b"kai deng", 1: b"da kai"}
+
+
+def test_load_keywords_sees_add_keyword(simulator):
+    recognizer, model = _recognizer(simulator)
+    recognizer.load_keywords({0: "bar"})
+    recognizer.add_keyword(0, "baz")
+    assert recognizer.load_keywords({0: "bar"})[:2] == (1, 0)
+    assert model.keywords == {0: b"bar"}
+
+
+def test_load_keywords_after_reset(simulator):
+    recognizer, model = _recognizer(simulator)
+    recognizer.load_keywords({0: "bar", 1: "baz"})
+    recognizer.reset()
+    assert model.keywords == {}
+    assert recognizer.load_keywords({0: "bar", 1: "baz"})[:2] == (2, 0)
+    assert model.keywords == {0: b"bar", 1: b"baz"}
+
+
+def test_keyword_cache_across_boots(simulator, tmp_path):
+    cache_path = str(tmp_path / "keywords")
+    table = {0: "bar", 1: "baz"}
+    recognizer, model = _recognizer(simulator)
+    assert recognizer.load_keywords(table, cache_path)[:2] == (2, 0)
+    assert os.path.exists(cache_path)
+
+    # A driver that resets the module cannot trust the cache.
+    recognizer, _ = _recognizer(simulator, model)
+    assert recognizer.load_keywords(table, cache_path)[:2] == (2, 0)
+    assert model.keywords == {0: b"bar", 1: b"baz"}
+
+    # One that adopts the module as it is skips what the cache recorded.
+    recognizer, _ = _recognizer(simulator, model)
+    recognizer.begin(reset=False)
+    assert recognizer.load_keywords(table, cache_path)[:2] == (0, 2)
+    assert model.keywords == {0: b"bar", 1: b"baz"}
+
+    # Writes that bypass load_keywords() leave no stale cache behind.
+    recognizer.add_keyword(1, "qux")
+    assert not os.path.exists(cache_path)
+    recognizer.reset()
+    recognizer, _ = _recognizer(simulator, model)
+    recognizer.begin(reset=False)
+    assert recognizer.load_keywords(table, cache_path)[:2] == (2, 0)
+    assert model.keywords == {0: b"bar", 1: b"baz"}
+
+
+def test_failed_first_reset_is_retried(simulator):
+    import speech_recognizer
+
+    recognizer = speech_recognizer.SpeechRecognizer(simulator.i2c)
+    with pytest.raises(OSError):
+        recognizer.add_keyword(0, "bar")
+    model = simulator.i2c.attach(
+        speech_recognizer.SpeechRecognizer.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.SpeechRecognizerModel(simulator.clock))
+    model.keywords[1] = b"stale"
+    recognizer.add_keyword(0, "bar")
+    assert model.keywords == {0: b"bar"}
+
+
+def test_failed_first_reset_is_retried_async(simulator):
+    import speech_recognizer
+
+    recognizer = speech_recognizer.SpeechRecognizer(simulator.i2c)
+    with pytest.raises(OSError):
+        asyncio.run(recognizer.set_timeout_async(1000))
+    model = simulator.i2c.attach(
+        speech_recognizer.SpeechRecognizer.DEFAULT_I2C_ADDRESS,
+        hardware_simulator.SpeechRecognizerModel(simulator.clock))
+    model.keywords[1] = b"stale"
+    asyncio.run(recognizer.add_keyword_async(0, "bar"))
+    assert model.keywords == {0: b"bar"}
+
+
+def test_recognize_returns_result_of_this_recognition(simulator):
+    recognizer, model = _recognizer(simulator)
+    model.script_recognition(7)
+    model.script_recognition(9, 300)
+    assert recognizer.recognize() == 7
+    assert recognizer.recognize() == 9
+    assert recognizer.recognize() == -1
+
+
+def test_recognize_async_returns_result_of_this_recognition(simulator):
+    recognizer, model = _recognizer(simulator)
+    model.script_recognition(7)
+    model.script_recognition(9, 300)
+    assert asyncio.run(recognizer.recognize_async()) == 7
+    assert asyncio.run(recognizer.recognize_async()) == 9
+    assert asyncio.run(recognizer.recognize_async()) == -1
+
+
+def test_poll_event_dispatches_callbacks(simulator):
+    recognizer, model = _recognizer(simulator)
+    calls = []
+    recognizer.on_event(recognizer.EVENT_SPEECH_RECOGNIZED,
+                        lambda event, result: calls.append((event, result)))
+    simulator.i2c.stats.reset()
+    assert recognizer.poll_event() == recognizer.EVENT_NONE
+    # RESULT and EVENT are read as one register burst.
+    assert simulator.i2c.stats.transactions == 2
+    assert calls == []
+
+    model.push_event(model.EVENT_SPEECH_RECOGNIZED, 3)
+    assert recognizer.poll_event() == recognizer.EVENT_SPEECH_RECOGNIZED
+    assert recognizer.event_result() == 3
+    assert calls == [(recognizer.EVENT_SPEECH_RECOGNIZED, 3)]
+
+    model.push_event(model.EVENT_SPEECH_RECOGNITION_TIMED_OUT, -1)
+    assert (recognizer.poll_event() ==
+            recognizer.EVENT_SPEECH_RECOGNITION_TIMED_OUT)
+    assert recognizer.event_result() == -1
+    assert len(calls) == 1
+
+    recognizer.on_event(recognizer.EVENT_SPEECH_RECOGNIZED, None)
+    model.push_event(model.EVENT_SPEECH_RECOGNIZED, 4)
+    assert recognizer.poll_event() == recognizer.EVENT_SPEECH_RECOGNIZED
+    assert len(calls) == 1
+
+
+def _start_recognition(simulator, model, result, duration_ms):
+    # Starts a recognition as the trigger button would, and returns when
+    # its result will be ready. The START_RECOGNIZING event is consumed.
+    model.script_recognition(result, duration_ms)
+    model.write_register(model.RECOGNIZE, 1)
+    model.read_register(model.EVENT)
+    return simulator.clock.now_us + duration_ms * 1000
+
+
+def test_events_poll_faster_while_recognizing(simulator):
+    recognizer, model = _recognizer(simulator)
+    recognizer.set_event_poll_intervals(100, 10)
+    events = recognizer.events()
+
+    # Idle: EVENT is polled once per idle interval.
+    done_us = _start_recognition(simulator, model, 3, 250)
+    simulator.i2c.stats.reset()
+    assert next(events) == (recognizer.EVENT_SPEECH_RECOGNIZED, 3)
+    assert done_us <= simulator.clock.now_us <= done_us + 100000
+    assert simulator.i2c.stats.transactions == 2 * 4
+
+    # After a trigger: the result is seen within the active interval.
+    model.push_event(model.EVENT_START_RECOGNIZING)
+    assert next(events)[0] == recognizer.EVENT_START_RECOGNIZING
+    done_us = _start_recognition(simulator, model, 4, 500)
+    assert next(events) == (recognizer.EVENT_SPEECH_RECOGNIZED, 4)
+    assert done_us <= simulator.clock.now_us <= done_us + 10000
+
+
+def test_events_async_yields_events(simulator):
+    recognizer, model = _recognizer(simulator)
+    recognizer.set_event_poll_intervals(50, 5)
+    model.push_event(model.EVENT_SPEECH_RECOGNIZED, 2)
+
+    async def collect():
+        received = []
+        async for event in recognizer.events_async():
+            received.append(event)
+            if len(received) == 2:
+                return received
+            model.push_event(model.EVENT_SPEECH_RECOGNITION_TIMED_OUT, -1)
+
+    assert asyncio.run(collect()) == [
+        (recognizer.EVENT_SPEECH_RECOGNIZED, 2),
+        (recognizer.EVENT_SPEECH_RECOGNITION_TIMED_OUT, -1),
+    ]
@@ -0,0 +1,139 @@
+import array
+import sys
+import time
+
+try:
+    from micropython import const
+except ImportError:
+
+    def const(x):
+        return x
+
+
+_KIND_COUNT = const(4)
+_CODE_COUNT = const(256)
+_BUCKET_COUNT = const(16)
+_DATA_BYTES = const(8)
+_NO_ADDRESS = const(0xFF)
+
+KIND_NAMES = ("i2c_write", "i2c_read", "uart_command", "uart_response")
+
+
+class TransactionTrace:
+
+    def __init__(self, size=32) -> None:
+        self._size = size
+        # Counters, histograms and the trace log live in fixed arrays so
+        # recording a transaction never allocates.
+        self._counts = array.array("L", [0] * (_KIND_COUNT * _CODE_COUNT))
+        self._totals = array.array("L", [0] * _KIND_COUNT)
+        self._errors = array.array("L", [0] * _KIND_COUNT)
+        self._histograms = array.array("L",
+                                       [0] * (_KIND_COUNT * _BUCKET_COUNT))
+        self._log_times = array.array("l", [0] * size)
+        self._log_kinds = bytearray(size)
+        self._log_addresses = bytearray(size)
+        self._log_codes = array.array("h", [0] * size)
+        self._log_lengths = array.array("H", [0] * size)
+        self._log_elapsed = array.array("L", [0] * size)
+        self._log_errors = bytearray(size)
+        self._log_data = bytearray(size * _DATA_BYTES)
+        self._log_head = 0
+        self._log_count = 0
+
+    def __call__(self, kind, address, code, data, elapsed_us, error) -> None:
+        if code >= 0:
+            self._counts[kind * _CODE_COUNT + code] += 1
+        self._totals[kind] += 1
+        if error is not None:
+            self._errors[kind] += 1
+        # Bucket n holds latencies in [2**n, 2**(n + 1)) microseconds.
+        bucket = 0
+        value = elapsed_us
+        while value > 1 and bucket < _BUCKET_COUNT - 1:
+            value >>= 1
+            bucket += 1
+        self._histograms[kind * _BUCKET_COUNT + bucket] += 1
+
+        index = self._log_head
+        self._log_head = index + 1 if index + 1 < self._size else 0
+        if self._log_count < self._size:
+            self._log_count += 1
+        self._log_times[index] = time.ticks_ms()
+        self._log_kinds[index] = kind
+        self._log_addresses[index] = (_NO_ADDRESS
+                                      if address is None else address)
+        self._log_codes[index] = code
+        length = len(data)
+        self._log_lengths[index] = length
+        self._log_elapsed[index] = elapsed_us
+        self._log_errors[index] = error is not None
+        offset = index * _DATA_BYTES
+        for i in range(length if length < _DATA_BYTES else _DATA_BYTES):
+            self._log_data[offset + i] = data[i]
+
+    def reset(self) -> None:
+        for counters in (self._counts, self._totals, self._errors,
+                         self._histograms):
+            for i in range(len(counters)):
+                counters[i] = 0
+        self._log_head = 0
+        self._log_count = 0
+
+    def count(self, kind, code) -> int:
+        return self._counts[kind * _CODE_COUNT + code]
+
+    def total(self, kind) -> int:
+        return self._totals[kind]
+
+    def errors(self, kind) -> int:
+        return self._errors[kind]
+
+    def histogram(self, kind) -> tuple:
+        start = kind * _BUCKET_COUNT
+        return tuple(self._histograms[start:start + _BUCKET_COUNT])
+
+    def entries(self) -> list:
+        entries = []
+        index = self._log_head - self._log_count
+        if index < 0:
+            index += self._size
+        for _ in range(self._log_count):
+            address = self._log_addresses[index]
+            length = self._log_lengths[index]
+            offset = index * _DATA_BYTES
+            entries.append(
+                (self._log_times[index], self._log_kinds[index],
+                 None if address == _NO_ADDRESS else address,
+                 self._log_codes[index],
+                 bytes(self._log_data[offset:offset +
+                                      min(length, _DATA_BYTES)]), length,
+                 self._log_elapsed[index], bool(self._log_errors[index])))
+            index = index + 1 if index + 1 < self._size else 0
+        return entries
+
+    def dump(self, file=sys.stdout) -> None:
+        for kind in range(_KIND_COUNT):
+            if self._totals[kind] == 0:
+                continue
+            file.write("%s: %d transactions, %d errors\n" %
+                       (KIND_NAMES[kind], self._totals[kind],
+                        self._errors[kind]))
+            start = kind * _CODE_COUNT
+            for code in range(_CODE_COUNT):
+                if self._counts[start + code]:
+                    file.write("  0x%02x: %d\n" %
+                               (code, self._counts[start + code]))
+            histogram = self.histogram(kind)
+            for bucket in range(_BUCKET_COUNT):
+                if histogram[bucket]:
+                    file.write("  <%dus: %d\n" %
+                               (1 << (bucket + 1), histogram[bucket]))
+        for (ticks, kind, address, code, data, length, elapsed_us,
+             error) in self.entries():
+            file.write("%d %s %s %s [%d] %s %dus%s\n" %
+                       (ticks, KIND_NAMES[kind],
+                        "-" if address is None else "0x%02x" % address,
+                        "-" if code < 0 else "0x%02x" % code, length,
+                        " ".join("%02x" % byte for byte in data), elapsed_us,
+                        " error" if error else ""))